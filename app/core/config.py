@@ -82,6 +82,76 @@ class Settings(BaseSettings):
     FIRST_SUPERUSER_EMAIL: EmailStr
     FIRST_SUPERUSER_PASSWORD: str
 
+    XHS_NODE_PATH: str = "node"
+    XHS_WEB_SIGNER: str = "node"
+    XHS_CREATOR_SIGNER: str = "python"
+    XHS_SIGNER_POOL_SIZE: int = 2
+
+    @validator("XHS_WEB_SIGNER")
+    def check_web_signer(cls, v: str) -> str:
+        # 网页端签名依赖 jsdom，只能在 node 中计算
+        if v != "node":
+            raise ValueError(f"XHS_WEB_SIGNER must be 'node', got {v!r}")
+        return v
+
+    @validator("XHS_CREATOR_SIGNER")
+    def check_creator_signer(cls, v: str) -> str:
+        if v not in ("python", "node"):
+            raise ValueError(f"XHS_CREATOR_SIGNER must be 'python' or 'node', got {v!r}")
+        return v
+
+    XHS_XRAY_POOL_SIZE: int = 1
+    XHS_SIGNER_MAX_CALLS: int = 10000
+    XHS_SIGNER_TIMEOUT: float = 10
+    XHS_XRAY_BUFFER_SIZE: int = 512
+    XHS_XRAY_BATCH_SIZE: int = 256
+    XHS_XRAY_MAX_AGE: int = 60
+    XHS_HTTP_TIMEOUT: float = 15
+    XHS_HTTP_CONNECT_TIMEOUT: float = 5
+    XHS_HTTP_MAX_CONNECTIONS: int = 20
+    XHS_HTTP2: bool = True
+    XHS_RATE_LIMIT_BACKEND: str = "redis"
+    XHS_RATE_LIMIT: float = 5
+    XHS_RATE_LIMITS: dict[str, float] = {
+        "search": 1,
+        "comment": 3,
+        "sub_comment": 3,
+        "feed": 2,
+    }
+    XHS_RATE_LIMIT_BURST: int = 10
+    XHS_SUB_COMMENT_CONCURRENCY: int = 4
+    XHS_SEARCH_COMMENT_WORKERS: int = 3
+    XHS_SEARCH_QUEUE_SIZE: int = 10
+    XHS_RETRY_ATTEMPTS: int = 3
+    XHS_RETRY_BASE_DELAY: float = 0.5
+    XHS_RETRY_MAX_DELAY: float = 8
+    XHS_BREAKER_FAILURES: int = 5
+    XHS_BREAKER_RESET_TIMEOUT: float = 30
+    XHS_JOB_TIMEOUT: int = 3600
+    XHS_JOB_TTL: int = 86400
+    XHS_PERSIST: bool = True
+    XHS_DB_BATCH_SIZE: int = 500
+    XHS_MONITOR_CRON: str = "* * * * *"
+    XHS_MONITOR_BATCH_SIZE: int = 500
+    XHS_MONITOR_MIN_INTERVAL: float = 60
+    XHS_MONITOR_MAX_INTERVAL: float = 86400
+    XHS_MONITOR_BACKOFF: float = 2
+    XHS_MONITOR_TARGET_COMMENTS: float = 20
+    XHS_MONITOR_LEASE: int = 600
+    XHS_CACHE_ENABLED: bool = True
+    XHS_CACHE_TTLS: dict[str, float] = {
+        "note": 60,
+        "search": 300,
+    }
+    XHS_CACHE_STALE: float = 300
+    XHS_SINGLE_FLIGHT_BACKEND: str = "redis"
+    XHS_SINGLE_FLIGHT_TIMEOUT: float = 30
+    XHS_TIMEZONE: str = "Asia/Shanghai"
+    XHS_EXPORT_DIR: str = "exports"
+    XHS_EXPORT_ROW_GROUP_SIZE: int = 100000
+    XHS_EXPORT_COMPRESSION: str = "zstd"
+    XHS_EXPORT_CSV_CHUNK_SIZE: int = 1000
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,27 @@
+import asyncio
+from typing import Optional
+
+from redis import asyncio as aioredis
+
+from app.core.config import settings
+
+_client: Optional[aioredis.Redis] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_redis() -> aioredis.Redis:
+    """Shared Redis client for the running event loop."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client_loop is not loop:
+        _client = aioredis.Redis.from_url(settings.REDIS_URL)
+        _client_loop = loop
+    return _client
+
+
+async def close_redis() -> None:
+    global _client, _client_loop
+    if _client is not None:
+        await _client.close()
+    _client = None
+    _client_loop = None
@@ -8,7 +8,7 @@ TORTOISE_ORM = {
     "connections": {"default": settings.DATABASE_URI},
     "apps": {
         "models": {
-            "models": ["app.users.models", "aerich.models"],
+            "models": ["app.users.models", "app.xhs.models", "aerich.models"],
             "default_connection": "default",
         },
     },
@@ -1,6 +1,16 @@
+from app.core.redis import close_redis
 from app.initial_data import create_superuser
+from app.xhs.client import close_session
+from app.xhs.xhs_utils.xhs_util import xray_traceids
 
 
 
 async def startup() -> None:
     await create_superuser()
+    if xray_traceids is not None:
+        xray_traceids.warm()
+
+
+async def shutdown() -> None:
+    await close_session()
+    await close_redis()
@@ -10,7 +10,7 @@ from .core.auth import get_auth_router
 from .core.config import settings, Environment
 from .db.config import register_db
 from .health import router as health_check_router
-from .lifetime import startup
+from .lifetime import shutdown, startup
 from .users.routes import router as users_router
 from .xhs.routes import router as xhs_router
 
@@ -44,6 +44,7 @@ def get_application() -> FastAPI:
     
     register_db(_app)
     _app.on_event("startup")(startup)
+    _app.on_event("shutdown")(shutdown)
 
     return _app
 
@@ -1,9 +1,12 @@
-from saq import Queue
+from saq import CronJob, Queue
 from pydantic.utils import import_string
 from tortoise import Tortoise
 
 
 from .core.config import settings
+from .core.redis import close_redis
+from .xhs.client import close_session
+from .xhs.records import dumps
 from .db.config import TORTOISE_ORM
 
 
@@ -11,8 +14,17 @@ from .db.config import TORTOISE_ORM
 BACKGROUND_FUNCTIONS = [
     "app.users.tasks.log_user_email",
     "app.services.email.send_email_task",
+    "app.xhs.tasks.xhs_batch_comments",
+    "app.xhs.tasks.xhs_batch_search",
+    "app.xhs.tasks.xhs_batch_comment_item",
+    "app.xhs.tasks.xhs_batch_search_item",
+    "app.xhs.tasks.xhs_monitor_poll",
+    "app.xhs.tasks.xhs_export_parquet",
 ]
 FUNCTIONS = [import_string(bg_func) for bg_func in BACKGROUND_FUNCTIONS]
+CRON_JOBS = [
+    CronJob(import_string("app.xhs.tasks.xhs_monitor_tick"), cron=settings.XHS_MONITOR_CRON),
+]
 
 
 async def startup(_: dict):
@@ -28,13 +40,17 @@ async def shutdown(_: dict):
     Pops the bind on the db object.
     """
     await Tortoise.close_connections()
+    await close_session()
+    await close_redis()
 
 
-queue = Queue.from_url(settings.REDIS_URL)
+# 任务结果中的评论记录由 orjson 直接编码
+queue = Queue.from_url(settings.REDIS_URL, dump=dumps)
 
 settings = {
     "queue": queue,
     "functions": FUNCTIONS,
+    "cron_jobs": CRON_JOBS,
     "concurrency": 10,
     "startup": startup,
     "shutdown": shutdown,
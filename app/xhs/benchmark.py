@@ -0,0 +1,157 @@
+"""评论记录、响应编码和签名后端的微基准
+
+``records``（默认）对比规范化评论的两种方式：每条评论一个 dict、经 ``ApiResponse`` 校验和 jsonable_encoder
+后用 json 编码（原来的路径），与 ``CommentRecord`` 直接用 orjson 编码（``api_response`` 的路径）；
+``signers`` 对比创作者平台签名的 Python 实现与 node 进程池的单次耗时::
+
+    python -m app.xhs.benchmark --count 100000
+    python -m app.xhs.benchmark signers --count 1000
+"""
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from .routes import api_response
+from .schemas import ApiResponse
+from .xhs_api import format_comment
+from .xhs_utils.xhs_util import get_signer
+
+
+def _raw_comments(count: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            'id': f'{i:024x}',
+            'content': f'评论内容 {i}',
+            'like_count': str(i % 100),
+            'create_time': 1700000000000 + i,
+            'ip_location': '上海',
+            'user_info': {'nickname': f'用户{i % 1000}'},
+            'target_comment': {'id': f'{i - 1:024x}'} if i % 3 else None,
+        }
+        for i in range(count)
+    ]
+
+
+def _format_dict(note_id: str, comment: Dict[str, Any], root_comment_id: str = None) -> Dict[str, Any]:
+    """原来每条评论构造一个 dict 的写法，作为对照
+
+    与 ``format_comment`` 做同样的工作：note_time 留空，不在构造时格式化时间，
+    两者的差别只来自记录的表示方式和编码方式。
+    """
+    create_time = comment.get('create_time')
+    parent_comment_id = None
+    if root_comment_id:
+        parent_comment_id = (comment.get('target_comment') or {}).get('id') or root_comment_id
+    return {
+        'note_id': note_id,
+        'content': comment.get('content', ''),
+        'like_count': comment.get('like_count', 0),
+        'nickname': (comment.get('user_info') or {}).get('nickname', ''),
+        'comment_id': comment.get('id', ''),
+        'root_comment_id': root_comment_id,
+        'parent_comment_id': parent_comment_id,
+        'comment_location': comment.get('ip_location', ''),
+        'create_time': int(float(create_time)) if create_time else None,
+        'note_time': None
+    }
+
+
+def _measure(fn: Callable[[], Any], repeat: int) -> Tuple[float, Any]:
+    """取 repeat 次中最快的一次，每次之前先回收上一次的结果"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        result = None
+        gc.collect()
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def _memory(fn: Callable[[], Any]) -> int:
+    tracemalloc.start()
+    result = fn()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def run(count: int, repeat: int = 3) -> Dict[str, Dict[str, float]]:
+    """运行基准，返回两种方式的构造耗时、编码耗时（秒）和记录占用的内存（字节）"""
+    raw = _raw_comments(count)
+    root = 'f' * 24
+
+    def dict_path() -> bytes:
+        comments = [_format_dict('note', comment, root) for comment in raw]
+        response = ApiResponse(success=True, message='ok', data=comments)
+        return json.dumps(jsonable_encoder(response), ensure_ascii=False).encode('utf-8')
+
+    def record_path() -> bytes:
+        comments = [format_comment('note', comment, root) for comment in raw]
+        return api_response('ok', comments).body
+
+    results = {}
+    for name, build, encode in (
+        ('dict', lambda: [_format_dict('note', comment, root) for comment in raw], dict_path),
+        ('record', lambda: [format_comment('note', comment, root) for comment in raw], record_path),
+    ):
+        build_time, _ = _measure(build, repeat)
+        total_time, body = _measure(encode, repeat)
+        results[name] = {
+            'build': build_time,
+            'build_and_encode': total_time,
+            'memory': _memory(build),
+            'bytes': len(body),
+        }
+    return results
+
+
+def run_signers(count: int, repeat: int = 3) -> Dict[str, float]:
+    """运行签名基准，返回各签名后端的单次耗时（秒），不可用的后端跳过"""
+    api, data = "/api/sns/web/v1/feed", {"source_note_id": "64f8a1b2000000001e00c123"}
+    results = {}
+    for backend in ('python', 'node'):
+        try:
+            signer = get_signer(backend, 'creator')
+        except Exception as e:
+            print(f"{backend:>6}: 不可用（{e}）")  # noqa: T201
+            continue
+        # 第一次调用包含进程启动
+        signer.get_xs(api, data, "test_a1")
+        elapsed, _ = _measure(lambda signer=signer: [signer.get_xs(api, data, "test_a1") for _ in range(count)], repeat)
+        results[backend] = elapsed / count
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('target', nargs='?', choices=('records', 'signers'), default='records', help='基准项目')
+    parser.add_argument('--count', type=int, default=None, help='评论数量（默认 100000）或签名次数（默认 1000）')
+    parser.add_argument('--repeat', type=int, default=3, help='重复次数，取最快的一次')
+    args = parser.parse_args()
+
+    if args.target == 'signers':
+        for name, elapsed in run_signers(args.count or 1000, args.repeat).items():
+            print(f"{name:>6}: {elapsed * 1e6:8.1f} us/次")  # noqa: T201
+        return
+
+    results = run(args.count or 100000, args.repeat)
+    for name, item in results.items():
+        print(  # noqa: T201
+            f"{name:>6}: 构造 {item['build'] * 1000:8.1f} ms  构造+编码 {item['build_and_encode'] * 1000:8.1f} ms  "
+            f"内存 {item['memory'] / 1024 / 1024:7.1f} MiB  响应 {item['bytes'] / 1024 / 1024:6.1f} MiB"
+        )
+    speedup = results['dict']['build_and_encode'] / results['record']['build_and_encode']
+    memory = results['record']['memory'] / results['dict']['memory']
+    print(f"构造+编码快 {speedup:.1f} 倍，记录内存为 dict 的 {memory:.0%}")  # noqa: T201
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Redis read-through cache for upstream XHS responses."""
+
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from loguru import logger
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.redis import get_redis
+from .singleflight import single_flight
+
+CACHE_PREFIX = "xhs:cache"
+STATS_KEY = "xhs:cache:stats"
+
+
+class ResponseCache:
+    """所有 web 和 SAQ worker 进程共享的读穿缓存
+
+    缓存按命名空间（``note``、``search``）区分，过期时间取自 ``XHS_CACHE_TTLS``。
+    过期后的 ``XHS_CACHE_STALE`` 秒内仍返回旧值，同时在后台重新获取（stale-while-revalidate），
+    集群中同一个键只有一个进程去刷新；同时未命中的调用方通过 single_flight 合并为一次上游请求。
+    命中、过期和未命中次数记在 Redis 哈希 ``xhs:cache:stats`` 中。Redis 不可用时直接请求上游。
+    """
+
+    # Redis 出错后直接请求上游的时长（秒）
+    REDIS_RETRY_AFTER = 30
+    # 后台刷新的锁时长（秒），刷新失败后最多这么久再次尝试
+    REFRESH_LOCK = 30
+
+    def __init__(self):
+        self._refreshing: Dict[str, asyncio.Task] = {}
+        self._redis_down_until = 0.0
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{CACHE_PREFIX}:{namespace}:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+
+    async def get_or_fetch(
+        self,
+        namespace: str,
+        key: str,
+        fetch: Callable[[], Awaitable[Any]],
+        account: str = "",
+        fresh: bool = False,
+    ) -> Any:
+        """从缓存读取，未命中时调用 fetch 获取并写入缓存
+
+        Args:
+            namespace (str): 命名空间，决定过期时间
+            key (str): 规范化后的缓存键
+            fetch: 请求上游的协程函数，返回 None 时不缓存
+            account (str): 发起请求的账号，未命中时只和同一账号的调用方合并请求，
+                一个账号被拒绝或封禁的错误不会交给其他账号
+            fresh (bool): 不读缓存，直接请求上游并用结果更新缓存
+
+        Returns:
+            缓存的值或 fetch 的结果
+        """
+        ttl = settings.XHS_CACHE_TTLS.get(namespace, 0)
+        if not settings.XHS_CACHE_ENABLED or ttl <= 0 or time.monotonic() < self._redis_down_until:
+            return await fetch()
+
+        cache_key = self._key(namespace, key)
+        flight_key = f"{cache_key}:{account}" if account else cache_key
+        if fresh:
+            value = await single_flight.do(flight_key, fetch)
+            await self._store(namespace, cache_key, value)
+            return value
+
+        try:
+            cached = await get_redis().get(cache_key)
+        except (RedisError, OSError) as e:
+            self._redis_unavailable(e)
+            return await fetch()
+
+        entry = self._decode(cache_key, cached) if cached is not None else None
+        if entry is not None:
+            if time.time() - entry["t"] < ttl:
+                await self._count(namespace, "hit")
+            else:
+                await self._count(namespace, "stale")
+                self._revalidate(namespace, cache_key, fetch)
+            return entry["v"]
+
+        await self._count(namespace, "miss")
+        # 同时未命中的调用方只请求一次上游
+        value = await single_flight.do(flight_key, fetch)
+        await self._store(namespace, cache_key, value)
+        return value
+
+    async def stats(self) -> Dict[str, Dict[str, float]]:
+        """各命名空间的 hit、stale、miss 次数和命中率（stale 也算命中）"""
+        counters = await get_redis().hgetall(STATS_KEY)
+        stats: Dict[str, Dict[str, float]] = {}
+        for field, value in counters.items():
+            namespace, outcome = field.decode().split(":", 1)
+            stats.setdefault(namespace, {"hit": 0, "stale": 0, "miss": 0})[outcome] = int(value)
+        for item in stats.values():
+            total = item["hit"] + item["stale"] + item["miss"]
+            item["hit_rate"] = (item["hit"] + item["stale"]) / total if total else 0.0
+        return stats
+
+    def _decode(self, cache_key: str, cached: bytes) -> Optional[Dict[str, Any]]:
+        """解析缓存条目，损坏或旧格式的条目返回 None，按未命中处理"""
+        try:
+            entry = json.loads(cached)
+            if isinstance(entry, dict) and isinstance(entry.get("t"), (int, float)) and "v" in entry:
+                return entry
+        except (ValueError, TypeError):
+            pass
+        logger.warning(f"缓存{cache_key}无法解析，按未命中处理")
+        return None
+
+    async def _store(self, namespace: str, cache_key: str, value: Any) -> None:
+        if value is None:
+            return
+        ttl = settings.XHS_CACHE_TTLS[namespace]
+        try:
+            await get_redis().set(
+                cache_key,
+                json.dumps({"t": time.time(), "v": value}, ensure_ascii=False),
+                ex=int(ttl + settings.XHS_CACHE_STALE),
+            )
+        except (RedisError, OSError) as e:
+            self._redis_unavailable(e)
+
+    async def _count(self, namespace: str, outcome: str) -> None:
+        try:
+            await get_redis().hincrby(STATS_KEY, f"{namespace}:{outcome}", 1)
+        except (RedisError, OSError) as e:
+            self._redis_unavailable(e)
+
+    def _revalidate(self, namespace: str, cache_key: str, fetch: Callable[[], Awaitable[Any]]) -> None:
+        if cache_key in self._refreshing:
+            return
+        task = asyncio.ensure_future(self._refresh(namespace, cache_key, fetch))
+        self._refreshing[cache_key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(cache_key, None))
+
+    async def _refresh(self, namespace: str, cache_key: str, fetch: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            if not await get_redis().set(f"{cache_key}:refresh", 1, nx=True, ex=self.REFRESH_LOCK):
+                return
+            await self._store(namespace, cache_key, await fetch())
+        except Exception as e:
+            logger.warning(f"后台刷新缓存{cache_key}失败: {e}")
+
+    def _redis_unavailable(self, error: Exception) -> None:
+        self._redis_down_until = time.monotonic() + self.REDIS_RETRY_AFTER
+        logger.warning(f"Redis缓存不可用，{self.REDIS_RETRY_AFTER}秒内直接请求上游: {error}")
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,53 @@
+"""Shared async HTTP session for XHS upstream calls."""
+
+import asyncio
+from http.cookiejar import CookieJar
+from typing import Optional
+
+from curl_cffi.const import CurlHttpVersion
+from curl_cffi.requests import AsyncSession
+
+from app.core.config import settings
+
+EDITH_HOST = "https://edith.xiaohongshu.com"
+
+_session: Optional[AsyncSession] = None
+_session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+class _DiscardCookieJar(CookieJar):
+    """不保存响应里的 Set-Cookie
+
+    会话在所有调用方之间共享，每个请求只带调用方自己传入的 cookies，
+    避免不同账号的 cookie 通过会话串到别人的请求上。
+    """
+
+    def set_cookie(self, cookie):
+        pass
+
+
+def get_session() -> AsyncSession:
+    """获取当前事件循环上的共享会话，连接（TLS、HTTP/2）在请求之间复用"""
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session_loop is not loop:
+        _session = AsyncSession(
+            loop=loop,
+            max_clients=settings.XHS_HTTP_MAX_CONNECTIONS,
+            timeout=(settings.XHS_HTTP_CONNECT_TIMEOUT, settings.XHS_HTTP_TIMEOUT),
+            impersonate="chrome110",
+            http_version=CurlHttpVersion.V2TLS if settings.XHS_HTTP2 else CurlHttpVersion.V1_1,
+            cookies=_DiscardCookieJar(),
+        )
+        _session_loop = loop
+    return _session
+
+
+async def close_session() -> None:
+    global _session, _session_loop
+    if _session is not None:
+        result = _session.close()
+        if asyncio.iscoroutine(result):
+            await result
+    _session = None
+    _session_loop = None
@@ -0,0 +1,49 @@
+"""小红书上游请求的异常，按是否重试、是否计入熔断器分类。"""
+
+from typing import Optional
+
+
+class XhsError(Exception):
+    """小红书接口请求失败
+
+    Attributes:
+        retryable (bool): 是否值得重试
+        trips_breaker (bool): 是否说明上游不可用，计入熔断器的失败次数
+    """
+
+    retryable = False
+    trips_breaker = False
+
+    def __init__(self, message: str, status_code: Optional[int] = None, code: Optional[int] = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.code = code
+
+
+class XhsTransientError(XhsError):
+    """网络错误、超时或 5xx，可以重试"""
+
+    retryable = True
+    trips_breaker = True
+
+
+class XhsRequestError(XhsError):
+    """4xx，请求本身有问题（cookies 失效、参数错误等），不重试"""
+
+    @property
+    def trips_breaker(self) -> bool:
+        # 429 说明整个上游在限流，其他 4xx 只和这次请求有关
+        return self.status_code == 429
+
+
+class XhsRefusedError(XhsError):
+    """上游正常响应但拒绝了请求（响应中 code 不为 0，如登录失效、触发风控），不重试"""
+
+
+class XhsResponseError(XhsError):
+    """响应不是合法的 JSON 对象"""
+
+
+class XhsCircuitOpenError(XhsError):
+    """熔断器打开，请求未发出"""
@@ -0,0 +1,147 @@
+"""Retry, backoff and circuit breaking for upstream XHS calls."""
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from loguru import logger
+
+from app.core.config import settings
+from .errors import XhsCircuitOpenError, XhsError
+
+
+class CircuitBreaker:
+    """单个接口族的熔断器
+
+    连续 ``failure_threshold`` 次上游故障后打开，``reset_timeout`` 秒内的请求直接失败；
+    之后放行一个试探请求（半开），成功则关闭，失败则重新打开。
+
+    Args:
+        name (str): 接口族名称
+        failure_threshold (int): 打开熔断器的连续失败次数
+        reset_timeout (float): 打开后多少秒放行试探请求
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_request(self) -> None:
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probing):
+            raise XhsCircuitOpenError(f"{self.name} 接口熔断中，请稍后再试")
+        if state == "half_open":
+            self._probing = True
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info(f"{self.name} 接口恢复，关闭熔断器")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.error(f"{self.name} 接口连续失败{self.failures}次，打开熔断器{self.reset_timeout}秒")
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """请求以与上游健康无关的结果结束（如 4xx），半开状态下允许下一个试探请求"""
+        self._probing = False
+
+
+@dataclass
+class RequestOutcome:
+    """一次上游调用（包括重试）的结果"""
+
+    endpoint: str
+    attempts: int
+    elapsed: float
+    data: Any = None
+    error: Optional[XhsError] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    if endpoint not in breakers:
+        breakers[endpoint] = CircuitBreaker(endpoint, settings.XHS_BREAKER_FAILURES, settings.XHS_BREAKER_RESET_TIMEOUT)
+    return breakers[endpoint]
+
+
+def backoff_delay(attempt: int) -> float:
+    """第 ``attempt`` 次重试前的等待时间：指数退避加全抖动"""
+    return random.uniform(0, min(settings.XHS_RETRY_MAX_DELAY, settings.XHS_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+async def execute(endpoint: str, attempt: Callable[[], Awaitable[Any]]) -> RequestOutcome:
+    """执行一次上游调用，按失败类型决定是否重试
+
+    可重试的失败（网络错误、超时、5xx）按指数退避重试，最多 ``XHS_RETRY_ATTEMPTS`` 次；
+    4xx 和上游拒绝不重试。每个接口族有独立的熔断器，熔断期间直接返回失败，不发出请求。
+    非 XhsError 的异常（如缺少 a1 cookie）原样抛出。
+
+    Args:
+        endpoint (str): 接口族，决定使用哪个熔断器
+        attempt: 发出一次请求并返回解析后数据的协程函数，失败时抛出 XhsError
+
+    Returns:
+        RequestOutcome: 调用结果
+    """
+    breaker = get_breaker(endpoint)
+    start = time.monotonic()
+    attempts = 0
+    max_attempts = max(1, settings.XHS_RETRY_ATTEMPTS)
+    last_error: Optional[XhsError] = None
+    while True:
+        try:
+            breaker.before_request()
+        except XhsCircuitOpenError as e:
+            # 重试途中熔断器打开时，返回真正的失败原因
+            return RequestOutcome(endpoint, attempts, time.monotonic() - start, error=last_error or e)
+
+        attempts += 1
+        try:
+            data = await attempt()
+        except XhsError as e:
+            last_error = e
+            if e.trips_breaker:
+                breaker.record_failure()
+            else:
+                breaker.release()
+            if e.retryable and attempts < max_attempts:
+                delay = backoff_delay(attempts - 1)
+                logger.warning(f"{endpoint} 请求失败（第{attempts}次）: {e.message}，{delay:.2f}秒后重试")
+                await asyncio.sleep(delay)
+                continue
+            outcome = RequestOutcome(endpoint, attempts, time.monotonic() - start, error=e)
+            logger.warning(f"{endpoint} 请求失败: {type(e).__name__}: {e.message}（共{attempts}次，{outcome.elapsed:.2f}秒）")
+            return outcome
+        except BaseException:
+            breaker.release()
+            raise
+
+        breaker.record_success()
+        return RequestOutcome(endpoint, attempts, time.monotonic() - start, data=data)
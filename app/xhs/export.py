@@ -0,0 +1,423 @@
+"""Parquet 和 CSV 导出
+
+评论和笔记按 ``keyword=<关键词>/date=<YYYY-MM-DD>`` 分区写成 Parquet 文件（hive 分区布局，
+pandas、pyarrow、DuckDB、Spark 可直接按目录读取并按分区过滤），列由 ``CommentResponse`` /
+``NoteResponse`` 决定。数据来源是任意（异步）迭代器，既可以是数据库，也可以是正在采集的 ``iter_comments``；
+内存中最多缓存 ``XHS_EXPORT_ROW_GROUP_SIZE`` 行，攒够后作为一个 row group 在线程中写入，不阻塞事件循环。
+
+CSV 同样边读边写：每 ``XHS_EXPORT_CSV_CHUNK_SIZE`` 行在线程中编码（可选 gzip 压缩）一次，
+写入文件或直接作为 HTTP 响应体输出。
+
+批量任务的子任务把评论逐条写入 NDJSON 文件（``NdjsonWriter``），任务结果中只保存文件路径和数量，
+读取时用 ``iter_ndjson`` 分块读回。
+"""
+
+import asyncio
+import csv
+import io
+import uuid
+import zlib
+from datetime import date, datetime, time, timezone
+from pathlib import Path
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Type, Union
+
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+from pydantic import BaseModel
+from tortoise.expressions import Subquery
+
+from app.core.config import settings
+from .models import Comment, Note
+from .records import dumps, get_time_formatter
+from .schemas import CommentResponse, NoteResponse
+
+_ARROW_TYPES = {str: pa.string(), int: pa.int64(), float: pa.float64(), bool: pa.bool_()}
+
+# hive 分区中空值的约定写法
+DEFAULT_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+# 目录名中需要转义的字符，读取时按 URI 编码解码
+_UNSAFE_CHARS = set('%/\\:=?*"<>|#')
+
+
+def arrow_schema(model: Type[BaseModel]) -> pa.Schema:
+    """按 pydantic 模型的字段生成 Arrow schema，所有列都允许为空"""
+    return pa.schema([
+        pa.field(name, _ARROW_TYPES.get(field.type_, pa.string()))
+        for name, field in model.__fields__.items()
+    ])
+
+
+COMMENT_SCHEMA = arrow_schema(CommentResponse)
+NOTE_SCHEMA = arrow_schema(NoteResponse)
+
+
+def _escape(value: Optional[str]) -> str:
+    if not value:
+        return DEFAULT_PARTITION
+    return "".join(f"%{ord(c):02X}" if c in _UNSAFE_CHARS or ord(c) < 32 else c for c in value)
+
+
+def _coerce(value: Any, type_: pa.DataType) -> Any:
+    """接口返回的数字可能是字符串，无法转换的值写为空"""
+    if value is None or value == "":
+        return None
+    try:
+        if pa.types.is_integer(type_):
+            return int(value)
+        if pa.types.is_floating(type_):
+            return float(value)
+        if pa.types.is_boolean(type_):
+            return bool(value)
+    except (TypeError, ValueError):
+        return None
+    return value if isinstance(value, str) else str(value)
+
+
+def comment_date(comment: Dict[str, Any]) -> Optional[str]:
+    """评论的分区日期，按 ``XHS_TIMEZONE`` 取自毫秒级 create_time，与服务器所在时区无关"""
+    return get_time_formatter(settings.XHS_TIMEZONE).date(comment.get("create_time"))
+
+
+def local_date(moment: Optional[datetime] = None) -> str:
+    """时间点在 ``XHS_TIMEZONE`` 中的日期 ``%Y-%m-%d``，不传时为当前日期
+
+    数据库返回的不带时区的 datetime 按 UTC 处理（Tortoise 默认以 UTC 存储）。
+    """
+    tz = get_time_formatter(settings.XHS_TIMEZONE).tz
+    if moment is None:
+        return datetime.now(tz).date().isoformat()
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(tz).date().isoformat()
+
+
+class ParquetExporter:
+    """把记录按 (keyword, date) 分区写入 Parquet 文件
+
+    每个分区一个文件，文件名带本次导出的 ID，多次导出到同一目录不会相互覆盖。
+    所有分区合计缓存的行数达到 row_group_size 时，把最大的分区写成一个 row group。
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        schema: pa.Schema,
+        row_group_size: Optional[int] = None,
+        compression: Optional[str] = None,
+    ):
+        self.root = Path(root)
+        self.schema = schema
+        self.row_group_size = row_group_size or settings.XHS_EXPORT_ROW_GROUP_SIZE
+        self.compression = compression or settings.XHS_EXPORT_COMPRESSION
+        self.export_id = uuid.uuid4().hex
+        self.rows = 0
+        self._buffered = 0
+        self._buffers: Dict[Tuple[str, str], Dict[str, List[Any]]] = {}
+        self._writers: Dict[Tuple[str, str], pq.ParquetWriter] = {}
+        self._paths: List[Path] = []
+
+    async def write(self, record: Dict[str, Any], keyword: Optional[str], day: Optional[str]) -> None:
+        """写入一行，多余的键被忽略，缺少的列写为空"""
+        partition = (_escape(keyword), day or DEFAULT_PARTITION)
+        columns = self._buffers.get(partition)
+        if columns is None:
+            columns = self._buffers[partition] = {name: [] for name in self.schema.names}
+        for field in self.schema:
+            columns[field.name].append(_coerce(record.get(field.name), field.type))
+        self.rows += 1
+        self._buffered += 1
+        if self._buffered >= self.row_group_size:
+            await self._flush(max(self._buffers, key=lambda p: len(self._buffers[p][self.schema.names[0]])))
+
+    async def close(self) -> List[str]:
+        """写入剩余的行并关闭所有文件
+
+        Returns:
+            List[str]: 写入的文件路径
+        """
+        try:
+            for partition in list(self._buffers):
+                await self._flush(partition)
+        finally:
+            for writer in self._writers.values():
+                await asyncio.to_thread(writer.close)
+            self._writers.clear()
+        return [str(path) for path in self._paths]
+
+    async def _flush(self, partition: Tuple[str, str]) -> None:
+        columns = self._buffers.pop(partition)
+        table = pa.table(columns, schema=self.schema)
+        self._buffered -= table.num_rows
+        await asyncio.to_thread(self._write_table, partition, table)
+
+    def _write_table(self, partition: Tuple[str, str], table: pa.Table) -> None:
+        writer = self._writers.get(partition)
+        if writer is None:
+            keyword, day = partition
+            path = self.root / f"keyword={keyword}" / f"date={day}" / f"part-{self.export_id}.parquet"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            writer = self._writers[partition] = pq.ParquetWriter(path, self.schema, compression=self.compression)
+            self._paths.append(path)
+        writer.write_table(table)
+
+
+async def _aiter(records: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    if hasattr(records, "__aiter__"):
+        async for record in records:
+            yield record
+    else:
+        for record in records:
+            yield record
+
+
+async def export_comments(
+    comments: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+    keyword: Optional[str] = None,
+    root: Optional[Union[str, Path]] = None,
+) -> Dict[str, Any]:
+    """把评论按关键词和评论日期分区导出为 Parquet
+
+    Args:
+        comments: format_comment 格式的评论，可以是列表、iter_comments 或 iter_db_comments
+        keyword: 评论自身没有 keyword 时使用的分区关键词
+        root: 导出目录，默认 ``XHS_EXPORT_DIR/comments``
+
+    Returns:
+        dict: rows（导出行数）和 files（写入的文件）
+    """
+    exporter = ParquetExporter(root or Path(settings.XHS_EXPORT_DIR) / "comments", COMMENT_SCHEMA)
+    async for comment in _aiter(comments):
+        await exporter.write(comment, comment.get("keyword") or keyword, comment_date(comment))
+    files = await exporter.close()
+    logger.info(f"已导出{exporter.rows}条评论到{len(files)}个Parquet文件")
+    return {"rows": exporter.rows, "files": files}
+
+
+async def export_notes(
+    notes: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+    keyword: Optional[str] = None,
+    root: Optional[Union[str, Path]] = None,
+) -> Dict[str, Any]:
+    """把笔记按关键词和采集日期分区导出为 Parquet，参数和返回值同 export_comments"""
+    exporter = ParquetExporter(root or Path(settings.XHS_EXPORT_DIR) / "notes", NOTE_SCHEMA)
+    today = local_date()
+    async for note in _aiter(notes):
+        await exporter.write(note, note.get("keyword") or keyword, note.get("date") or today)
+    files = await exporter.close()
+    logger.info(f"已导出{exporter.rows}条笔记到{len(files)}个Parquet文件")
+    return {"rows": exporter.rows, "files": files}
+
+
+class CsvEncoder:
+    """把评论增量编码为 UTF-8-BOM CSV 字节（Excel 可直接打开），可选 gzip 压缩
+
+    表头取 CommentResponse 的字段，多余的键被忽略、缺少的列为空，各行的键不一致也不影响输出。
+    """
+
+    def __init__(self, fieldnames: Optional[List[str]] = None, compress: bool = False):
+        self.fieldnames = fieldnames or COMMENT_SCHEMA.names
+        # wbits=31 输出带 gzip 文件头的数据流
+        self._compressor = zlib.compressobj(wbits=31) if compress else None
+        self._header = True
+
+    def encode(self, rows: List[Dict[str, Any]]) -> bytes:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self.fieldnames, extrasaction="ignore")
+        if self._header:
+            buffer.write("\ufeff")
+            writer.writeheader()
+            self._header = False
+        writer.writerows(rows)
+        data = buffer.getvalue().encode("utf-8")
+        return self._compressor.compress(data) if self._compressor else data
+
+    def finish(self) -> bytes:
+        """没有任何行时也输出表头，压缩时输出剩余的压缩数据"""
+        data = self.encode([]) if self._header else b""
+        return data + self._compressor.flush() if self._compressor else data
+
+
+async def iter_csv(
+    comments: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+    compress: bool = False,
+    chunk_size: Optional[int] = None,
+) -> AsyncIterator[bytes]:
+    """把评论流编码为 CSV 字节流，每 chunk_size 行输出一块，可直接作为 StreamingResponse 的内容
+
+    Args:
+        comments: 评论，可以是列表、iter_comments、iter_db_comments 等
+        compress: 是否 gzip 压缩
+        chunk_size: 每块的行数，默认 ``XHS_EXPORT_CSV_CHUNK_SIZE``
+    """
+    chunk_size = chunk_size or settings.XHS_EXPORT_CSV_CHUNK_SIZE
+    encoder = CsvEncoder(compress=compress)
+    rows: List[Dict[str, Any]] = []
+    async for comment in _aiter(comments):
+        rows.append(comment)
+        if len(rows) >= chunk_size:
+            chunk, rows = rows, []
+            data = await asyncio.to_thread(encoder.encode, chunk)
+            if data:
+                yield data
+    if rows:
+        yield await asyncio.to_thread(encoder.encode, rows)
+    yield await asyncio.to_thread(encoder.finish)
+
+
+async def write_csv(
+    comments: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+    path: Union[str, Path],
+    compress: bool = False,
+) -> int:
+    """把评论流写入 CSV 文件，编码和写文件都在线程中进行
+
+    Returns:
+        int: 写入的行数
+    """
+    rows = 0
+
+    async def counted() -> AsyncIterator[Dict[str, Any]]:
+        nonlocal rows
+        async for comment in _aiter(comments):
+            rows += 1
+            yield comment
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    file = await asyncio.to_thread(open, path, "wb")
+    try:
+        async for data in iter_csv(counted(), compress):
+            await asyncio.to_thread(file.write, data)
+    finally:
+        await asyncio.to_thread(file.close)
+    return rows
+
+
+def _millis(day: date) -> int:
+    tz = get_time_formatter(settings.XHS_TIMEZONE).tz
+    return int(datetime.combine(day, time.min, tzinfo=tz).timestamp() * 1000)
+
+
+async def iter_db_comments(
+    keyword: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    batch_size: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """按主键分批读取已入库的评论，产出 CommentResponse 的字段和 keyword
+
+    Args:
+        keyword: 只导出该关键词搜到的笔记下的评论
+        start_date: 评论日期下限（含），按 ``XHS_TIMEZONE`` 计算
+        end_date: 评论日期上限（含），按 ``XHS_TIMEZONE`` 计算
+        batch_size: 每次查询的行数，默认 ``XHS_DB_BATCH_SIZE``
+    """
+    batch_size = batch_size or settings.XHS_DB_BATCH_SIZE
+    query = Comment.all()
+    if keyword is not None:
+        query = query.filter(note_id__in=Subquery(Note.filter(keyword=keyword).values("note_id")))
+    if start_date:
+        query = query.filter(create_time__gte=_millis(start_date))
+    if end_date:
+        query = query.filter(create_time__lt=_millis(end_date) + 86400 * 1000)
+
+    last_id = 0
+    while True:
+        rows = await query.filter(id__gt=last_id).order_by("id").limit(batch_size).values(
+            "id", "note_id", "comment_id", "root_comment_id", "parent_comment_id",
+            "content", "like_count", "nickname", "ip_location", "create_time",
+        )
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        keywords = dict(await Note.filter(note_id__in={row["note_id"] for row in rows}).values_list("note_id", "keyword"))
+        for row in rows:
+            row["keyword"] = keywords.get(row["note_id"])
+            row["comment_location"] = row.pop("ip_location")
+            yield row
+
+
+async def iter_db_notes(keyword: Optional[str] = None, batch_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """按主键分批读取已入库的笔记，产出 NoteResponse 的字段、keyword 和 date（最近一次采集的日期，按 ``XHS_TIMEZONE``）"""
+    batch_size = batch_size or settings.XHS_DB_BATCH_SIZE
+    query = Note.all() if keyword is None else Note.filter(keyword=keyword)
+    last_id = 0
+    while True:
+        rows = await query.filter(id__gt=last_id).order_by("id").limit(batch_size).values(
+            "id", "note_id", "xsec_token", "title", "url", "keyword", "author", "like_count",
+            "last_crawled_at", "updated_at",
+        )
+        if not rows:
+            return
+        last_id = rows[-1]["id"]
+        for row in rows:
+            yield {
+                "note_id": row["note_id"],
+                "title": row["title"],
+                "xsec_token": row["xsec_token"],
+                "user_nickname": row["author"],
+                "liked_count": row["like_count"],
+                "note_url": row["url"],
+                "keyword": row["keyword"],
+                "date": local_date(row["last_crawled_at"] or row["updated_at"]),
+            }
+
+
+class NdjsonWriter:
+    """把记录逐条追加到 NDJSON 文件（每行一条 orjson 编码的记录），每 chunk_size 行在线程中写入一次"""
+
+    def __init__(self, path: Union[str, Path], chunk_size: Optional[int] = None):
+        self.path = Path(path)
+        self.chunk_size = chunk_size or settings.XHS_EXPORT_CSV_CHUNK_SIZE
+        self.rows = 0
+        self._lines: List[bytes] = []
+        self._file = None
+
+    async def write(self, record: Dict[str, Any]) -> None:
+        self._lines.append(dumps(record))
+        self.rows += 1
+        if len(self._lines) >= self.chunk_size:
+            await self._flush()
+
+    async def close(self) -> None:
+        """写入剩余的行并关闭文件，没有任何行时也会创建空文件"""
+        try:
+            await self._flush()
+        finally:
+            if self._file is not None:
+                await asyncio.to_thread(self._file.close)
+                self._file = None
+
+    async def _flush(self) -> None:
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = await asyncio.to_thread(open, self.path, "wb")
+        if self._lines:
+            lines, self._lines = self._lines, []
+            await asyncio.to_thread(self._file.write, b"\n".join(lines) + b"\n")
+
+
+async def iter_ndjson(path: Union[str, Path], chunk_size: Optional[int] = None) -> AsyncIterator[Dict[str, Any]]:
+    """分块读取 NdjsonWriter 写入的记录，同一时刻内存中最多有 chunk_size 行"""
+    chunk_size = chunk_size or settings.XHS_EXPORT_CSV_CHUNK_SIZE
+    file = await asyncio.to_thread(open, path, "rb")
+    try:
+        while True:
+            lines = await asyncio.to_thread(_read_lines, file, chunk_size)
+            if not lines:
+                return
+            for line in lines:
+                yield orjson.loads(line)
+    finally:
+        await asyncio.to_thread(file.close)
+
+
+def _read_lines(file: Any, count: int) -> List[bytes]:
+    lines = []
+    for line in file:
+        if line.strip():
+            lines.append(line)
+            if len(lines) >= count:
+                break
+    return lines
@@ -0,0 +1,82 @@
+"""Tortoise models for collected XHS data."""
+
+from tortoise import fields
+
+from app.db.models import TimeStampedModel
+
+
+class CrawlRun(TimeStampedModel):
+    """一次采集（获取评论或搜索笔记）"""
+
+    id = fields.IntField(pk=True)
+    kind = fields.CharField(max_length=32, description="comments 或 search")
+    target = fields.CharField(max_length=1024, description="笔记URL或搜索关键词")
+    status = fields.CharField(max_length=16, default="running", description="running、success、failed")
+    note_count = fields.IntField(default=0)
+    comment_count = fields.IntField(default=0)
+    error = fields.TextField(null=True)
+    finished_at = fields.DatetimeField(null=True)
+
+    class Meta:
+        table = "xhs_crawl_runs"
+
+
+class Note(TimeStampedModel):
+    id = fields.IntField(pk=True)
+    note_id = fields.CharField(max_length=64, unique=True)
+    xsec_token = fields.CharField(max_length=255, default="")
+    title = fields.CharField(max_length=512, default="")
+    url = fields.CharField(max_length=1024, default="")
+    keyword = fields.CharField(max_length=255, null=True, description="最近一次搜到该笔记的关键词")
+    author = fields.CharField(max_length=255, null=True)
+    like_count = fields.IntField(null=True)
+    collected_count = fields.IntField(null=True)
+    comment_count = fields.IntField(null=True, description="上游返回的评论总数")
+    last_crawled_at = fields.DatetimeField(null=True)
+    # 增量同步的高水位线：已获取的最新根评论，只在同步完整结束后推进
+    last_comment_time = fields.BigIntField(null=True)
+    last_comment_id = fields.CharField(max_length=64, null=True)
+
+    class Meta:
+        table = "xhs_notes"
+
+
+class Comment(TimeStampedModel):
+    id = fields.BigIntField(pk=True)
+    comment_id = fields.CharField(max_length=64, unique=True)
+    note_id = fields.CharField(max_length=64)
+    root_comment_id = fields.CharField(max_length=64, null=True, index=True, description="子评论所属的根评论，根评论为空")
+    parent_comment_id = fields.CharField(max_length=64, null=True, description="子评论回复的评论，根评论为空")
+    content = fields.TextField()
+    like_count = fields.IntField(default=0)
+    nickname = fields.CharField(max_length=255, default="")
+    ip_location = fields.CharField(max_length=64, default="")
+    create_time = fields.BigIntField(null=True, description="评论时间（毫秒级时间戳）")
+    crawl_run: fields.ForeignKeyNullableRelation[CrawlRun] = fields.ForeignKeyField(
+        "models.CrawlRun", related_name="comments", null=True, on_delete=fields.SET_NULL
+    )
+
+    class Meta:
+        table = "xhs_comments"
+        indexes = (("note_id", "create_time"),)
+
+
+class MonitoredNote(TimeStampedModel):
+    """定时增量同步评论的笔记，轮询间隔随新增评论速度自适应"""
+
+    id = fields.IntField(pk=True)
+    note_id = fields.CharField(max_length=64, unique=True)
+    note_url = fields.CharField(max_length=1024)
+    cookies = fields.TextField()
+    user_info = fields.CharField(max_length=255, default="", description="客户标识")
+    keyword = fields.CharField(max_length=255, default="")
+    enabled = fields.BooleanField(default=True)
+    interval = fields.FloatField(description="当前轮询间隔（秒）")
+    velocity = fields.FloatField(default=0, description="新增评论速度（条/秒，指数加权平均）")
+    next_due_at = fields.DatetimeField(index=True)
+    last_polled_at = fields.DatetimeField(null=True)
+    last_new_comments = fields.IntField(default=0)
+    error_count = fields.IntField(default=0, description="连续失败次数")
+
+    class Meta:
+        table = "xhs_monitored_notes"
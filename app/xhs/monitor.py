@@ -0,0 +1,150 @@
+"""评论监控调度
+
+被监控的笔记存放在 ``xhs_monitored_notes`` 表中，同时按下次到期时间放在 Redis 有序集合
+``xhs:monitor:due`` 里（分数为到期的 Unix 时间戳），作为所有 worker 共享的优先队列。
+定时任务每次最多取出 ``XHS_MONITOR_BATCH_SIZE`` 条最早到期的笔记，各放入一个轮询任务，
+所以请求量有固定上限，与被监控的笔记数量无关：笔记越多，每条笔记实际等待的时间越长，
+但最早到期的总是先被轮询。每条笔记的轮询间隔按新增评论速度自适应。
+"""
+
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
+
+from loguru import logger
+
+from app.core.config import settings
+from app.core.redis import get_redis
+from .errors import XhsError
+from .models import MonitoredNote
+from .services import XhsService
+from .xhs_utils.xhs_util import convert_discovery_to_explore_url
+
+DUE_KEY = "xhs:monitor:due"
+
+# 取出最多 ARGV[2] 条到期的笔记，并把它们的到期时间推迟到租约结束（ARGV[3]），
+# 多个 worker 同时调度时不会重复取出；轮询任务异常退出时租约到期后会被重新调度。
+_CLAIM_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, note_id in ipairs(due) do
+    redis.call('ZADD', KEYS[1], ARGV[3], note_id)
+end
+return due
+"""
+
+
+def next_interval(interval: float, velocity: float, new_comments: int, elapsed: float) -> Tuple[float, float]:
+    """根据本次轮询获取到的新增评论数计算下次轮询间隔
+
+    新增评论速度按指数加权平均平滑。有新增评论时，让下次轮询大约获取
+    ``XHS_MONITOR_TARGET_COMMENTS`` 条；没有新增时，间隔按 ``XHS_MONITOR_BACKOFF`` 倍增长。
+    结果限制在 ``XHS_MONITOR_MIN_INTERVAL`` 和 ``XHS_MONITOR_MAX_INTERVAL`` 之间。
+
+    Args:
+        interval (float): 当前轮询间隔（秒）
+        velocity (float): 之前的新增评论速度（条/秒）
+        new_comments (int): 本次获取到的新增评论数
+        elapsed (float): 距离上次轮询的时间（秒）
+
+    Returns:
+        tuple: (下次轮询间隔, 新的新增评论速度)
+    """
+    rate = new_comments / elapsed if elapsed > 0 else 0.0
+    velocity = 0.5 * rate + 0.5 * velocity if velocity else rate
+    if new_comments and velocity > 0:
+        interval = settings.XHS_MONITOR_TARGET_COMMENTS / velocity
+    else:
+        interval = interval * settings.XHS_MONITOR_BACKOFF
+    return min(max(interval, settings.XHS_MONITOR_MIN_INTERVAL), settings.XHS_MONITOR_MAX_INTERVAL), velocity
+
+
+async def schedule(note_id: str, due: float) -> None:
+    await get_redis().zadd(DUE_KEY, {note_id: due})
+
+
+async def claim_due_notes(limit: int) -> List[str]:
+    """取出最多 limit 条已到期的笔记，最早到期的在前"""
+    redis = get_redis()
+    if not await redis.exists(DUE_KEY):
+        await rebuild_queue()
+    now = time.time()
+    due = await redis.eval(_CLAIM_SCRIPT, 1, DUE_KEY, now, limit, now + settings.XHS_MONITOR_LEASE)
+    return [note_id.decode() for note_id in due]
+
+
+async def rebuild_queue() -> int:
+    """Redis 中的队列丢失（如 Redis 重启）时从数据库恢复"""
+    notes = await MonitoredNote.filter(enabled=True).values_list("note_id", "next_due_at")
+    if notes:
+        await get_redis().zadd(DUE_KEY, {note_id: due.timestamp() for note_id, due in notes})
+        logger.info(f"从数据库恢复了{len(notes)}条监控笔记的调度")
+    return len(notes)
+
+
+async def add_note(cookies: str, note_url: str, user_info: str = "", keyword: str = "") -> MonitoredNote:
+    """开始监控一条笔记（已在监控中时更新 cookies 等信息），立即安排第一次轮询"""
+    if "discovery" in note_url:
+        note_url = convert_discovery_to_explore_url(note_url)
+    note_id = XhsService().api.extract_url_params(note_url)["note_id"]
+    now = datetime.now(timezone.utc)
+    note, _ = await MonitoredNote.update_or_create(
+        defaults={
+            "note_url": note_url,
+            "cookies": cookies,
+            "user_info": user_info,
+            "keyword": keyword,
+            "enabled": True,
+            "interval": settings.XHS_MONITOR_MIN_INTERVAL,
+            "next_due_at": now,
+        },
+        note_id=note_id,
+    )
+    await schedule(note_id, now.timestamp())
+    return note
+
+
+async def remove_note(note_id: str) -> bool:
+    """停止监控一条笔记，返回笔记是否在监控中"""
+    deleted = await MonitoredNote.filter(note_id=note_id).delete()
+    await get_redis().zrem(DUE_KEY, note_id)
+    return bool(deleted)
+
+
+async def poll_note(note_id: str) -> Dict[str, Any]:
+    """增量同步一条监控中的笔记，并按结果安排下次轮询
+
+    Returns:
+        dict: note_id、new_comments（新增评论数）和 interval（下次轮询间隔）
+    """
+    note = await MonitoredNote.get_or_none(note_id=note_id, enabled=True)
+    if note is None:
+        await get_redis().zrem(DUE_KEY, note_id)
+        return {"note_id": note_id, "new_comments": 0, "interval": None}
+
+    now = datetime.now(timezone.utc)
+    new_comments = 0
+    try:
+        result = await XhsService().sync_note_comments(note.cookies, note.note_url)
+        new_comments = result["new_comments_count"]
+        note.error_count = 0
+    except XhsError as e:
+        # 失败按没有新增处理，间隔同样退避，避免反复请求失效的 cookies 或被风控的笔记
+        note.error_count += 1
+        logger.warning(f"监控笔记{note_id}同步失败（连续{note.error_count}次）: {e.message}")
+
+    if note.last_polled_at is None:
+        # 第一次同步获取的是全部历史评论，不能反映新增速度
+        note.interval = settings.XHS_MONITOR_MIN_INTERVAL
+    else:
+        elapsed = (now - note.last_polled_at).total_seconds()
+        note.interval, note.velocity = next_interval(note.interval, note.velocity, new_comments, elapsed)
+    note.last_polled_at = now
+    note.last_new_comments = new_comments
+    note.next_due_at = now + timedelta(seconds=note.interval)
+    await note.save(update_fields=[
+        "interval", "velocity", "last_polled_at", "last_new_comments", "next_due_at", "error_count", "updated_at",
+    ])
+    await schedule(note_id, note.next_due_at.timestamp())
+
+    logger.info(f"监控笔记{note_id}新增{new_comments}条评论，{note.interval:.0f}秒后再次轮询")
+    return {"note_id": note_id, "new_comments": new_comments, "interval": note.interval}
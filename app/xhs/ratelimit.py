@@ -0,0 +1,143 @@
+"""Upstream request rate limiting."""
+
+import asyncio
+import time
+from typing import Dict
+
+from loguru import logger
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.redis import get_redis
+
+
+class AsyncTokenBucket:
+    """进程内的异步令牌桶
+
+    ``acquire`` 预先扣除令牌，令牌不足时记为欠账并等待到令牌补足为止，
+    所以并发的调用方会按到达顺序依次放行，不需要加锁。
+
+    Args:
+        rate (float): 每秒补充的令牌数，小于等于 0 时不限速
+        capacity (int): 桶容量，即允许的突发请求数
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+# 与 AsyncTokenBucket 相同的预扣算法，在 Redis 中原子执行，所有进程共享同一个桶。
+# 使用 Redis 服务器时间，不受各机器时钟偏差影响。返回需要等待的毫秒数。
+_ACQUIRE_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + (now - ts) * rate / 1000) - 1
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+local wait = 0
+if tokens < 0 then
+    wait = math.ceil(-tokens * 1000 / rate)
+end
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + wait + 1000)
+return wait
+"""
+
+
+class RedisTokenBucket:
+    """存放在 Redis 中、所有 web 和 SAQ worker 进程共享的令牌桶
+
+    Args:
+        key (str): 桶在 Redis 中的键
+        rate (float): 每秒补充的令牌数，小于等于 0 时不限速
+        capacity (int): 桶容量，即允许的突发请求数
+    """
+
+    def __init__(self, key: str, rate: float, capacity: int = 1):
+        self.key = key
+        self.rate = rate
+        self.capacity = max(1, capacity)
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        wait_ms = await get_redis().eval(_ACQUIRE_SCRIPT, 1, self.key, self.rate, self.capacity)
+        if wait_ms:
+            await asyncio.sleep(int(wait_ms) / 1000)
+
+
+def endpoint_family(uri: str) -> str:
+    """把接口路径归类到限速使用的接口族"""
+    path = uri.split('?', 1)[0]
+    if path == "/api/sns/web/v1/search/notes":
+        return "search"
+    if path == "/api/sns/web/v2/comment/page":
+        return "comment"
+    if path == "/api/sns/web/v2/comment/sub/page":
+        return "sub_comment"
+    if path == "/api/sns/web/v1/feed":
+        return "feed"
+    return "default"
+
+
+class UpstreamRateLimiter:
+    """按接口族限速
+
+    每个接口族一个令牌桶，速率取自 ``XHS_RATE_LIMITS``，未配置的接口族使用 ``XHS_RATE_LIMIT``。
+    ``XHS_RATE_LIMIT_BACKEND`` 为 ``redis`` 时令牌桶放在 Redis 中，整个集群共享限额；
+    Redis 不可用时退回到进程内的令牌桶，不会因此阻断请求。
+    """
+
+    # Redis 出错后改用进程内限速的时长（秒），避免每个请求都去连接不可用的 Redis
+    REDIS_RETRY_AFTER = 30
+
+    def __init__(self):
+        self._local: Dict[str, AsyncTokenBucket] = {}
+        self._redis: Dict[str, RedisTokenBucket] = {}
+        self._redis_down_until = 0.0
+
+    def _rate(self, family: str) -> float:
+        return settings.XHS_RATE_LIMITS.get(family, settings.XHS_RATE_LIMIT)
+
+    def _local_bucket(self, family: str) -> AsyncTokenBucket:
+        if family not in self._local:
+            self._local[family] = AsyncTokenBucket(self._rate(family), settings.XHS_RATE_LIMIT_BURST)
+        return self._local[family]
+
+    async def acquire(self, family: str = "default") -> None:
+        if settings.XHS_RATE_LIMIT_BACKEND == "redis" and time.monotonic() >= self._redis_down_until:
+            if family not in self._redis:
+                self._redis[family] = RedisTokenBucket(
+                    f"xhs:ratelimit:{family}", self._rate(family), settings.XHS_RATE_LIMIT_BURST
+                )
+            try:
+                await self._redis[family].acquire()
+                return
+            except (RedisError, OSError) as e:
+                self._redis_down_until = time.monotonic() + self.REDIS_RETRY_AFTER
+                logger.warning(f"Redis限速不可用，{self.REDIS_RETRY_AFTER}秒内使用进程内限速: {e}")
+        await self._local_bucket(family).acquire()
+
+
+# 本进程内所有小红书接口请求共享的限速器
+upstream_limiter = UpstreamRateLimiter()
@@ -0,0 +1,142 @@
+"""Compact records for normalized comments and notes."""
+
+from collections.abc import Mapping
+from dataclasses import dataclass, fields
+from datetime import datetime, tzinfo
+from functools import lru_cache
+from typing import Any, Dict, Iterator, MutableMapping, Optional, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import orjson
+
+
+class Record(Mapping):
+    """用 ``__slots__`` 存储字段的只读映射
+
+    每条记录只有固定的几个槽位，没有每个实例一份的 ``__dict__`` 和哈希表，内存占用明显小于同样内容的 dict。
+    同时实现 Mapping 接口，``record["note_id"]``、``record.get(...)``、``dict(record)`` 和与 dict 比较都和原来的 dict 一样；
+    子类是 dataclass，orjson 直接按槽位编码，不经过 dict。
+    """
+
+    __slots__ = ()
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.__dataclass_fields__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__dataclass_fields__)
+
+    def __len__(self) -> int:
+        return len(self.__dataclass_fields__)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+
+# eq=False 保留 Mapping 的比较方式，记录可以和 dict 比较
+@dataclass(eq=False)
+class CommentRecord(Record):
+    """规范化后的评论（根评论或子评论），字段与 CommentResponse 一致
+
+    create_time（毫秒级时间戳）是评论时间的唯一来源；note_time 默认为空，
+    只在调用方指定时区时由 TimeFormatter 填入。
+    """
+
+    __slots__ = (
+        "note_id", "content", "like_count", "nickname", "comment_id",
+        "root_comment_id", "parent_comment_id", "comment_location", "create_time", "note_time",
+    )
+
+    note_id: str
+    content: str
+    like_count: Any
+    nickname: str
+    comment_id: str
+    root_comment_id: Optional[str]
+    parent_comment_id: Optional[str]
+    comment_location: str
+    create_time: Optional[int]
+    note_time: Optional[str]
+
+
+@dataclass(eq=False)
+class RootCommentRecord(CommentRecord):
+    """不展开子评论时返回的根评论，sub_cursor 用于按需获取它的子评论，没有子评论时为空"""
+
+    __slots__ = ("sub_comment_count", "sub_cursor")
+
+    sub_comment_count: int
+    sub_cursor: Optional[str]
+
+
+@dataclass(eq=False)
+class NoteRecord(Record):
+    """搜索到的笔记"""
+
+    __slots__ = ("title", "note_id", "xsec_token", "url")
+
+    title: str
+    note_id: str
+    xsec_token: str
+    url: str
+
+
+class TimeFormatter:
+    """把毫秒级时间戳格式化为指定时区的 ``%Y-%m-%d %H:%M:%S``
+
+    按分钟缓存格式化结果，同一分钟内的评论只调用一次 strftime，秒数直接拼接。
+    """
+
+    def __init__(self, tz: tzinfo, cache_size: int = 4096):
+        self.tz = tz
+        self._minute = lru_cache(maxsize=cache_size)(self._format_minute)
+
+    def _format_minute(self, minute: int) -> str:
+        return datetime.fromtimestamp(minute * 60, self.tz).strftime("%Y-%m-%d %H:%M")
+
+    def format(self, create_time: Optional[int]) -> str:
+        if not create_time:
+            return "未知时间"
+        seconds = int(create_time) // 1000
+        return f"{self._minute(seconds // 60)}:{seconds % 60:02d}"
+
+    def date(self, create_time: Optional[int]) -> Optional[str]:
+        """时间戳所在的日期 ``%Y-%m-%d``，没有时间时返回 None"""
+        if not create_time:
+            return None
+        return self._minute(int(create_time) // 60000)[:10]
+
+    def apply(self, comment: Union[CommentRecord, MutableMapping[str, Any]]) -> Any:
+        """按 create_time 填入评论的 note_time，返回评论本身"""
+        note_time = self.format(comment.get("create_time"))
+        if isinstance(comment, Record):
+            comment.note_time = note_time
+        else:
+            comment["note_time"] = note_time
+        return comment
+
+
+@lru_cache(maxsize=32)
+def get_time_formatter(tz: str) -> TimeFormatter:
+    """按 IANA 时区名（如 ``Asia/Shanghai``、``UTC``）获取共享的 TimeFormatter
+
+    Raises:
+        ValueError: 未知的时区
+    """
+    try:
+        return TimeFormatter(ZoneInfo(tz))
+    except (ZoneInfoNotFoundError, ValueError) as e:
+        raise ValueError(f"未知的时区: {tz}") from e
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj: Any) -> bytes:
+    """用 orjson 编码，记录直接按槽位编码，其他 Mapping 转为 dict"""
+    return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
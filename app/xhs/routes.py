@@ -1,10 +1,16 @@
 """XHS API routes."""
 
 import asyncio
-from typing import List
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+import json
+from datetime import date
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Mapping, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from loguru import logger
 
+from app.core.config import settings
+from app.worker import queue
+
 from .schemas import (
     CommentRequest,
     CommentResponse,
@@ -13,46 +19,280 @@ from .schemas import (
     ApiResponse,
     UrlConvertRequest,
     UrlConvertResponse,
-    ReplyCommentRequest
+    ReplyCommentRequest,
+    JobResponse,
+    MonitorRequest,
+    ExportRequest,
+    SubCommentRequest,
+    SubCommentsResponse
 )
-from .xhs_api import XhsAPI
+from .cache import response_cache
+from .errors import XhsError
+from .export import iter_csv, iter_db_comments
+from .models import MonitoredNote
+from .monitor import add_note, remove_note
+from .records import TimeFormatter, dumps, get_time_formatter
+from .tasks import BATCH_FUNCTIONS, get_batch_results, iter_batch_comments, settle_batch
+from .xhs_api import AsyncXhsAPI, comment_projector, format_comment
 from .services import XhsService
 
-router = APIRouter(prefix="/xhs", tags=["XHS"])
+class XhsJSONResponse(JSONResponse):
+    """用 orjson 编码响应，评论和笔记记录直接按槽位编码"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def api_response(message: str, data: List[Any]) -> XhsJSONResponse:
+    """直接返回成功的 ApiResponse，跳过 response_model 对 data 中每条记录的校验和 jsonable_encoder 转换"""
+    return XhsJSONResponse({"success": True, "message": message, "data": data})
+
+
+def time_formatter(
+    tz: Optional[str] = Query(default=None, description="按该时区（如 Asia/Shanghai）填入 note_time，不传时只返回毫秒级时间戳 create_time")
+) -> Optional[TimeFormatter]:
+    """解析 tz 查询参数"""
+    if tz is None:
+        return None
+    try:
+        return get_time_formatter(tz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+class CommentOutput:
+    """由 fields、raw、expand、tz 查询参数决定的评论输出方式
+
+    options 传给 iter_comments / get_comments；finish 在输出前处理每条评论（需要时填入 note_time）。
+    """
+
+    def __init__(self, options: Dict[str, Any], formatter: Optional[TimeFormatter] = None):
+        self.options = options
+        self.formatter = formatter
+
+    def finish(self, comment: Any) -> Any:
+        return self.formatter.apply(comment) if self.formatter else comment
+
+
+def comment_output(
+    fields: Optional[str] = Query(default=None, description="只返回这些字段（逗号分隔，如 comment_id,content），未请求的字段不做处理"),
+    raw: bool = Query(default=False, description="原样返回接口返回的根评论，不规范化、不展开其余子评论"),
+    expand: bool = Query(default=True, description="为 false 时只返回根评论，每条带 sub_cursor，用 /xhs/get_sub_comments 按需展开"),
+    formatter: Optional[TimeFormatter] = Depends(time_formatter)
+) -> CommentOutput:
+    """解析 fields、raw 和 expand 查询参数"""
+    if raw:
+        if fields:
+            raise HTTPException(status_code=400, detail="fields 和 raw 不能同时使用")
+        return CommentOutput({"raw": True})
+    options: Dict[str, Any] = {} if expand else {"expand": False}
+    if fields:
+        try:
+            options["transform"] = comment_projector([field.strip() for field in fields.split(",") if field.strip()], formatter)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return CommentOutput(options)
+    return CommentOutput(options, formatter)
+
+
+async def _with_note_time(comments: AsyncIterable[Dict[str, Any]], formatter: TimeFormatter) -> AsyncIterator[Dict[str, Any]]:
+    async for comment in comments:
+        yield formatter.apply(comment)
+
+
+router = APIRouter(prefix="/xhs", tags=["XHS"], default_response_class=XhsJSONResponse)
 xhs_service = XhsService()
 
 
 @router.post("/get_comments", response_model=ApiResponse)
-async def get_comments(request: CommentRequest):
+async def get_comments(request: CommentRequest, output: CommentOutput = Depends(comment_output)):
     """获取小红书笔记评论
     
     Args:
         request: 包含cookies、note_url等参数的请求体
+        output: 由 fields、raw、expand、tz 查询参数决定的输出方式
         
     Returns:
         ApiResponse: 包含评论列表的响应
     """
     try:
-        api = XhsAPI()
-        comments = api.get_comments(
+        api = AsyncXhsAPI()
+        comments = await api.get_comments(
             cookies_str=request.cookies,
             ori_url=request.note_url,
             cursor=request.cursor or "",
-            max_comments=request.max_comments
+            max_comments=request.max_comments,
+            **output.options
         )
-
+        if output.formatter:
+            comments = [output.finish(comment) for comment in comments]
         
-        return ApiResponse(
-            success=True,
-            message=f"成功获取{len(comments)}条评论",
-            data=comments
-        )
+        return api_response(f"成功获取{len(comments)}条评论", comments)
         
     except Exception as e:
         logger.error(f"获取评论失败: {e}")
         raise HTTPException(status_code=500, detail=f"获取评论失败: {str(e)}")
 
 
+@router.post("/get_sub_comments", response_model=SubCommentsResponse)
+async def get_sub_comments(request: SubCommentRequest, output: CommentOutput = Depends(comment_output)):
+    """按 sub_cursor 展开一条根评论的子评论
+
+    sub_cursor 取自 expand=false 时根评论的 sub_cursor，或上一次调用返回的 sub_cursor；
+    返回的 sub_cursor 为空表示这条根评论的子评论已全部获取。
+
+    Args:
+        request: 包含cookies、sub_cursor、max_comments的请求体
+        output: 由 fields、tz 查询参数决定的输出方式
+
+    Returns:
+        SubCommentsResponse: 子评论列表和继续获取时使用的 sub_cursor
+    """
+    if output.options.get("raw"):
+        raise HTTPException(status_code=400, detail="获取子评论不支持 raw")
+    try:
+        api = AsyncXhsAPI()
+        sub_comments, sub_cursor = await api.fetch_sub_comments(
+            cookies_str=request.cookies,
+            sub_cursor=request.sub_cursor,
+            max_comments=request.max_comments,
+            transform=output.options.get("transform", format_comment)
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"获取子评论失败: {e}")
+        raise HTTPException(status_code=500, detail=f"获取子评论失败: {str(e)}")
+    if output.formatter:
+        sub_comments = [output.finish(comment) for comment in sub_comments]
+    return XhsJSONResponse({
+        "success": True,
+        "message": f"成功获取{len(sub_comments)}条子评论",
+        "data": sub_comments,
+        "sub_cursor": sub_cursor
+    })
+
+
+def _encode_record(event: str, record: Mapping[str, Any], fmt: str) -> bytes:
+    data = dumps(record)
+    if fmt == "sse":
+        return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+    return data + b"\n"
+
+
+async def _stream_comments(request: CommentRequest, fmt: str, output: CommentOutput) -> AsyncIterator[bytes]:
+    api = AsyncXhsAPI()
+    progress: Dict[str, Any] = {}
+    try:
+        async for comment in api.iter_comments(
+            cookies_str=request.cookies,
+            note_url=request.note_url,
+            cursor=request.cursor or "",
+            max_comments=request.max_comments,
+            progress=progress,
+            **output.options
+        ):
+            yield _encode_record("comment", output.finish(comment), fmt)
+    except XhsError as e:
+        logger.error(f"流式获取评论失败: {e.message}")
+        progress['error'] = {'type': type(e).__name__, 'message': e.message}
+    except Exception as e:
+        # 响应头已经发出，只能在 summary 中告知失败，客户端据此区分中断和正常结束
+        logger.exception(f"流式获取评论失败: {e}")
+        progress['error'] = {'type': type(e).__name__, 'message': str(e)}
+    yield _encode_record("summary", {"type": "summary", **progress}, fmt)
+
+
+@router.post("/get_comments/stream")
+async def get_comments_stream(
+    request: CommentRequest,
+    format: str = Query(default="ndjson", pattern="^(ndjson|sse)$", description="输出格式：ndjson 或 sse"),
+    output: CommentOutput = Depends(comment_output)
+):
+    """流式获取小红书笔记评论
+
+    每获取到一页评论就立即输出，不等待全部评论获取完成。ndjson 格式每行一条评论，
+    sse 格式每条评论是一个 comment 事件。最后输出一条 summary 记录（sse 为 summary 事件），
+    包含 count（评论数量）、cursor（继续获取时使用的游标）和 has_more（是否还有更多评论），
+    上游请求失败时还包含 error。
+
+    Args:
+        request: 包含cookies、note_url等参数的请求体
+        format: 输出格式
+        output: 由 fields、raw、expand、tz 查询参数决定的输出方式
+
+    Returns:
+        StreamingResponse: 评论流
+    """
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        _stream_comments(request, format, output),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _csv_response(
+    comments: AsyncIterable[Dict[str, Any]], name: str, compress: bool, formatter: Optional[TimeFormatter]
+) -> StreamingResponse:
+    filename = f"{name}.csv.gz" if compress else f"{name}.csv"
+    if formatter:
+        comments = _with_note_time(comments, formatter)
+    return StreamingResponse(
+        iter_csv(comments, compress),
+        media_type="application/gzip" if compress else "text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
+async def _crawl_comments(request: CommentRequest) -> AsyncIterator[Dict[str, Any]]:
+    try:
+        async for comment in AsyncXhsAPI().iter_comments(
+            cookies_str=request.cookies,
+            note_url=request.note_url,
+            cursor=request.cursor or "",
+            max_comments=request.max_comments
+        ):
+            yield comment
+    except XhsError as e:
+        # 响应头已经发出，只能截断输出
+        logger.error(f"导出评论CSV失败: {e.message}")
+    except Exception as e:
+        # 非上游错误（如 Cookie 中没有 a1）同样截断输出，不中断响应
+        logger.exception(f"导出评论CSV失败: {e}")
+
+
+@router.post("/get_comments/csv")
+async def get_comments_csv(
+    request: CommentRequest,
+    gzip: bool = Query(default=False, description="是否 gzip 压缩"),
+    formatter: Optional[TimeFormatter] = Depends(time_formatter)
+):
+    """边采集边以 CSV 文件下载笔记评论，上游请求中途失败时文件在失败处截断
+    
+    Args:
+        request: 包含cookies、note_url等参数的请求体
+        gzip: 是否 gzip 压缩
+        formatter: 由 tz 查询参数决定，指定时填入评论的 note_time
+        
+    Returns:
+        StreamingResponse: CSV 文件
+    """
+    return _csv_response(_crawl_comments(request), "xhs_comments", gzip, formatter)
+
+
+@router.get("/export/comments.csv")
+async def export_comments_csv(
+    keyword: Optional[str] = Query(default=None, description="只导出该关键词的评论"),
+    start_date: Optional[date] = Query(default=None, description="评论日期下限（含）"),
+    end_date: Optional[date] = Query(default=None, description="评论日期上限（含）"),
+    gzip: bool = Query(default=False, description="是否 gzip 压缩"),
+    formatter: Optional[TimeFormatter] = Depends(time_formatter)
+):
+    """以 CSV 文件下载已入库的评论，按批读取数据库边读边输出"""
+    return _csv_response(iter_db_comments(keyword, start_date, end_date), "xhs_comments", gzip, formatter)
+
+
 @router.post("/search_notes_by_keyword", response_model=ApiResponse)
 async def search_notes_by_keyword(request: SearchRequest):
     """根据关键词搜索小红书笔记
@@ -64,50 +304,42 @@ async def search_notes_by_keyword(request: SearchRequest):
         ApiResponse: 包含笔记列表的响应
     """
     try:
-        api = XhsAPI()
-        notes = api.search_notes_by_keyword(
+        api = AsyncXhsAPI()
+        notes = await api.search_notes_by_keyword(
             cookies_str=request.cookies,
             keyword=request.keyword,
             num=request.num
         )
 
         
-        return ApiResponse(
-            success=True,
-            message=f"成功搜索到{len(notes)}条笔记",
-            data=notes
-        )
+        return api_response(f"成功搜索到{len(notes)}条笔记", notes)
         
     except Exception as e:
         logger.error(f"搜索笔记失败: {e}")
         raise HTTPException(status_code=500, detail=f"搜索笔记失败: {str(e)}")
 
 @router.post("/search_comments_by_keyword", response_model=ApiResponse)
-async def search_comments_by_keyword(request: SearchRequest):
+async def search_comments_by_keyword(request: SearchRequest, formatter: Optional[TimeFormatter] = Depends(time_formatter)):
     """根据关键词搜索小红书评论
 
     Args:
         request: 包含cookies、keyword、num等参数的请求体
+        formatter: 由 tz 查询参数决定，指定时填入评论的 note_time
         
     Returns:
         ApiResponse: 包含笔记列表的响应
     """
     try:
-        api = XhsAPI()
-        comments_list = []
-        comments_list = api.search_comments_by_keyword(
+        api = AsyncXhsAPI()
+        comments_list = await api.search_comments_by_keyword(
             cookies_str=request.cookies,
             keyword=request.keyword,
-            num=request.num,
-            comments_list=comments_list
+            num=request.num
         )
-
+        if formatter:
+            comments_list = [formatter.apply(comment) for comment in comments_list]
         
-        return ApiResponse(
-            success=True,
-            message=f"成功搜索到{len(comments_list)}条评论",
-            data=comments_list
-        )
+        return api_response(f"成功搜索到{len(comments_list)}条评论", comments_list)
         
     except Exception as e:
         logger.error(f"搜索评论失败: {e}")
@@ -120,25 +352,34 @@ async def health_check():
     return {"status": "healthy", "service": "xhs-api"}
 
 
+@router.get("/cache/stats")
+async def cache_stats():
+    """上游响应缓存各命名空间的命中、过期和未命中次数"""
+    return await response_cache.stats()
+
+
 @router.post("/comments/batch", response_model=ApiResponse)
-async def get_comments_batch(requests: List[CommentRequest], background_tasks: BackgroundTasks):
+async def get_comments_batch(requests: List[CommentRequest]):
     """批量获取多个笔记的评论
     
     Args:
         requests: 包含多个评论请求的列表
-        background_tasks: 后台任务
         
     Returns:
-        ApiResponse: 批量处理结果
+        ApiResponse: 包含后台任务ID的响应，通过 GET /xhs/jobs/{job_id} 查询进度和结果
     """
     try:
-        # 添加到后台任务队列
-        background_tasks.add_task(xhs_service.process_batch_comments, requests)
+        job = await queue.enqueue(
+            "xhs_batch_comments",
+            requests=[request.dict() for request in requests],
+            timeout=settings.XHS_JOB_TIMEOUT,
+            ttl=settings.XHS_JOB_TTL
+        )
         
         return ApiResponse(
             success=True,
             message=f"已提交{len(requests)}个批量任务到后台处理",
-            data=[]
+            data=[{"job_id": job.key}]
         )
         
     except Exception as e:
@@ -147,24 +388,27 @@ async def get_comments_batch(requests: List[CommentRequest], background_tasks: B
 
 
 @router.post("/search/batch", response_model=ApiResponse)
-async def search_notes_batch(requests: List[SearchRequest], background_tasks: BackgroundTasks):
+async def search_notes_batch(requests: List[SearchRequest]):
     """批量搜索多个关键词的笔记
     
     Args:
         requests: 包含多个搜索请求的列表
-        background_tasks: 后台任务
         
     Returns:
-        ApiResponse: 批量处理结果
+        ApiResponse: 包含后台任务ID的响应，通过 GET /xhs/jobs/{job_id} 查询进度和结果
     """
     try:
-        # 添加到后台任务队列
-        background_tasks.add_task(xhs_service.process_batch_search, requests)
+        job = await queue.enqueue(
+            "xhs_batch_search",
+            requests=[request.dict() for request in requests],
+            timeout=settings.XHS_JOB_TIMEOUT,
+            ttl=settings.XHS_JOB_TTL
+        )
         
         return ApiResponse(
             success=True,
             message=f"已提交{len(requests)}个批量搜索任务到后台处理",
-            data=[]
+            data=[{"job_id": job.key}]
         )
         
     except Exception as e:
@@ -172,6 +416,139 @@ async def search_notes_batch(requests: List[SearchRequest], background_tasks: Ba
         raise HTTPException(status_code=500, detail=f"批量搜索失败: {str(e)}")
 
 
+@router.post("/export", response_model=ApiResponse)
+async def export_parquet(request: ExportRequest):
+    """把已入库的评论或笔记导出为按关键词和日期分区的 Parquet 文件
+    
+    Args:
+        request: 导出类型、关键词和日期范围
+        
+    Returns:
+        ApiResponse: 包含后台任务ID的响应，任务结果为导出行数和文件列表
+    """
+    try:
+        job = await queue.enqueue(
+            "xhs_export_parquet",
+            request=json.loads(request.json()),
+            timeout=settings.XHS_JOB_TIMEOUT,
+            ttl=settings.XHS_JOB_TTL
+        )
+        
+        return ApiResponse(
+            success=True,
+            message="已提交导出任务到后台处理",
+            data=[{"job_id": job.key}]
+        )
+        
+    except Exception as e:
+        logger.error(f"提交导出任务失败: {e}")
+        raise HTTPException(status_code=500, detail=f"提交导出任务失败: {str(e)}")
+
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """查询后台任务的状态和结果
+    
+    Args:
+        job_id: 批量接口返回的任务ID
+        
+    Returns:
+        JobResponse: 任务状态、进度和结果
+    """
+    job = await queue.job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    
+    status, progress, result = job.status, job.progress, job.result
+    counters = None
+    if job.function in BATCH_FUNCTIONS:
+        # 批量任务的状态和结果由子任务汇总
+        counters = await settle_batch(queue, job.key)
+        if counters:
+            finished = counters["success"] + counters["failed"]
+            progress = finished / counters["total"] if counters["total"] else 1.0
+            if finished >= counters["total"]:
+                result = await get_batch_results(queue, job.key, counters["total"])
+            else:
+                status, result = "active", None
+    
+    return JobResponse(
+        job_id=job.key,
+        function=job.function,
+        status=status,
+        progress=progress,
+        result=result,
+        error=job.error,
+        queued=job.queued,
+        started=job.started,
+        completed=job.completed,
+        counters=counters
+    )
+
+
+@router.get("/jobs/{job_id}/comments.csv")
+async def get_job_comments_csv(
+    job_id: str,
+    gzip: bool = Query(default=False, description="是否 gzip 压缩"),
+    formatter: Optional[TimeFormatter] = Depends(time_formatter)
+):
+    """以 CSV 文件下载批量获取评论任务的全部评论，按子任务逐个读取"""
+    job = await queue.job(job_id)
+    if job is None or job.function != "xhs_batch_comments":
+        raise HTTPException(status_code=404, detail="批量评论任务不存在或已过期")
+    counters = await settle_batch(queue, job.key)
+    if not counters or counters["success"] + counters["failed"] < counters["total"]:
+        raise HTTPException(status_code=409, detail="任务尚未完成")
+    return _csv_response(iter_batch_comments(queue, job.key, counters["total"]), f"xhs_comments_{job.key}", gzip, formatter)
+
+
+@router.post("/monitor", response_model=ApiResponse)
+async def monitor_note(request: MonitorRequest):
+    """开始定时监控笔记的新增评论
+    
+    新增评论由后台定时任务增量同步入库，轮询间隔随评论活跃程度自动调整
+    
+    Args:
+        request: 包含cookies、note_url等参数的请求体
+        
+    Returns:
+        ApiResponse: 包含笔记ID和下次轮询时间的响应
+    """
+    try:
+        note = await add_note(request.cookies, request.note_url, request.user_info, request.keyword)
+    except Exception as e:
+        logger.error(f"添加监控失败: {e}")
+        raise HTTPException(status_code=500, detail=f"添加监控失败: {str(e)}")
+    
+    return ApiResponse(
+        success=True,
+        message=f"已开始监控笔记{note.note_id}",
+        data=[{"note_id": note.note_id, "next_due_at": note.next_due_at.isoformat()}]
+    )
+
+
+@router.get("/monitor", response_model=ApiResponse)
+async def list_monitored_notes(limit: int = Query(default=100, ge=1, le=1000), offset: int = Query(default=0, ge=0)):
+    """列出监控中的笔记，按下次轮询时间排序"""
+    notes = await MonitoredNote.filter(enabled=True).order_by("next_due_at").offset(offset).limit(limit).values(
+        "note_id", "note_url", "user_info", "keyword", "interval", "velocity",
+        "next_due_at", "last_polled_at", "last_new_comments", "error_count"
+    )
+    return ApiResponse(
+        success=True,
+        message=f"共{len(notes)}条监控中的笔记",
+        data=notes
+    )
+
+
+@router.delete("/monitor/{note_id}", response_model=ApiResponse)
+async def unmonitor_note(note_id: str):
+    """停止监控笔记"""
+    if not await remove_note(note_id):
+        raise HTTPException(status_code=404, detail="笔记不在监控中")
+    return ApiResponse(success=True, message=f"已停止监控笔记{note_id}", data=[])
+
+
 @router.post("/reply_comment", response_model=ApiResponse)
 async def reply_comment(request: ReplyCommentRequest):
     """回复小红书评论
@@ -183,8 +560,8 @@ async def reply_comment(request: ReplyCommentRequest):
         ApiResponse: 回复结果响应
     """
     try:
-        api = XhsAPI()
-        api.reply_comment(
+        api = AsyncXhsAPI()
+        await api.reply_comment(
             cookies_str=request.cookies,
             note_id=request.note_id,
             comment_id=request.comment_id,
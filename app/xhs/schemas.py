@@ -1,6 +1,7 @@
 """Pydantic schemas for XHS API."""
 
-from typing import List, Optional
+from datetime import date
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, Field
 
 
@@ -11,7 +12,17 @@ class CommentResponse(BaseModel):
     nickname: str = Field(..., description="用户昵称")
     comment_id: str = Field(..., description="评论ID")
     comment_location: str = Field(default="", description="IP位置")
-    note_time: str = Field(..., description="评论时间")
+    note_time: Optional[str] = Field(default=None, description="评论时间，只在请求指定 tz 时按该时区格式化")
+    note_id: Optional[str] = Field(default=None, description="笔记ID")
+    root_comment_id: Optional[str] = Field(default=None, description="子评论所属的根评论ID，根评论为空")
+    parent_comment_id: Optional[str] = Field(default=None, description="子评论回复的评论ID，根评论为空")
+    create_time: Optional[int] = Field(default=None, description="评论时间（毫秒级时间戳）")
+
+
+class RootCommentResponse(CommentResponse):
+    """不展开子评论时的根评论响应模型"""
+    sub_comment_count: int = Field(default=0, description="子评论数量")
+    sub_cursor: Optional[str] = Field(default=None, description="获取子评论的游标，传给 /xhs/get_sub_comments，没有子评论时为空")
 
 
 class NoteResponse(BaseModel):
@@ -32,6 +43,13 @@ class CommentRequest(BaseModel):
     cursor: Optional[str] = Field(default="", description="分页游标")
 
 
+class SubCommentRequest(BaseModel):
+    """获取子评论请求模型"""
+    cookies: str = Field(..., description="Cookie字符串")
+    sub_cursor: str = Field(..., description="根评论的 sub_cursor 或上次返回的 sub_cursor")
+    max_comments: Optional[int] = Field(default=None, ge=1, description="最多返回的子评论数量，不传时返回全部")
+
+
 class SearchRequest(BaseModel):
     """搜索笔记请求模型"""
     cookies: str = Field(..., description="Cookie字符串")
@@ -39,6 +57,22 @@ class SearchRequest(BaseModel):
     num: int = Field(default=20, ge=1, le=100, description="搜索数量")
 
 
+class MonitorRequest(BaseModel):
+    """监控笔记评论请求模型"""
+    cookies: str = Field(..., description="Cookie字符串")
+    note_url: str = Field(..., description="笔记URL")
+    user_info: str = Field(default="", description="客户标识")
+    keyword: str = Field(default="", description="关键词")
+
+
+class ExportRequest(BaseModel):
+    """导出 Parquet 请求模型"""
+    kind: str = Field(default="comments", regex="^(comments|notes)$", description="导出评论（comments）或笔记（notes）")
+    keyword: Optional[str] = Field(default=None, description="只导出该关键词的数据，不传导出全部")
+    start_date: Optional[date] = Field(default=None, description="评论日期下限（含），只对评论有效")
+    end_date: Optional[date] = Field(default=None, description="评论日期上限（含），只对评论有效")
+
+
 class ApiResponse(BaseModel):
     """通用API响应模型"""
     success: bool = Field(..., description="是否成功")
@@ -46,6 +80,11 @@ class ApiResponse(BaseModel):
     data: Optional[List] = Field(default=None, description="响应数据")
 
 
+class SubCommentsResponse(ApiResponse):
+    """获取子评论响应模型"""
+    sub_cursor: Optional[str] = Field(default=None, description="继续获取的游标，已取完时为空")
+
+
 class UrlConvertRequest(BaseModel):
     """URL转换请求模型"""
     url: str = Field(..., description="原始URL")
@@ -65,4 +104,18 @@ class ReplyCommentRequest(BaseModel):
     cookies: str = Field(..., description="Cookie字符串")
     note_id: str = Field(..., description="笔记ID")
     comment_id: str = Field(..., description="评论ID")
-    content: str = Field(..., description="回复内容")
\ No newline at end of file
+    content: str = Field(..., description="回复内容")
+
+
+class JobResponse(BaseModel):
+    """后台任务状态响应模型"""
+    job_id: str = Field(..., description="任务ID")
+    function: str = Field(..., description="任务类型")
+    status: str = Field(..., description="任务状态：new、queued、active、complete、failed、aborted")
+    progress: float = Field(default=0.0, description="任务进度 0~1")
+    result: Optional[Any] = Field(default=None, description="任务结果")
+    error: Optional[str] = Field(default=None, description="失败原因")
+    queued: int = Field(default=0, description="入队时间（毫秒级时间戳）")
+    started: int = Field(default=0, description="开始时间（毫秒级时间戳）")
+    completed: int = Field(default=0, description="完成时间（毫秒级时间戳）")
+    counters: Optional[Dict[str, int]] = Field(default=None, description="批量任务计数：total、success、failed、items")
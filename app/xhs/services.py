@@ -1,19 +1,24 @@
 """XHS service layer for business logic and background tasks."""
 
-import asyncio
-from typing import List, Dict, Any
+import os
+from typing import Any, AsyncIterable, Dict, Iterable, List, Optional, Union
 from loguru import logger
-from datetime import datetime
+from datetime import date, datetime
 
+from app.core.config import settings
 from .schemas import CommentRequest, SearchRequest
-from .xhs_api import XhsAPI
+from .client import close_session
+from .export import NdjsonWriter, export_comments, export_notes, iter_db_comments, iter_db_notes, write_csv
+from .storage import CommentWriter, finish_run, get_sync_state, mark_note_crawled, start_run, upsert_comments, upsert_notes
+from .xhs_api import AsyncXhsAPI
+from .xhs_utils.xhs_util import convert_discovery_to_explore_url
 
 
 class XhsService:
     """XHS业务服务类"""
     
     def __init__(self):
-        self.api = XhsAPI()
+        self.api = AsyncXhsAPI()
     
     async def process_batch_comments(self, requests: List[CommentRequest]) -> List[Dict[str, Any]]:
         """批量处理评论获取任务
@@ -27,44 +32,118 @@ class XhsService:
         results = []
         
         for i, request in enumerate(requests):
+            logger.info(f"处理第{i+1}/{len(requests)}个评论任务: {request.note_url}")
+            results.append(await self.process_comment_request(i + 1, request))
+        
+        return results
+    
+    async def process_comment_request(self, task_id: int, request: CommentRequest, comments_file: Optional[str] = None) -> Dict[str, Any]:
+        """处理批量任务中的单个评论获取请求
+        
+        Args:
+            task_id: 请求在批量任务中的序号（从1开始）
+            request: 评论请求
+            comments_file: 把评论逐条写入该 NDJSON 文件，结果中只保存文件路径，不保存评论列表
+            
+        Returns:
+            Dict: 处理结果
+        """
+        crawl_run, writer = None, None
+        spool = NdjsonWriter(comments_file) if comments_file else None
+        comments = []
+        count, note_id = 0, None
+        try:
+            crawl_run = await start_run("comments", request.note_url) if settings.XHS_PERSIST else None
+            writer = CommentWriter(crawl_run) if crawl_run else None
+            error = None
             try:
-                logger.info(f"处理第{i+1}/{len(requests)}个评论任务: {request.note_url}")
-                
-                comments = self.api.get_comments(
-                    cookies_str=request.cookies,
-                    ori_url=request.note_url,
-                    cursor=request.cursor or "",
-                    max_comments=request.max_comments
-                )
-                
-                result = {
-                    "task_id": i + 1,
-                    "note_url": request.note_url,
-                    "status": "success",
-                    "comments_count": len(comments),
-                    "comments": comments,
-                    "processed_at": datetime.now().isoformat()
-                }
-                
-                logger.info(f"任务{i+1}完成，获取{len(comments)}条评论")
-                
+                async for comment in self.api.iter_comments(
+                    request.cookies,
+                    request.note_url,
+                    request.cursor or "",
+                    request.max_comments
+                ):
+                    count += 1
+                    note_id = note_id or comment["note_id"]
+                    if spool:
+                        await spool.write(comment)
+                    else:
+                        comments.append(comment)
+                    if writer:
+                        await writer.add(comment)
             except Exception as e:
-                logger.error(f"任务{i+1}失败: {e}")
-                result = {
-                    "task_id": i + 1,
-                    "note_url": request.note_url,
-                    "status": "failed",
-                    "error": str(e),
-                    "processed_at": datetime.now().isoformat()
-                }
+                error = e
+            finally:
+                if spool:
+                    await spool.close()
+            
+            if crawl_run:
+                # 中途失败时已经获取到的评论同样入库；入库失败时任务同样记为失败
+                await writer.flush()
+                if note_id:
+                    xsec_token = self.api.extract_url_params(request.note_url).get("xsec_token", "")
+                    await mark_note_crawled(note_id, xsec_token, request.note_url)
+                await finish_run(crawl_run, str(error) if error else None, comment_count=writer.written)
+            if error:
+                raise error
+            
+            result = {
+                "task_id": task_id,
+                "note_url": request.note_url,
+                "status": "success",
+                "comments_count": count,
+                **({"comments_file": comments_file} if spool else {"comments": comments}),
+                "processed_at": datetime.now().isoformat()
+            }
             
-            results.append(result)
+            logger.info(f"任务{task_id}完成，获取{count}条评论")
             
-            # 添加延迟避免请求过于频繁
-            if i < len(requests) - 1:
-                await asyncio.sleep(2)
+        except Exception as e:
+            logger.error(f"任务{task_id}失败: {e}")
+            result = {
+                "task_id": task_id,
+                "note_url": request.note_url,
+                "status": "failed",
+                "error": str(e),
+                "processed_at": datetime.now().isoformat()
+            }
         
-        return results
+        if crawl_run:
+            result["crawl_run_id"] = crawl_run.id
+        
+        return result
+    
+    async def sync_note_comments(self, cookies_str: str, note_url: str) -> Dict[str, Any]:
+        """增量同步笔记评论：只获取并入库上次同步之后的新增评论
+        
+        评论数没有变化时只请求一次笔记信息；有变化时翻页到已入库的最新根评论为止。
+        
+        Args:
+            cookies_str: Cookie字符串
+            note_url: 笔记URL
+            
+        Returns:
+            Dict: note_id、comment_count（上游评论数）、new_comments_count 和 comments（新增评论）
+        """
+        if "discovery" in note_url:
+            note_url = convert_discovery_to_explore_url(note_url)
+        params = self.api.extract_url_params(note_url)
+        note_id = params["note_id"]
+        
+        state = await get_sync_state(note_id)
+        _, comments = await self.api.fetch_new_comments(cookies_str, note_url, state)
+        await upsert_comments(comments)
+        
+        # 获取中途失败时 state 不会推进，下次从原来的高水位线重新获取
+        await mark_note_crawled(note_id, params.get("xsec_token", ""), note_url, state)
+        
+        logger.info(f"笔记{note_id}增量同步完成，新增{len(comments)}条评论")
+        return {
+            "note_id": note_id,
+            "comment_count": state.get("comment_count"),
+            "new_comments_count": len(comments),
+            "comments": comments
+        }
     
     async def process_batch_search(self, requests: List[SearchRequest]) -> List[Dict[str, Any]]:
         """批量处理搜索任务
@@ -78,43 +157,56 @@ class XhsService:
         results = []
         
         for i, request in enumerate(requests):
-            try:
-                logger.info(f"处理第{i+1}/{len(requests)}个搜索任务: {request.keyword}")
-                
-                notes = self.api.search_notes_by_keyword(
-                    cookies_str=request.cookies,
-                    keyword=request.keyword,
-                    num=request.num
-                )
-                
-                result = {
-                    "task_id": i + 1,
-                    "keyword": request.keyword,
-                    "status": "success",
-                    "notes_count": len(notes),
-                    "notes": notes,
-                    "processed_at": datetime.now().isoformat()
-                }
-                
-                logger.info(f"搜索任务{i+1}完成，找到{len(notes)}条笔记")
-                
-            except Exception as e:
-                logger.error(f"搜索任务{i+1}失败: {e}")
-                result = {
-                    "task_id": i + 1,
-                    "keyword": request.keyword,
-                    "status": "failed",
-                    "error": str(e),
-                    "processed_at": datetime.now().isoformat()
-                }
+            logger.info(f"处理第{i+1}/{len(requests)}个搜索任务: {request.keyword}")
+            results.append(await self.process_search_request(i + 1, request))
+        
+        return results
+    
+    async def process_search_request(self, task_id: int, request: SearchRequest) -> Dict[str, Any]:
+        """处理批量任务中的单个搜索请求
+        
+        Args:
+            task_id: 请求在批量任务中的序号（从1开始）
+            request: 搜索请求
+            
+        Returns:
+            Dict: 处理结果
+        """
+        crawl_run = await start_run("search", request.keyword) if settings.XHS_PERSIST else None
+        notes = []
+        try:
+            async for note in self.api.iter_search_notes(request.cookies, request.keyword):
+                notes.append(note)
+                if len(notes) >= request.num:
+                    break
             
-            results.append(result)
+            result = {
+                "task_id": task_id,
+                "keyword": request.keyword,
+                "status": "success",
+                "notes_count": len(notes),
+                "notes": [{"title": note["title"], "url": note["url"]} for note in notes],
+                "processed_at": datetime.now().isoformat()
+            }
             
-            # 添加延迟避免请求过于频繁
-            if i < len(requests) - 1:
-                await asyncio.sleep(2)
+            logger.info(f"搜索任务{task_id}完成，找到{len(notes)}条笔记")
+            
+        except Exception as e:
+            logger.error(f"搜索任务{task_id}失败: {e}")
+            result = {
+                "task_id": task_id,
+                "keyword": request.keyword,
+                "status": "failed",
+                "error": str(e),
+                "processed_at": datetime.now().isoformat()
+            }
         
-        return results
+        if crawl_run:
+            note_count = await upsert_notes(notes, request.keyword)
+            await finish_run(crawl_run, result.get("error"), note_count=note_count)
+            result["crawl_run_id"] = crawl_run.id
+        
+        return result
     
     async def get_note_info(self, cookies_str: str, note_url: str) -> Dict[str, Any]:
         """获取笔记基本信息
@@ -156,7 +248,7 @@ class XhsService:
         """
         try:
             # 尝试进行一个简单的搜索来验证cookies
-            notes = self.api.search_notes_by_keyword(
+            notes = await self.api.search_notes_by_keyword(
                 cookies_str=cookies_str,
                 keyword="测试",
                 num=1
@@ -169,40 +261,63 @@ class XhsService:
             logger.warning(f"Cookies验证失败: {e}")
             return False
     
-    async def export_comments_to_csv(self, comments: List[Dict], filename: str = None) -> str:
+    async def export_comments_to_csv(
+        self,
+        comments: Union[Iterable[Dict], AsyncIterable[Dict]],
+        filename: str = None,
+        compress: bool = False
+    ) -> str:
         """将评论导出为CSV文件
         
+        评论边读边写，可以直接传入 iter_comments 或 iter_db_comments，内存占用与评论数量无关。
+        
         Args:
-            comments: 评论列表
+            comments: 评论列表或异步迭代器
             filename: 文件名，如果不提供则自动生成
+            compress: 是否 gzip 压缩，自动生成的文件名以 .csv.gz 结尾
             
         Returns:
             str: 导出的文件路径
         """
-        import csv
-        import os
-        
         if not filename:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"xhs_comments_{timestamp}.csv"
-        
-        # 确保导出目录存在
-        export_dir = "exports"
-        os.makedirs(export_dir, exist_ok=True)
-        filepath = os.path.join(export_dir, filename)
+            filename = f"xhs_comments_{timestamp}.csv" + (".gz" if compress else "")
+        filepath = os.path.join(settings.XHS_EXPORT_DIR, filename)
         
         try:
-            with open(filepath, 'w', newline='', encoding='utf-8-sig') as csvfile:
-                if comments:
-                    fieldnames = comments[0].keys()
-                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-                    writer.writeheader()
-                    writer.writerows(comments)
-            
-            logger.info(f"评论已导出到: {filepath}")
+            rows = await write_csv(comments, filepath, compress)
+            logger.info(f"{rows}条评论已导出到: {filepath}")
             return filepath
             
         except Exception as e:
             logger.error(f"导出CSV失败: {e}")
             raise
-    
+
+    async def export_to_parquet(
+        self,
+        kind: str = "comments",
+        keyword: Optional[str] = None,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None
+    ) -> Dict[str, Any]:
+        """把已入库的评论或笔记按关键词和日期分区导出为 Parquet
+        
+        数据按批从数据库读取，边读边写，内存占用与导出的总行数无关。
+        正在采集的评论可以直接把 iter_comments 传给 export.export_comments。
+        
+        Args:
+            kind: comments 或 notes
+            keyword: 只导出该关键词的数据
+            start_date: 评论日期下限（含）
+            end_date: 评论日期上限（含）
+            
+        Returns:
+            Dict: rows（导出行数）和 files（写入的文件）
+        """
+        if kind == "notes":
+            return await export_notes(iter_db_notes(keyword))
+        return await export_comments(iter_db_comments(keyword, start_date, end_date))
+
+    async def close(self) -> None:
+        """关闭共享的HTTP会话"""
+        await close_session()
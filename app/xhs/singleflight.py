@@ -0,0 +1,151 @@
+"""Single-flight coalescing of identical concurrent upstream requests."""
+
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict
+
+from loguru import logger
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.redis import get_redis
+
+SINGLE_FLIGHT_PREFIX = "xhs:singleflight"
+
+# 只在锁仍属于自己时释放，执行超过锁时长后不会误删别人的锁
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_MISSING = object()
+
+
+class SingleFlight:
+    """同一时刻相同 key 的请求只执行一次，结果分享给所有等待者
+
+    进程内用 Future 合并；``XHS_SINGLE_FLIGHT_BACKEND`` 为 ``redis`` 时还通过 Redis 锁跨进程合并：
+    拿到锁的进程请求上游，把结果写入短时有效的结果键并发布到同名频道，其他进程订阅等待。
+    请求失败、等待超过 ``XHS_SINGLE_FLIGHT_TIMEOUT`` 或 Redis 不可用时，等待者自己请求上游。
+    """
+
+    # 结果键的保留时长（秒），覆盖等待者订阅之前结果就已发布的情况
+    RESULT_TTL = 5
+    # Redis 出错后只在进程内合并的时长（秒）
+    REDIS_RETRY_AFTER = 30
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._redis_down_until = 0.0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 fn，或者等待正在执行的相同 key 的调用并返回它的结果
+
+        Args:
+            key (str): 请求的标识，如接口、笔记ID和游标
+            fn: 请求上游的协程函数，结果需要能序列化为 JSON
+
+        Returns:
+            fn 的结果（可能来自其他调用方）
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # 执行者被取消了，自己重新执行
+                    return await self.do(key, fn)
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        # 没有等待者时不报告 "exception was never retrieved"
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            result = await self._run(key, fn)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._calls.pop(key, None)
+
+    async def _run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if settings.XHS_SINGLE_FLIGHT_BACKEND != "redis" or time.monotonic() < self._redis_down_until:
+            return await fn()
+
+        name = f"{SINGLE_FLIGHT_PREFIX}:{hashlib.sha1(key.encode('utf-8')).hexdigest()}"
+        token = uuid.uuid4().hex
+        redis = get_redis()
+        try:
+            leader = await redis.set(f"{name}:lock", token, nx=True, px=int(settings.XHS_SINGLE_FLIGHT_TIMEOUT * 1000))
+        except (RedisError, OSError) as e:
+            self._redis_unavailable(e)
+            return await fn()
+
+        if not leader:
+            shared = await self._wait(name)
+            return await fn() if shared is _MISSING else shared
+
+        try:
+            result = await fn()
+        except BaseException:
+            await self._publish(name, token, {"ok": False})
+            raise
+        await self._publish(name, token, {"ok": True, "v": result})
+        return result
+
+    async def _publish(self, name: str, token: str, entry: Dict[str, Any]) -> None:
+        payload = json.dumps(entry, ensure_ascii=False)
+        redis = get_redis()
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                if entry["ok"]:
+                    pipe.set(f"{name}:result", payload, ex=self.RESULT_TTL)
+                pipe.publish(name, payload)
+                pipe.eval(_RELEASE_SCRIPT, 1, f"{name}:lock", token)
+                await pipe.execute()
+        except (RedisError, OSError) as e:
+            self._redis_unavailable(e)
+
+    async def _wait(self, name: str) -> Any:
+        """等待其他进程发布的结果，拿不到时返回 _MISSING"""
+        redis = get_redis()
+        pubsub = redis.pubsub()
+        try:
+            await pubsub.subscribe(name)
+            # 订阅之前结果可能已经发布
+            payload = await redis.get(f"{name}:result")
+            deadline = time.monotonic() + settings.XHS_SINGLE_FLIGHT_TIMEOUT
+            while payload is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return _MISSING
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+                if message is not None:
+                    payload = message["data"]
+            entry = json.loads(payload)
+            return entry["v"] if entry["ok"] else _MISSING
+        except (RedisError, OSError) as e:
+            self._redis_unavailable(e)
+            return _MISSING
+        finally:
+            await pubsub.close()
+
+    def _redis_unavailable(self, error: Exception) -> None:
+        self._redis_down_until = time.monotonic() + self.REDIS_RETRY_AFTER
+        logger.warning(f"Redis不可用，{self.REDIS_RETRY_AFTER}秒内只在进程内合并请求: {error}")
+
+
+single_flight = SingleFlight()
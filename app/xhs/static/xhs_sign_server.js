@@ -0,0 +1,86 @@
+// 常驻签名进程：加载一个签名脚本后，通过 stdin/stdout 以行分隔的 JSON 提供函数调用
+//
+// 用法: node xhs_sign_server.js <bundle.js>
+// 请求: {"id": 1, "fn": "get_request_headers_params", "args": [api, data, a1]}
+//      带 "count": n 时连续调用 n 次，result 为结果数组（用于批量预生成 traceId）
+// 响应: {"id": 1, "ok": true, "result": {...}} 或 {"id": 1, "ok": false, "error": "..."}
+// 启动完成后会先输出 {"id": 0, "ok": true, "result": "ready"}
+const fs = require('fs');
+const path = require('path');
+const readline = require('readline');
+const vm = require('vm');
+
+// stdout 专用于协议输出，签名脚本里的调试输出一律丢弃
+console.log = console.info = console.debug = function () {};
+
+function send(message) {
+    process.stdout.write(JSON.stringify(message) + '\n');
+}
+
+const bundlePath = path.resolve(process.argv[2]);
+let lookup;
+try {
+    // 与 execjs 一致：脚本在函数作用域内执行，通过 eval 按名称取出顶层函数
+    // 传入本文件的 require，使 jsdom 和 xhs_xray_pack*.js 的解析不依赖进程工作目录
+    const source = fs.readFileSync(bundlePath, 'utf8');
+    const wrapper = vm.runInThisContext(
+        '(function (require, module, exports, __filename, __dirname) {\n' +
+        source +
+        '\n;return function (name) { return eval(name); };\n})',
+        { filename: bundlePath }
+    );
+    lookup = wrapper(require, module, exports, bundlePath, path.dirname(bundlePath));
+} catch (e) {
+    send({ id: 0, ok: false, error: 'failed to load ' + bundlePath + ': ' + (e && e.stack || e) });
+    process.exit(1);
+}
+
+const functions = {};
+
+function resolve(name) {
+    if (!(name in functions)) {
+        const fn = lookup(name);
+        if (typeof fn !== 'function') {
+            throw new Error(name + ' is not a function');
+        }
+        functions[name] = fn;
+    }
+    return functions[name];
+}
+
+function handle(line) {
+    if (!line) {
+        return;
+    }
+    let request;
+    try {
+        request = JSON.parse(line);
+    } catch (e) {
+        console.error('invalid request: ' + line);
+        return;
+    }
+    try {
+        const fn = resolve(request.fn);
+        const args = request.args || [];
+        let result;
+        if (request.count) {
+            result = [];
+            for (let i = 0; i < request.count; i++) {
+                result.push(fn.apply(null, args));
+            }
+        } else {
+            result = fn.apply(null, args);
+        }
+        send({ id: request.id, ok: true, result: result === undefined ? null : result });
+    } catch (e) {
+        send({ id: request.id, ok: false, error: String(e && e.stack || e) });
+    }
+}
+
+const rl = readline.createInterface({ input: process.stdin, terminal: false });
+rl.on('line', handle);
+rl.on('close', function () {
+    process.exit(0);
+});
+
+send({ id: 0, ok: true, result: 'ready' });
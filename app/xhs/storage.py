@@ -0,0 +1,159 @@
+"""采集结果入库
+
+评论按 comment_id、笔记按 note_id 批量 upsert（MySQL 上是 ``INSERT ... ON DUPLICATE KEY UPDATE``），
+重复采集同一条笔记只会刷新点赞数等可变字段，不会产生重复行。
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.core.config import settings
+from .models import Comment, CrawlRun, Note
+
+# 重复采集时刷新的列，created_at 保持第一次入库的时间
+COMMENT_UPDATE_FIELDS = (
+    "content",
+    "like_count",
+    "nickname",
+    "ip_location",
+    "root_comment_id",
+    "parent_comment_id",
+    "updated_at",
+)
+NOTE_UPDATE_FIELDS = ("xsec_token", "title", "url", "keyword", "updated_at")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _comment(comment: Dict[str, Any], crawl_run: Optional[CrawlRun]) -> Comment:
+    return Comment(
+        comment_id=comment["comment_id"],
+        note_id=comment["note_id"],
+        root_comment_id=comment.get("root_comment_id"),
+        parent_comment_id=comment.get("parent_comment_id"),
+        content=comment.get("content", ""),
+        like_count=int(comment.get("like_count") or 0),
+        nickname=comment.get("nickname", ""),
+        ip_location=comment.get("comment_location", ""),
+        create_time=comment.get("create_time"),
+        crawl_run=crawl_run,
+    )
+
+
+async def upsert_comments(comments: Iterable[Dict[str, Any]], crawl_run: Optional[CrawlRun] = None) -> int:
+    """按 comment_id 批量写入评论，每批 ``XHS_DB_BATCH_SIZE`` 条
+
+    Args:
+        comments: format_comment 规范化后的评论
+        crawl_run: 本次采集，写入评论的 crawl_run_id
+
+    Returns:
+        int: 写入（插入或更新）的评论数量
+    """
+    objects = [_comment(comment, crawl_run) for comment in comments if comment.get("comment_id")]
+    if objects:
+        await Comment.bulk_create(
+            objects,
+            batch_size=settings.XHS_DB_BATCH_SIZE,
+            on_conflict=("comment_id",),
+            update_fields=COMMENT_UPDATE_FIELDS + ("crawl_run_id",) if crawl_run else COMMENT_UPDATE_FIELDS,
+        )
+    return len(objects)
+
+
+async def upsert_notes(notes: Iterable[Dict[str, Any]], keyword: Optional[str] = None) -> int:
+    """按 note_id 批量写入搜索到的笔记
+
+    Args:
+        notes: iter_search_notes 产出的笔记
+        keyword: 搜索关键词
+
+    Returns:
+        int: 写入（插入或更新）的笔记数量
+    """
+    objects = [
+        Note(
+            note_id=note["note_id"],
+            xsec_token=note.get("xsec_token") or "",
+            title=note.get("title") or "",
+            url=note.get("url") or "",
+            keyword=keyword,
+        )
+        for note in notes
+        if note.get("note_id")
+    ]
+    if objects:
+        await Note.bulk_create(
+            objects,
+            batch_size=settings.XHS_DB_BATCH_SIZE,
+            on_conflict=("note_id",),
+            update_fields=NOTE_UPDATE_FIELDS,
+        )
+    return len(objects)
+
+
+class CommentWriter:
+    """边采集边入库：评论先放在缓冲区，攒够一批再 upsert，结束时调用 flush 写入剩余部分"""
+
+    def __init__(self, crawl_run: Optional[CrawlRun] = None, batch_size: Optional[int] = None):
+        self.crawl_run = crawl_run
+        self.batch_size = batch_size or settings.XHS_DB_BATCH_SIZE
+        self.written = 0
+        self._buffer: List[Dict[str, Any]] = []
+
+    async def add(self, comment: Dict[str, Any]) -> None:
+        self._buffer.append(comment)
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        buffer, self._buffer = self._buffer, []
+        self.written += await upsert_comments(buffer, self.crawl_run)
+
+
+async def mark_note_crawled(note_id: str, xsec_token: str = "", url: str = "", state: Optional[Dict[str, Any]] = None) -> None:
+    """记录笔记最近一次采集评论的时间，笔记不存在时先创建
+
+    Args:
+        state: 增量同步结束后的状态（见 AsyncXhsAPI.fetch_new_comments），保存评论数和高水位线
+    """
+    note, _ = await Note.get_or_create(note_id=note_id, defaults={"xsec_token": xsec_token, "url": url})
+    note.last_crawled_at = _now()
+    update_fields = ["last_crawled_at", "updated_at"]
+    if state:
+        comment_count = str(state.get("comment_count", ""))
+        note.comment_count = int(comment_count) if comment_count.isdigit() else None
+        update_fields.append("comment_count")
+        if state.get("since"):
+            note.last_comment_time, note.last_comment_id = state["since"]
+            update_fields += ["last_comment_time", "last_comment_id"]
+    await note.save(update_fields=update_fields)
+
+
+async def get_sync_state(note_id: str) -> Dict[str, Any]:
+    """读取增量同步的状态：comment_count 为上次同步时的评论数，since 为高水位线 (create_time, comment_id)"""
+    state: Dict[str, Any] = {}
+    note = await Note.get_or_none(note_id=note_id)
+    if note is None:
+        return state
+    if note.comment_count is not None:
+        state["comment_count"] = note.comment_count
+    if note.last_comment_id:
+        state["since"] = (note.last_comment_time or 0, note.last_comment_id)
+    return state
+
+
+async def start_run(kind: str, target: str) -> CrawlRun:
+    return await CrawlRun.create(kind=kind, target=target)
+
+
+async def finish_run(crawl_run: CrawlRun, error: Optional[str] = None, **counts: int) -> None:
+    """记录采集结束，counts 为 note_count / comment_count"""
+    crawl_run.status = "failed" if error else "success"
+    crawl_run.error = error
+    crawl_run.finished_at = _now()
+    for field, value in counts.items():
+        setattr(crawl_run, field, value)
+    await crawl_run.save(update_fields=["status", "error", "finished_at", "updated_at", *counts])
@@ -0,0 +1,269 @@
+"""SAQ tasks for XHS crawls.
+
+批量任务按扇出/扇入执行：父任务只负责把每个请求拆成一个子任务放回队列，
+任意数量的 worker 并行处理子任务（共享 Redis 限速额度），子任务完成后在
+``xhs:batch:{父任务ID}`` 哈希中累加计数。父任务的进度和结果由计数和子任务结果汇总得到，
+父任务本身不等待子任务，不会占住 worker 的并发槽位。
+
+多个 worker 副本可能拿到同一个子任务（父任务重试时重新入队已完成的子任务，或 SAQ 重复投递）：
+子任务开始前在 Redis 中占用 ``xhs:batch:{父任务ID}:claim:{序号}``，结果写入
+``xhs:batch:{父任务ID}:results``，已有结果的子任务直接返回原来的结果，每个子任务只执行、只计数一次。
+子任务抛出异常或等待其他 worker 超时时记为失败；超时被取消、worker 退出后被 SAQ 清理的子任务
+没有机会记录结果，查询父任务时由 ``settle_batch`` 补记为失败，父任务总能结束。
+
+评论子任务把评论写入 ``XHS_EXPORT_DIR/batches/{父任务ID}/{序号}.ndjson``，Redis 中的任务结果
+只保存数量和文件路径，内存占用与评论数量无关。超过 ``XHS_JOB_TTL`` 的批量目录在下一次扇出时删除。
+"""
+
+import asyncio
+import shutil
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import orjson
+from loguru import logger
+from saq import Job, Queue, Status
+
+from app.core.config import settings
+from app.core.redis import get_redis
+from .export import iter_ndjson
+from .records import dumps
+from .monitor import claim_due_notes, poll_note
+from .schemas import CommentRequest, ExportRequest, SearchRequest
+from .services import XhsService
+
+# 父任务 -> 子任务
+BATCH_FUNCTIONS = {
+    "xhs_batch_comments": "xhs_batch_comment_item",
+    "xhs_batch_search": "xhs_batch_search_item",
+}
+
+
+def batch_key(batch_id: str) -> str:
+    return f"xhs:batch:{batch_id}"
+
+
+def child_key(batch_id: str, task_id: int) -> str:
+    return f"{batch_id}:{task_id}"
+
+
+def results_key(batch_id: str) -> str:
+    return f"xhs:batch:{batch_id}:results"
+
+
+# 子任务正在其他 worker 上执行时，等待它的结果的轮询间隔（秒）
+CLAIM_POLL_INTERVAL = 1.0
+
+
+def batch_dir(batch_id: str) -> Path:
+    """批量任务的评论文件目录，web 进程和所有 worker 需要共享 XHS_EXPORT_DIR"""
+    return Path(settings.XHS_EXPORT_DIR) / "batches" / batch_id
+
+
+def prune_batch_dirs(max_age: float) -> int:
+    """删除超过 max_age 秒未修改的批量任务目录，这时任务结果也已经过期，返回删除的目录数"""
+    root = Path(settings.XHS_EXPORT_DIR) / "batches"
+    if not root.is_dir():
+        return 0
+    expire_before = time.time() - max_age
+    removed = 0
+    for path in root.iterdir():
+        if path.is_dir() and path.stat().st_mtime < expire_before:
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+async def _fan_out(ctx: dict, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+    job: Job = ctx["job"]
+    queue = job.get_queue()
+    batch_id = job.key
+    key = batch_key(batch_id)
+    redis = get_redis()
+    await asyncio.to_thread(prune_batch_dirs, settings.XHS_JOB_TTL)
+    # 父任务重试时不重置已有计数；子任务的 key 固定，未完成的重复入队会被 SAQ 忽略，
+    # 已完成的子任务再次入队时由 _run_once 直接返回原来的结果
+    await redis.hsetnx(key, "total", len(requests))
+    await redis.hsetnx(key, "success", 0)
+    await redis.hsetnx(key, "failed", 0)
+    await redis.hsetnx(key, "items", 0)
+    await redis.expire(key, settings.XHS_JOB_TTL)
+
+    for task_id, request in enumerate(requests, 1):
+        await queue.enqueue(
+            BATCH_FUNCTIONS[job.function],
+            key=child_key(batch_id, task_id),
+            batch_id=batch_id,
+            task_id=task_id,
+            request=request,
+            timeout=settings.XHS_JOB_TIMEOUT,
+            ttl=settings.XHS_JOB_TTL,
+        )
+    return {"batch_id": batch_id, "total": len(requests)}
+
+
+async def _run_once(
+    batch_id: str, task_id: int, run: Callable[[], Awaitable[Tuple[Dict[str, Any], int]]]
+) -> Dict[str, Any]:
+    """执行子任务并累加计数，同一个子任务在所有 worker 中只执行一次
+
+    已有结果时直接返回；其他 worker 正在执行时等待它的结果，最多等 ``XHS_JOB_TIMEOUT`` 秒。
+
+    Args:
+        run: 执行子任务的协程函数，返回 (结果, 获取到的评论或笔记数)
+    """
+    redis = get_redis()
+    claim = f"{batch_key(batch_id)}:claim:{task_id}"
+    deadline = time.monotonic() + settings.XHS_JOB_TIMEOUT
+    while True:
+        stored = await redis.hget(results_key(batch_id), str(task_id))
+        if stored is not None:
+            logger.info(f"批量任务{batch_id}的子任务{task_id}已经执行过，返回原来的结果")
+            return orjson.loads(stored)
+        if await redis.set(claim, 1, nx=True, ex=int(settings.XHS_JOB_TIMEOUT)):
+            break
+        if time.monotonic() >= deadline:
+            error = TimeoutError(f"等待批量任务{batch_id}的子任务{task_id}在其他 worker 上完成超时")
+            await _record(batch_id, task_id, _failed(task_id, error), 0)
+            raise error
+        await asyncio.sleep(CLAIM_POLL_INTERVAL)
+
+    try:
+        result, items = await run()
+    except Exception as e:
+        logger.exception(f"批量任务{batch_id}的子任务{task_id}失败")
+        await _record(batch_id, task_id, _failed(task_id, e), 0)
+        raise
+    except BaseException:
+        # 被取消（超时、worker 关闭）时交给 SAQ 重试或由 settle_batch 补记
+        await redis.delete(claim)
+        raise
+    await _record(batch_id, task_id, result, items)
+    return result
+
+
+def _failed(task_id: int, error: Any) -> Dict[str, Any]:
+    return {"task_id": task_id, "status": "failed", "error": str(error)}
+
+
+async def _record(batch_id: str, task_id: int, result: Dict[str, Any], items: int) -> None:
+    """保存子任务结果并累加计数，已有结果的子任务不重复计数"""
+    key = batch_key(batch_id)
+    redis = get_redis()
+    if not await redis.hsetnx(results_key(batch_id), str(task_id), dumps(result)):
+        return
+    async with redis.pipeline(transaction=True) as pipe:
+        pipe.expire(results_key(batch_id), settings.XHS_JOB_TTL)
+        pipe.hincrby(key, "success" if result["status"] == "success" else "failed", 1)
+        pipe.hincrby(key, "items", items)
+        await pipe.execute()
+
+
+async def xhs_batch_comments(ctx: dict, *, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """批量获取评论：每个笔记拆成一个子任务"""
+    return await _fan_out(ctx, requests)
+
+
+async def xhs_batch_search(ctx: dict, *, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """批量搜索笔记：每个关键词拆成一个子任务"""
+    return await _fan_out(ctx, requests)
+
+
+async def xhs_batch_comment_item(_: dict, *, batch_id: str, task_id: int, request: Dict[str, Any]) -> Dict[str, Any]:
+    async def run() -> Tuple[Dict[str, Any], int]:
+        comments_file = batch_dir(batch_id) / f"{task_id}.ndjson"
+        result = await XhsService().process_comment_request(task_id, CommentRequest(**request), comments_file=str(comments_file))
+        return result, result.get("comments_count", 0)
+
+    return await _run_once(batch_id, task_id, run)
+
+
+async def xhs_batch_search_item(_: dict, *, batch_id: str, task_id: int, request: Dict[str, Any]) -> Dict[str, Any]:
+    async def run() -> Tuple[Dict[str, Any], int]:
+        result = await XhsService().process_search_request(task_id, SearchRequest(**request))
+        return result, result.get("notes_count", 0)
+
+    return await _run_once(batch_id, task_id, run)
+
+
+async def xhs_monitor_tick(ctx: dict) -> Dict[str, Any]:
+    """定时任务：取出到期的监控笔记，每条放入一个轮询任务"""
+    queue = ctx["job"].get_queue()
+    note_ids = await claim_due_notes(settings.XHS_MONITOR_BATCH_SIZE)
+    for note_id in note_ids:
+        await queue.enqueue(
+            "xhs_monitor_poll",
+            key=f"monitor:{note_id}",
+            note_id=note_id,
+            timeout=settings.XHS_MONITOR_LEASE,
+            ttl=settings.XHS_MONITOR_LEASE,
+        )
+    return {"claimed": len(note_ids)}
+
+
+async def xhs_monitor_poll(_: dict, *, note_id: str) -> Dict[str, Any]:
+    return await poll_note(note_id)
+
+
+async def xhs_export_parquet(_: dict, *, request: Dict[str, Any]) -> Dict[str, Any]:
+    request = ExportRequest(**request)
+    return await XhsService().export_to_parquet(request.kind, request.keyword, request.start_date, request.end_date)
+
+
+async def get_batch_counters(batch_id: str) -> Optional[Dict[str, int]]:
+    """批量任务的计数：total、success、failed、items（获取到的评论或笔记数），父任务尚未执行时返回 None"""
+    counters = await get_redis().hgetall(batch_key(batch_id))
+    if not counters:
+        return None
+    return {key.decode(): int(value) for key, value in counters.items()}
+
+
+async def settle_batch(queue: Queue, batch_id: str) -> Optional[Dict[str, int]]:
+    """返回批量任务的计数，并把已经结束却没有记录结果的子任务计为失败
+
+    子任务超时被取消、被中止或 worker 退出后被 SAQ 清理时，任务函数来不及记录结果，
+    不补记的话父任务会一直处于未完成状态。
+    """
+    counters = await get_batch_counters(batch_id)
+    if not counters or counters["success"] + counters["failed"] >= counters["total"]:
+        return counters
+    stored = await get_redis().hkeys(results_key(batch_id))
+    missing = [task_id for task_id in range(1, counters["total"] + 1) if str(task_id).encode() not in stored]
+    jobs = await asyncio.gather(*(queue.job(child_key(batch_id, task_id)) for task_id in missing))
+    settled = False
+    for task_id, job in zip(missing, jobs):
+        # 尚未入队（父任务正在扇出）或等待重试的子任务不处理
+        if job is not None and job.status in (Status.FAILED, Status.ABORTED):
+            await _record(batch_id, task_id, _failed(task_id, job.error or "子任务超时、被中止或 worker 已退出"), 0)
+            settled = True
+    return await get_batch_counters(batch_id) if settled else counters
+
+
+async def _child_result(queue: Queue, batch_id: str, task_id: int) -> Optional[Dict[str, Any]]:
+    stored = await get_redis().hget(results_key(batch_id), str(task_id))
+    if stored is not None:
+        return orjson.loads(stored)
+    job = await queue.job(child_key(batch_id, task_id))
+    return job.result if job else None
+
+
+async def get_batch_results(queue: Queue, batch_id: str, total: int) -> List[Optional[Dict[str, Any]]]:
+    """按请求顺序汇总子任务结果，已过期的子任务为 None"""
+    return list(await asyncio.gather(*(_child_result(queue, batch_id, task_id) for task_id in range(1, total + 1))))
+
+
+async def iter_batch_comments(queue: Queue, batch_id: str, total: int) -> AsyncIterator[Dict[str, Any]]:
+    """按请求顺序逐个读取子任务的评论文件，分块读取，内存占用与评论数量无关"""
+    for task_id in range(1, total + 1):
+        result = await _child_result(queue, batch_id, task_id) or {}
+        if result.get("comments_file"):
+            try:
+                async for comment in iter_ndjson(result["comments_file"]):
+                    yield comment
+            except FileNotFoundError:
+                logger.warning(f"批量任务{batch_id}的子任务{task_id}的评论文件已被删除")
+        else:
+            # 改为写文件之前入队的子任务，评论仍在结果中
+            for comment in result.get("comments", []):
+                yield comment
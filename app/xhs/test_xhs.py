@@ -1,8 +1,56 @@
 """Test script for XHS API functionality."""
 
 import asyncio
-from .xhs_api import XhsAPI
+import base64
+import hashlib
+import itertools
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import pytest
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from app.core.config import settings
+from .errors import XhsCircuitOpenError, XhsRefusedError, XhsRequestError, XhsResponseError, XhsTransientError
+from .executor import CircuitBreaker, execute
+from .ratelimit import AsyncTokenBucket, endpoint_family
+from .xhs_api import AsyncXhsAPI, XhsAPI, parse_response
 from .services import XhsService
+from .xhs_utils.xhs_util import PythonCreatorSigner, Signer, XrayTraceIdPool, get_signer, generate_xray_traceid, generate_xs_xs_common
+
+
+@pytest.fixture(autouse=True)
+def no_shared_redis_state(monkeypatch):
+    """用假数据测试时不读写共享的 Redis 缓存，只在进程内合并请求"""
+    monkeypatch.setattr(settings, "XHS_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "XHS_SINGLE_FLIGHT_BACKEND", "local")
+
+
+@pytest.fixture
+def memory_db():
+    """在独立的内存 SQLite 数据库中建表，不读写配置的 DATABASE_URI
+
+    返回异步上下文管理器，在测试自己的事件循环中使用：``async with memory_db(): ...``
+    """
+    from tortoise import Tortoise
+    from app.db.config import TORTOISE_ORM
+
+    config = {**TORTOISE_ORM, "connections": {"default": "sqlite://:memory:"}}
+
+    @asynccontextmanager
+    async def connect():
+        await Tortoise.init(config=config, _create_db=True)
+        await Tortoise.generate_schemas()
+        try:
+            yield
+        finally:
+            await Tortoise.close_connections()
+
+    yield connect
+    Tortoise._reset_apps()
 
 
 async def test_url_extraction():
@@ -63,6 +111,1197 @@ async def test_service_functions():
     await service.close()
 
 
+def test_python_creator_signer_matches_node():
+    """Python 实现的创作者签名与 xhs_creator_xs.js 的输出逐字节一致"""
+    python_signer = PythonCreatorSigner()
+    node_signer = get_signer('node', 'creator')
+
+    for data in ['', {}, {"note_id": "64f8a1b2000000001e00c123", "content": "测试"}]:
+        node_xs, node_xt = node_signer.get_xs("/api/galaxy/creator/note/user/posted", data, "test_a1")
+        python_xs, python_xt = python_signer.get_xs("/api/galaxy/creator/note/user/posted", data, "test_a1", xt=node_xt)
+        assert python_xs == node_xs
+        assert python_xt == node_xt
+
+    # 签名后端必须实现两个签名方法
+    with pytest.raises(TypeError):
+        Signer()
+
+
+def test_creator_signer_chosen_by_config():
+    """创作者签名按 XHS_CREATOR_SIGNER 选择后端，无效的后端配置在加载配置时报错"""
+    from pydantic import ValidationError
+    from .xhs_utils import xhs_util
+
+    assert settings.XHS_CREATOR_SIGNER == "python"
+    assert isinstance(xhs_util.creator_signer, PythonCreatorSigner)
+    xs, xt = xhs_util.generate_creator_xs("test_a1", "/api/galaxy/creator/note/user/posted")
+    assert _decode_creator_xs(xs)['x3'] == "test_a1" and isinstance(xt, int)
+
+    for name, value in (("XHS_WEB_SIGNER", "python"), ("XHS_CREATOR_SIGNER", "rust")):
+        with pytest.raises(ValidationError, match=name):
+            type(settings)(**{name: value})
+    assert type(settings)(XHS_CREATOR_SIGNER="node").XHS_CREATOR_SIGNER == "node"
+
+
+def _decode_creator_xs(xs):
+    """解出创作者签名里的明文 x1=...;x2=...;x3=...;x4=...;"""
+    assert xs.startswith('XYW_')
+    payload = json.loads(base64.b64decode(xs[4:]))['payload']
+    decryptor = Cipher(algorithms.AES(PythonCreatorSigner.key), modes.CBC(PythonCreatorSigner.iv)).decryptor()
+    padded = decryptor.update(bytes.fromhex(payload)) + decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    plaintext = base64.b64decode(unpadder.update(padded) + unpadder.finalize()).decode()
+    return dict(part.split('=', 1) for part in plaintext.strip(';').split(';'))
+
+
+def test_concurrent_signing():
+    """多线程并发签名：每个签名都对应自己的参数，且不会修改进程工作目录"""
+    signers = [PythonCreatorSigner(), get_signer('node', 'creator')]
+    cwd = os.getcwd()
+
+    def sign(i):
+        a1 = f"a1_{i}"
+        api = f"/api/sns/web/v2/comment/page?note_id={i}"
+        signer = signers[i % len(signers)]
+        xs, xt = signer.get_xs(api, '', a1)
+        return i, a1, api, xs, xt, generate_xray_traceid()
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(sign, range(500)))
+
+    assert os.getcwd() == cwd
+    trace_ids = set()
+    for i, a1, api, xs, xt, trace_id in results:
+        fields = _decode_creator_xs(xs)
+        assert fields['x1'] == hashlib.md5(api.encode()).hexdigest()
+        assert fields['x3'] == a1
+        assert fields['x4'] == str(xt)
+        assert re.fullmatch(r'[0-9a-f]{32}', trace_id)
+        trace_ids.add(trace_id)
+    assert len(trace_ids) == len(results)
+
+
+def test_concurrent_web_signing():
+    """多线程并发调用依赖 jsdom 的网页端签名"""
+    def sign(i):
+        return generate_xs_xs_common(f"a1_{i}", f"/api/sns/web/v1/feed?i={i}", {"source_note_id": str(i)})
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(sign, range(200)))
+
+    for xs, xt, xs_common in results:
+        assert xs.startswith('XYW_')
+        assert json.loads(base64.b64decode(xs[4:]))['payload']
+        assert int(xt) > 0
+        assert xs_common
+
+
+class CountingTraceIdRuntime:
+    """代替 xhs_xray.js 进程，生成递增的 traceId 并记录调用次数"""
+
+    def __init__(self):
+        self._ids = itertools.count()
+        self.calls = 0
+        self.batches = 0
+
+    def call(self, fn):
+        self.calls += 1
+        return f"sync-{next(self._ids)}"
+
+    def call_many(self, fn, count):
+        self.batches += 1
+        return [f"batch-{next(self._ids)}" for _ in range(count)]
+
+
+def _wait_refilled(pool):
+    deadline = time.monotonic() + 5
+    while pool._refilling and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_xray_traceid_pool_refills_at_low_watermark():
+    """余量低于 low_watermark 时后台补充一批，取用时不调用 JS"""
+    runtime = CountingTraceIdRuntime()
+    pool = XrayTraceIdPool(runtime, capacity=16, batch_size=8, low_watermark=3)
+    pool.warm()
+    _wait_refilled(pool)
+    assert runtime.batches == 1
+
+    for _ in range(5):
+        pool.get()
+    assert runtime.batches == 1 and runtime.calls == 0
+    # 取到剩下 2 条，低于 3，触发第二批
+    pool.get()
+    _wait_refilled(pool)
+    assert runtime.batches == 2 and runtime.calls == 0 and len(pool._buffer) == 10
+
+
+def test_xray_traceid_pool_discards_expired_ids():
+    """超过 max_age 未被取用的 traceId 被丢弃，改为同步生成"""
+    runtime = CountingTraceIdRuntime()
+    pool = XrayTraceIdPool(runtime, capacity=16, batch_size=8, low_watermark=0, max_age=0.05)
+    pool.warm()
+    _wait_refilled(pool)
+    assert pool.get().startswith("batch-")
+    time.sleep(0.1)
+    assert pool.get().startswith("sync-")
+    assert runtime.calls == 1 and len(pool._buffer) == 0
+
+
+def test_xray_traceid_pool_unique_under_concurrent_get():
+    """多线程同时取用时每个 traceId 只被取出一次"""
+    runtime = CountingTraceIdRuntime()
+    pool = XrayTraceIdPool(runtime, capacity=64, batch_size=32, low_watermark=16)
+
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        trace_ids = list(executor.map(lambda _: pool.get(), range(2000)))
+    _wait_refilled(pool)
+    assert len(set(trace_ids)) == len(trace_ids)
+
+
+def test_xray_traceid_requires_javascript_engine(monkeypatch):
+    from .xhs_utils import xhs_util
+
+    monkeypatch.setattr(xhs_util, "xray_traceids", None)
+    with pytest.raises(Exception, match="JavaScript engine not available"):
+        generate_xray_traceid()
+
+
+STUB_BUNDLE = """
+Atomics.wait(new Int32Array(new SharedArrayBuffer(4)), 0, 0, %d);
+function echo(x) { return x; }
+function pid() { return process.pid; }
+function crash() { process.exit(3); }
+function hang() { while (true) {} }
+"""
+
+
+def _stub_pool(tmp_path, startup_ms=0, **kwargs):
+    """加载测试用签名脚本的进程池，startup_ms 模拟加载 jsdom 等耗时的启动"""
+    from .xhs_utils.node_pool import NodeWorkerPool
+
+    bundle = tmp_path / f"stub_{startup_ms}.js"
+    bundle.write_text(STUB_BUNDLE % startup_ms)
+    return NodeWorkerPool(bundle, node_path=settings.XHS_NODE_PATH, **kwargs)
+
+
+def test_node_pool_matches_pipelined_responses_and_recycles(tmp_path):
+    """同一进程上的流水线请求按 id 对应各自的响应；达到 max_calls 后换新进程"""
+    pool = _stub_pool(tmp_path, size=1, max_calls=100, timeout=10)
+    try:
+        worker = pool._acquire()
+        futures = [worker.submit("echo", {"i": i}) for i in range(50)]
+        assert [future.result(timeout=10) for future in futures] == [{"i": i} for i in range(50)]
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            assert list(executor.map(lambda i: pool.call("echo", i), range(300))) == list(range(300))
+
+        first = pool.call("pid")
+        for i in range(100):
+            pool.call("echo", i)
+        assert pool.call("pid") != first
+    finally:
+        pool.close()
+
+
+def test_node_pool_respawns_crashed_and_kills_hung_workers(tmp_path):
+    """崩溃的进程在下次调用时重启；超时的进程被杀掉"""
+    from .xhs_utils.node_pool import NodeWorkerError
+
+    pool = _stub_pool(tmp_path, size=1, timeout=0.5)
+    try:
+        first = pool.call("pid")
+        with pytest.raises(NodeWorkerError):
+            pool.call("crash")
+        second = pool.call("pid")
+        assert second != first
+
+        hung = pool._acquire()
+        with pytest.raises(NodeWorkerError, match="timed out"):
+            pool.call("hang")
+        assert hung.proc.wait(timeout=5) is not None and not hung.alive
+        assert pool.call("pid") not in (first, second)
+    finally:
+        pool.close()
+
+
+def test_node_pool_starts_workers_outside_the_lock(tmp_path):
+    """进程启动不持有进程池的锁，两个位置的进程同时启动"""
+    pool = _stub_pool(tmp_path, startup_ms=500, size=2, timeout=10)
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            pids = list(executor.map(lambda _: pool.call("pid"), range(2)))
+        assert time.perf_counter() - start < 0.9
+        assert len(set(pids)) == 2
+    finally:
+        pool.close()
+
+
+class FakeUpstreamAPI(AsyncXhsAPI):
+    """用内存中的假数据代替小红书接口，记录每次请求的路径"""
+
+    def __init__(self, pages=3, page_size=10, sub_pages=0, latency=0, search_pages=0, notes_per_page=5, overlap=0, fail_page=None):
+        super().__init__()
+        self.pages = pages
+        self.page_size = page_size
+        self.sub_pages = sub_pages
+        self.latency = latency
+        self.search_pages = search_pages
+        self.notes_per_page = notes_per_page
+        self.overlap = overlap
+        self.fail_page = fail_page
+        self.requests = []
+        self.search_requests = []
+        self.search_ids = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _request(self, method, cookies_str, uri, params=None, data=''):
+        self.requests.append(uri)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            return self._respond(uri, params or data)
+        finally:
+            self.in_flight -= 1
+
+    def _respond(self, uri, params):
+        if uri == "/api/sns/web/v2/comment/page":
+            page = int(params['cursor'] or 0)
+            if page == self.fail_page:
+                raise XhsRefusedError("访问频次异常", code=300013)
+            comments = [
+                {
+                    'id': f'c{page}-{i}',
+                    'content': f'comment {page}-{i}',
+                    'create_time': 1700000000000 + page * 100 + i,
+                    'user_info': {'nickname': 'user'},
+                    'sub_comments': [],
+                    'sub_comment_has_more': self.sub_pages > 0,
+                    'sub_comment_cursor': '0',
+                }
+                for i in range(self.page_size)
+            ]
+            has_more = page + 1 < self.pages
+            return {'code': 0, 'data': {'comments': comments, 'cursor': str(page + 1) if has_more else '', 'has_more': has_more}}
+        if uri.startswith("/api/sns/web/v2/comment/sub/page"):
+            query = dict(item.split('=', 1) for item in uri.split('?', 1)[1].split('&'))
+            page = int(query['cursor'] or 0)
+            comments = [{'id': f"{query['root_comment_id']}-s{page}-{i}", 'content': 'reply'} for i in range(2)]
+            has_more = page + 1 < self.sub_pages
+            return {'code': 0, 'data': {'comments': comments, 'cursor': str(page + 1) if has_more else '', 'has_more': has_more}}
+        if uri == "/api/sns/web/v1/search/notes":
+            self.search_requests.append(params['page'])
+            self.search_ids.append(params['search_id'])
+            page = params['page']
+            # 每页重复上一页最后 overlap 条结果
+            ids = [f'n{page - 1}-{i}' for i in range(self.notes_per_page - self.overlap, self.notes_per_page)] if page > 1 else []
+            ids += [f'n{page}-{i}' for i in range(self.notes_per_page)]
+            items = [
+                {'id': note_id, 'xsec_token': 'token', 'note_card': {'display_title': note_id}}
+                for note_id in ids
+            ] if page <= self.search_pages else []
+            return {'code': 0, 'data': {'items': items, 'has_more': page < self.search_pages}}
+        raise AssertionError(f"unexpected request {uri}")
+
+
+NOTE_URL = "https://www.xiaohongshu.com/explore/64f8a1b2000000001e00c123?xsec_token=ABtest123&xsec_source=pc_search"
+
+
+def test_iter_comments_stops_at_max_comments():
+    """iter_comments 按游标逐页获取，达到 max_comments 后不再请求下一页"""
+    api = FakeUpstreamAPI(pages=5, page_size=10)
+
+    async def collect():
+        return [comment async for comment in api.iter_comments("a1=x", NOTE_URL, max_comments=15)]
+
+    comments = asyncio.run(collect())
+    assert [c['comment_id'] for c in comments] == [f'c0-{i}' for i in range(10)] + [f'c1-{i}' for i in range(5)]
+    assert len(api.requests) == 2
+
+    comments = asyncio.run(api.get_comments("a1=x", NOTE_URL))
+    assert len(comments) == 50
+    # 不再共享可变的默认参数
+    assert len(asyncio.run(api.get_comments("a1=x", NOTE_URL, max_comments=3))) == 3
+
+
+def test_iter_comments_failure_handling():
+    """第一页失败时抛出异常，后续页失败时停止并在 progress 中记录原因"""
+    api = FakeUpstreamAPI(pages=3, page_size=10, fail_page=0)
+    try:
+        asyncio.run(api.get_comments("a1=x", NOTE_URL))
+    except XhsRefusedError:
+        pass
+    else:
+        raise AssertionError("first page failure should raise")
+
+    api = FakeUpstreamAPI(pages=3, page_size=10, fail_page=1)
+    progress = {}
+
+    async def collect():
+        return [comment async for comment in api.iter_comments("a1=x", NOTE_URL, progress=progress)]
+
+    assert len(asyncio.run(collect())) == 10
+    assert progress == {"count": 10, "cursor": "1", "has_more": True, "error": {"type": "XhsRefusedError", "message": "访问频次异常"}}
+
+
+def test_sub_comments_expanded_concurrently_in_order():
+    """子评论并发展开，结果仍按根评论顺序排列"""
+    api = FakeUpstreamAPI(pages=1, page_size=20, sub_pages=3, latency=0.02)
+    start = time.perf_counter()
+    comments = asyncio.run(api.get_comments("a1=x", NOTE_URL))
+    elapsed = time.perf_counter() - start
+
+    expected = []
+    for i in range(20):
+        expected.append(f'c0-{i}')
+        expected.extend(f'c0-{i}-s{page}-{j}' for page in range(3) for j in range(2))
+    assert [c['comment_id'] for c in comments] == expected
+    assert comments[0]['root_comment_id'] is None
+    assert comments[1]['root_comment_id'] == comments[1]['parent_comment_id'] == 'c0-0'
+    assert 1 < api.max_in_flight <= settings.XHS_SUB_COMMENT_CONCURRENCY
+    # 串行需要 61 次往返
+    assert elapsed < 61 * 0.02 / 2
+
+
+def test_root_comment_yielded_before_its_sub_comments_expand():
+    """根评论和内嵌子评论不等待其余子评论展开完成就产出，顺序不变"""
+    class SlowSubCommentAPI(FakeUpstreamAPI):
+        async def _request(self, method, cookies_str, uri, params=None, data=''):
+            if uri.startswith("/api/sns/web/v2/comment/sub/page"):
+                await self.release.wait()
+            return await super()._request(method, cookies_str, uri, params, data)
+
+    async def crawl():
+        api = SlowSubCommentAPI(pages=1, page_size=2, sub_pages=1)
+        api.release = asyncio.Event()
+        comments = api.iter_comments("a1=x", NOTE_URL)
+        first = await asyncio.wait_for(comments.__anext__(), 1)
+        api.release.set()
+        return [first] + [comment async for comment in comments]
+
+    ids = [comment["comment_id"] for comment in asyncio.run(crawl())]
+    assert ids == ["c0-0", "c0-0-s0-0", "c0-0-s0-1", "c0-1", "c0-1-s0-0", "c0-1-s0-1"]
+
+
+def test_comments_persisted_with_idempotent_upsert(monkeypatch, memory_db):
+    """评论按 comment_id 批量 upsert，重复采集不产生重复行"""
+    from .models import Comment, CrawlRun
+    from .schemas import CommentRequest
+
+    monkeypatch.setattr(settings, "XHS_PERSIST", True)
+    monkeypatch.setattr(settings, "XHS_DB_BATCH_SIZE", 7)
+
+    async def run():
+        async with memory_db():
+            service = XhsService()
+            service.api = FakeUpstreamAPI(pages=2, page_size=10, sub_pages=1)
+            request = CommentRequest(cookies="a1=x", note_url=NOTE_URL)
+            first = await service.process_comment_request(1, request)
+            second = await service.process_comment_request(1, request)
+            return first, second, await Comment.all().count(), await CrawlRun.filter(status="success").count()
+
+    first, second, stored, runs = asyncio.run(run())
+    assert first['comments_count'] == second['comments_count'] == stored == 60
+    assert first['crawl_run_id'] != second['crawl_run_id']
+    assert runs == 2
+
+
+def test_export_parquet_partitions_and_row_groups(monkeypatch, tmp_path, memory_db):
+    """入库的评论按关键词/日期分区导出为 Parquet，按 row group 分批写入"""
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    from .export import COMMENT_SCHEMA, comment_date
+    from .schemas import CommentRequest
+    from .storage import upsert_notes
+
+    monkeypatch.setattr(settings, "XHS_PERSIST", True)
+    monkeypatch.setattr(settings, "XHS_EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "XHS_EXPORT_ROW_GROUP_SIZE", 8)
+
+    async def run():
+        async with memory_db():
+            service = XhsService()
+            service.api = FakeUpstreamAPI(pages=2, page_size=10, sub_pages=1)
+            await service.process_comment_request(1, CommentRequest(cookies="a1=x", note_url=NOTE_URL))
+            await upsert_notes([{"note_id": "64f8a1b2000000001e00c123"}], keyword="美食/探店")
+            return await service.export_to_parquet("comments", keyword="美食/探店")
+
+    result = asyncio.run(run())
+    assert result["rows"] == 60
+    # 根评论带 create_time，子评论没有时间，落在默认分区
+    day = comment_date({"create_time": 1700000000000})
+    assert sorted(path.split("/")[-2] for path in result["files"]) == [f"date={day}", "date=__HIVE_DEFAULT_PARTITION__"]
+    assert all(pq.ParquetFile(path).metadata.num_row_groups > 1 for path in result["files"])
+
+    table = ds.dataset(str(tmp_path / "comments"), format="parquet", partitioning="hive").to_table()
+    assert table.num_rows == 60
+    assert set(table.column("keyword").to_pylist()) == {"美食/探店"}
+    assert table.schema.field("create_time").type == COMMENT_SCHEMA.field("create_time").type
+    replies = [row for row in table.to_pylist() if row["root_comment_id"]]
+    assert len(replies) == 40 and all(row["parent_comment_id"] == row["root_comment_id"] for row in replies)
+
+
+def test_export_dates_follow_configured_timezone(monkeypatch):
+    """笔记的分区日期与评论一样按 XHS_TIMEZONE 计算，与服务器时区无关"""
+    from datetime import datetime, timezone
+    from .export import comment_date, local_date
+
+    monkeypatch.setattr(settings, "XHS_TIMEZONE", "Asia/Shanghai")
+    # 数据库返回的不带时区的时间是 UTC
+    assert local_date(datetime(2023, 11, 14, 22, 13, 20)) == "2023-11-15"
+    assert local_date(datetime(2023, 11, 14, 22, 13, 20, tzinfo=timezone.utc)) == comment_date({"create_time": 1700000000000})
+    monkeypatch.setattr(settings, "XHS_TIMEZONE", "UTC")
+    assert local_date(datetime(2023, 11, 14, 22, 13, 20)) == "2023-11-14"
+    assert local_date() == datetime.now(timezone.utc).date().isoformat()
+
+
+class GrowingThreadAPI(FakeUpstreamAPI):
+    """评论按时间从新到旧返回，修改 total 模拟新增评论"""
+
+    def __init__(self, total, page_size=10):
+        super().__init__(page_size=page_size)
+        self.total = total
+
+    def _respond(self, uri, params):
+        if uri == "/api/sns/web/v1/feed":
+            return {'code': 0, 'data': {'items': [{'note_card': {'note_id': 'n', 'interact_info': {'comment_count': str(self.total)}}}]}}
+        if uri == "/api/sns/web/v2/comment/page":
+            page = int(params['cursor'] or 0)
+            newest = self.total - 1 - page * self.page_size
+            comments = [
+                {'id': f'c{n}', 'content': '', 'create_time': 1700000000000 + n * 1000, 'user_info': {}, 'sub_comments': []}
+                for n in range(newest, max(-1, newest - self.page_size), -1)
+            ]
+            has_more = newest - self.page_size >= 0
+            return {'code': 0, 'data': {'comments': comments, 'cursor': str(page + 1) if has_more else '', 'has_more': has_more}}
+        return super()._respond(uri, params)
+
+
+def test_fetch_new_comments_incremental():
+    """评论数不变时只请求笔记信息，有新增时翻页到高水位线为止，只返回新增评论"""
+    api = GrowingThreadAPI(total=25)
+    state = {}
+    _, comments = asyncio.run(api.fetch_new_comments("a1=x", NOTE_URL, state))
+    assert len(comments) == 25
+    assert state == {'since': (1700000024000, 'c24'), 'comment_count': '25'}
+
+    api.requests.clear()
+    _, comments = asyncio.run(api.fetch_new_comments("a1=x", NOTE_URL, state))
+    assert comments == [] and api.requests == ["/api/sns/web/v1/feed"]
+
+    api.requests.clear()
+    api.total = 28
+    _, comments = asyncio.run(api.fetch_new_comments("a1=x", NOTE_URL, state))
+    assert [c['comment_id'] for c in comments] == ['c27', 'c26', 'c25']
+    assert api.requests == ["/api/sns/web/v1/feed", "/api/sns/web/v2/comment/page"]
+    assert state == {'since': (1700000027000, 'c27'), 'comment_count': '28'}
+
+
+def test_monitor_interval_adapts_to_velocity():
+    """活跃笔记间隔缩短，没有新增评论时指数退避，结果限制在上下限之间"""
+    from .monitor import next_interval
+
+    interval, velocity = next_interval(600, 0, new_comments=60, elapsed=600)
+    assert velocity == 0.1
+    assert interval == max(settings.XHS_MONITOR_TARGET_COMMENTS / 0.1, settings.XHS_MONITOR_MIN_INTERVAL)
+
+    interval, _ = next_interval(600, 0, new_comments=6000, elapsed=60)
+    assert interval == settings.XHS_MONITOR_MIN_INTERVAL
+
+    interval, velocity = next_interval(600, 0.1, new_comments=0, elapsed=600)
+    assert interval == 600 * settings.XHS_MONITOR_BACKOFF and velocity == 0.05
+
+    interval, _ = next_interval(settings.XHS_MONITOR_MAX_INTERVAL, 0, new_comments=0, elapsed=600)
+    assert interval == settings.XHS_MONITOR_MAX_INTERVAL
+
+
+def test_concurrent_identical_crawls_share_upstream_requests():
+    """同一账号同时获取同一笔记的评论时每一页只请求一次上游，不同账号不合并"""
+    api = FakeUpstreamAPI(pages=3, page_size=10, sub_pages=2, latency=0.01)
+
+    async def crawl(*cookies):
+        return await asyncio.gather(*(api.get_comments(cookie, NOTE_URL) for cookie in cookies))
+
+    first, second = asyncio.run(crawl("a1=x", "a1=x; web_session=s"))
+    assert first == second and len(first) == 30 * 5
+    # 3 页评论 + 30 条根评论各 2 页子评论
+    assert len(api.requests) == 3 + 30 * 2
+
+    api.requests.clear()
+    first, second = asyncio.run(crawl("a1=x", "a1=y"))
+    assert first == second
+    assert len(api.requests) == 2 * (3 + 30 * 2)
+
+
+class BannedAccountAPI(FakeUpstreamAPI):
+    """Cookie 为 a1=banned 的账号的请求全部被上游拒绝"""
+
+    async def _request(self, method, cookies_str, uri, params=None, data=''):
+        if "a1=banned" in cookies_str:
+            await asyncio.sleep(0.01)
+            raise XhsRefusedError("账号异常", code=-100)
+        return await super()._request(method, cookies_str, uri, params, data)
+
+
+def test_single_flight_failure_not_shared_across_accounts():
+    """一个账号的上游失败不会交给同时请求同一页的其他账号"""
+    api = BannedAccountAPI(pages=1, page_size=10, latency=0.02)
+
+    async def crawl():
+        return await asyncio.gather(
+            api.get_comments("a1=banned", NOTE_URL), api.get_comments("a1=x", NOTE_URL), return_exceptions=True
+        )
+
+    banned, ok = asyncio.run(crawl())
+    assert isinstance(banned, XhsRefusedError)
+    assert len(ok) == 10
+
+
+def test_note_cache_bypassed_by_incremental_sync(monkeypatch):
+    """增量同步不读缓存的评论数，新评论在缓存过期前就能发现；未命中时不同账号不共享上游错误"""
+    from . import cache
+
+    redis = MemoryRedis()
+    monkeypatch.setattr(cache, "get_redis", lambda: redis)
+    monkeypatch.setattr(cache.response_cache, "_redis_down_until", 0.0)
+    monkeypatch.setattr(settings, "XHS_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "XHS_CACHE_TTLS", {"note": 60})
+
+    class BannedThreadAPI(GrowingThreadAPI):
+        async def _request(self, method, cookies_str, uri, params=None, data=''):
+            if "a1=banned" in cookies_str:
+                await asyncio.sleep(0.01)
+                raise XhsRefusedError("账号异常", code=-100)
+            return await super()._request(method, cookies_str, uri, params, data)
+
+    api = BannedThreadAPI(total=25)
+    api.latency = 0.02
+
+    async def both():
+        return await asyncio.gather(api.get_note_info("a1=banned", NOTE_URL), api.get_note_info("a1=x", NOTE_URL))
+
+    banned, info = asyncio.run(both())
+    assert banned is None and info["comment_count"] == "25"
+
+    api.total = 28
+    assert asyncio.run(api.get_note_info("a1=x", NOTE_URL))["comment_count"] == "25"
+    state = {"comment_count": "25", "since": (1700000024000, "c24")}
+    _, comments = asyncio.run(api.fetch_new_comments("a1=x", NOTE_URL, state))
+    assert [c["comment_id"] for c in comments] == ["c27", "c26", "c25"]
+    # 最新的笔记信息写回缓存
+    assert asyncio.run(api.get_note_info("a1=x", NOTE_URL))["comment_count"] == "28"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """挂载 XHS 路由的 TestClient，路由中的上游接口换成假接口
+
+    ``client(api_cls=FakeUpstreamAPI, **kwargs)`` 返回 TestClient，每个请求用 kwargs 新建一个假接口，
+    创建过的假接口按顺序记录在 ``client.apis`` 中。
+    """
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from . import routes
+
+    def make(api_cls=FakeUpstreamAPI, **kwargs):
+        def make_api():
+            make.apis.append(api_cls(**kwargs))
+            return make.apis[-1]
+
+        monkeypatch.setattr(routes, "AsyncXhsAPI", make_api)
+        app = FastAPI()
+        app.include_router(routes.router)
+        return TestClient(app)
+
+    make.apis = []
+    return make
+
+
+class MemoryRedis:
+    """只实现 ResponseCache 和批量任务计数用到的几个 Redis 命令"""
+
+    def __init__(self):
+        self.data = {}
+        self.hashes = {}
+        self.expires = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value).encode()
+        return True
+
+    async def hincrby(self, key, field, amount=1):
+        counters = self.hashes.setdefault(key, {})
+        counters[field.encode()] = counters.get(field.encode(), 0) + amount
+
+    async def hgetall(self, key):
+        return {field: str(value).encode() for field, value in self.hashes.get(key, {}).items()}
+
+    async def hsetnx(self, key, field, value):
+        counters = self.hashes.setdefault(key, {})
+        if field.encode() in counters:
+            return 0
+        counters[field.encode()] = value
+        return 1
+
+    async def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field.encode()] = value
+
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field.encode())
+
+    async def hkeys(self, key):
+        return list(self.hashes.get(key, {}))
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def expire(self, key, seconds):
+        self.expires[key] = seconds
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    """按顺序执行排队的命令"""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+
+
+class FakeJob:
+    def __init__(self, queue, function, key, kwargs):
+        self.queue = queue
+        self.function = function
+        self.key = key
+        self.kwargs = kwargs
+        self.status = "queued"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.queued = self.started = self.completed = 0
+        self.runs = 0
+
+    def get_queue(self):
+        return self.queue
+
+
+class FakeQueue:
+    """代替 SAQ 队列：与 SAQ 一样，相同 key 的任务未完成时不会重复入队，完成后可以再次入队；run 直接调用任务函数"""
+
+    def __init__(self):
+        self.jobs = {}
+
+    async def enqueue(self, function, key, **kwargs):
+        if key in self.jobs and self.jobs[key].status != "complete":
+            return None
+        for option in ("timeout", "ttl"):
+            kwargs.pop(option, None)
+        job = self.jobs[key] = FakeJob(self, function, key, kwargs)
+        return job
+
+    async def job(self, key):
+        return self.jobs.get(key)
+
+    async def run(self, key):
+        from . import tasks
+
+        job = self.jobs[key]
+        job.status = "active"
+        job.runs += 1
+        try:
+            job.result = await getattr(tasks, job.function)({"job": job}, **job.kwargs)
+        except Exception as e:
+            job.status, job.error = "failed", repr(e)
+            raise
+        job.status = "complete"
+        return job.result
+
+
+@pytest.fixture
+def batch_queue(monkeypatch, tmp_path):
+    """批量任务使用内存中的队列和 Redis，子任务的评论文件写到临时目录"""
+    from . import routes, services, tasks
+
+    queue = FakeQueue()
+    redis = MemoryRedis()
+    monkeypatch.setattr(tasks, "get_redis", lambda: redis)
+    monkeypatch.setattr(routes, "queue", queue)
+    monkeypatch.setattr(services, "AsyncXhsAPI", lambda: BannedAccountAPI(pages=2, page_size=10, sub_pages=1))
+    monkeypatch.setattr(settings, "XHS_PERSIST", False)
+    monkeypatch.setattr(settings, "XHS_EXPORT_DIR", str(tmp_path))
+    return queue
+
+
+def test_batch_fan_out_and_partial_failure_aggregation(batch_queue, tmp_path, client):
+    """父任务按请求拆成子任务；子任务完成后累加计数，全部结束后按请求顺序汇总，部分失败也能查询"""
+    import csv
+    import io
+    from .tasks import prune_batch_dirs
+
+    requests = [{"cookies": cookies, "note_url": NOTE_URL} for cookies in ("a1=x", "a1=banned", "a1=y")]
+    asyncio.run(batch_queue.enqueue("xhs_batch_comments", key="batch", requests=requests))
+    assert asyncio.run(batch_queue.run("batch")) == {"batch_id": "batch", "total": 3}
+    assert sorted(batch_queue.jobs) == ["batch", "batch:1", "batch:2", "batch:3"]
+    assert batch_queue.jobs["batch:2"].kwargs == {"batch_id": "batch", "task_id": 2, "request": requests[1]}
+
+    http = client()
+    body = http.get("/xhs/jobs/batch").json()
+    assert body["status"] == "active" and body["progress"] == 0
+    assert body["counters"] == {"total": 3, "success": 0, "failed": 0, "items": 0}
+
+    for key in ("batch:1", "batch:2"):
+        asyncio.run(batch_queue.run(key))
+    body = http.get("/xhs/jobs/batch").json()
+    assert body["status"] == "active" and body["result"] is None
+    assert body["counters"] == {"total": 3, "success": 1, "failed": 1, "items": 60}
+    assert http.get("/xhs/jobs/batch/comments.csv").status_code == 409
+
+    asyncio.run(batch_queue.run("batch:3"))
+    body = http.get("/xhs/jobs/batch").json()
+    assert body["progress"] == 1 and body["status"] == "complete"
+    assert body["counters"] == {"total": 3, "success": 2, "failed": 1, "items": 120}
+    assert [result["status"] for result in body["result"]] == ["success", "failed", "success"]
+    # 任务结果中只有数量和评论文件，评论不进 Redis
+    assert all("comments" not in result for result in body["result"])
+    assert body["result"][0]["comments_file"] == str(tmp_path / "batches" / "batch" / "1.ndjson")
+
+    rows = list(csv.DictReader(io.StringIO(http.get("/xhs/jobs/batch/comments.csv").content.decode("utf-8-sig"))))
+    assert len(rows) == 120 and rows[0]["comment_id"] == "c0-0"
+
+    # 结果过期后，批量目录在下一次扇出时删除
+    stale = tmp_path / "batches" / "batch"
+    os.utime(stale, (time.time() - settings.XHS_JOB_TTL - 1,) * 2)
+    assert prune_batch_dirs(settings.XHS_JOB_TTL) == 1 and not stale.exists()
+
+
+def test_batch_child_enqueued_twice_runs_once(batch_queue, monkeypatch):
+    """同一个 {batch_id}:{task_id} 重复入队或被两个 worker 同时执行时，只执行、只计数一次"""
+    from . import services, tasks
+
+    apis = []
+    monkeypatch.setattr(
+        services, "AsyncXhsAPI", lambda: apis.append(FakeUpstreamAPI(pages=2, page_size=10, sub_pages=1)) or apis[-1]
+    )
+    requests = [{"cookies": "a1=x", "note_url": NOTE_URL}]
+    asyncio.run(batch_queue.enqueue("xhs_batch_comments", key="batch", requests=requests))
+    asyncio.run(batch_queue.run("batch"))
+    first = asyncio.run(batch_queue.run("batch:1"))
+
+    # 父任务重试，已完成的子任务再次入队并执行
+    asyncio.run(batch_queue.enqueue("xhs_batch_comments", key="batch", requests=requests))
+    asyncio.run(batch_queue.run("batch"))
+    assert batch_queue.jobs["batch:1"].status == "queued"
+    assert asyncio.run(batch_queue.run("batch:1")) == first
+    assert len(apis) == 1
+    counters = asyncio.run(tasks.get_batch_counters("batch"))
+    assert counters == {"total": 1, "success": 1, "failed": 0, "items": 60}
+
+    # 两个 worker 副本同时拿到同一个子任务
+    monkeypatch.setattr(tasks, "CLAIM_POLL_INTERVAL", 0.01)
+    kwargs = {"batch_id": "other", "task_id": 1, "request": requests[0]}
+
+    async def run_twice():
+        return await asyncio.gather(
+            tasks.xhs_batch_comment_item({}, **kwargs), tasks.xhs_batch_comment_item({}, **kwargs)
+        )
+
+    left, right = asyncio.run(run_twice())
+    assert left == right and len(apis) == 2
+    assert asyncio.run(tasks.get_batch_counters("other"))["success"] == 1
+
+
+def test_batch_completes_when_children_fail_or_are_aborted(batch_queue, client, monkeypatch):
+    """子任务抛出异常、或被中止后没有记录结果时计为失败，批量任务仍然能结束并下载 CSV"""
+    from . import services
+    from .schemas import CommentRequest
+
+    requests = [{"cookies": "a1=x", "note_url": NOTE_URL} for _ in range(3)]
+    asyncio.run(batch_queue.enqueue("xhs_batch_comments", key="batch", requests=requests))
+    asyncio.run(batch_queue.run("batch"))
+
+    async def broken(self, task_id, request, comments_file=None):
+        raise RuntimeError("数据库不可用")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(services.XhsService, "process_comment_request", broken)
+        with pytest.raises(RuntimeError):
+            asyncio.run(batch_queue.run("batch:1"))
+    # 超时或 worker 退出后被 SAQ 清理，任务函数没有机会记录结果
+    batch_queue.jobs["batch:2"].status, batch_queue.jobs["batch:2"].error = "aborted", "swept"
+    asyncio.run(batch_queue.run("batch:3"))
+
+    http = client()
+    body = http.get("/xhs/jobs/batch").json()
+    assert body["status"] == "complete" and body["progress"] == 1
+    assert body["counters"] == {"total": 3, "success": 1, "failed": 2, "items": 60}
+    assert [result["status"] for result in body["result"]] == ["failed", "failed", "success"]
+    assert body["result"][0]["error"] == "数据库不可用" and body["result"][1]["error"] == "swept"
+    # 再次查询不会重复计数
+    assert http.get("/xhs/jobs/batch").json()["counters"]["failed"] == 2
+    assert http.get("/xhs/jobs/batch/comments.csv").status_code == 200
+
+    # 入库失败同样只让子任务结果记为失败
+    async def start_run(*args):
+        raise RuntimeError("数据库不可用")
+
+    monkeypatch.setattr(settings, "XHS_PERSIST", True)
+    monkeypatch.setattr(services, "start_run", start_run)
+    result = asyncio.run(services.XhsService().process_comment_request(1, CommentRequest(**requests[0])))
+    assert result["status"] == "failed" and result["error"] == "数据库不可用"
+
+
+def test_response_cache_read_through_and_stale(monkeypatch):
+    """搜索结果按搜索会话缓存，过期后先返回旧值再在后台刷新"""
+    from . import cache
+
+    redis = MemoryRedis()
+    monkeypatch.setattr(cache, "get_redis", lambda: redis)
+    monkeypatch.setattr(cache.response_cache, "_redis_down_until", 0.0)
+    monkeypatch.setattr(settings, "XHS_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "XHS_CACHE_TTLS", {"search": 300})
+    api = FakeUpstreamAPI(search_pages=2, notes_per_page=5)
+
+    first = asyncio.run(api.search_notes_by_keyword("a1=x", "测试", 100))
+    assert asyncio.run(api.search_notes_by_keyword("a1=x", " 测试 ", 100)) == first
+    assert api.search_requests == [1, 2]
+
+    async def search_stale():
+        notes = await api.search_notes_by_keyword("a1=x", "测试", 100)
+        await asyncio.gather(*cache.response_cache._refreshing.values())
+        return notes
+
+    monkeypatch.setattr(settings, "XHS_CACHE_TTLS", {"search": 1e-9})
+    assert asyncio.run(search_stale()) == first
+    assert api.search_requests == [1, 2, 1, 2]
+    assert asyncio.run(cache.response_cache.stats()) == {
+        "search": {"hit": 2, "stale": 2, "miss": 2, "hit_rate": 4 / 6}
+    }
+
+
+def test_response_cache_keeps_search_pages_in_one_session(monkeypatch):
+    """后续页沿用缓存的第一页的 search_id，不与其他搜索的页拼接；损坏的缓存条目按未命中处理"""
+    from . import cache
+
+    redis = MemoryRedis()
+    monkeypatch.setattr(cache, "get_redis", lambda: redis)
+    monkeypatch.setattr(cache.response_cache, "_redis_down_until", 0.0)
+    monkeypatch.setattr(settings, "XHS_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "XHS_CACHE_TTLS", {"search": 300})
+    api = FakeUpstreamAPI(search_pages=2, notes_per_page=5)
+
+    # 只取第一页，缓存的是这次搜索的第一页和 search_id
+    assert len(asyncio.run(api.search_notes_by_keyword("a1=x", "测试", 5))) == 5
+    notes = asyncio.run(api.search_notes_by_keyword("a1=y", "测试", 100))
+    assert len(notes) == 10 and len({note['url'] for note in notes}) == 10
+    assert api.search_requests == [1, 2]
+    assert api.search_ids[1] == api.search_ids[0]
+
+    for key in list(redis.data):
+        redis.data[key] = b'{"v": "old format"'
+    api.search_requests.clear()
+    assert asyncio.run(api.search_notes_by_keyword("a1=x", "测试", 100)) == notes
+    assert api.search_requests == [1, 2]
+
+
+def test_search_notes_dedup_and_termination():
+    """搜索结果按 note_id 去重，has_more 为 false 时停止，返回恰好 num 条"""
+    api = FakeUpstreamAPI(search_pages=3, notes_per_page=5, overlap=2)
+    notes = asyncio.run(api.search_notes_by_keyword("a1=x", "测试", 100))
+    assert len(notes) == 15
+    assert len({note['url'] for note in notes}) == 15
+    assert api.search_requests == [1, 2, 3]
+
+    api = FakeUpstreamAPI(search_pages=3, notes_per_page=5, overlap=2)
+    notes = asyncio.run(api.search_notes_by_keyword("a1=x", "测试", 7))
+    assert [note['title'] for note in notes] == [f'n1-{i}' for i in range(5)] + ['n2-0', 'n2-1']
+    assert api.search_requests == [1, 2]
+
+
+def test_search_comments_pipeline():
+    """搜索翻页到 has_more 为 false 为止；评论数量达到 num 时停止并取消在途请求"""
+    api = FakeUpstreamAPI(pages=2, page_size=10, search_pages=2, latency=0.001)
+    comments = asyncio.run(api.search_comments_by_keyword("a1=x", "测试", 1000))
+    assert api.search_requests == [1, 2]
+    assert len(comments) == 2 * 5 * 20
+
+    api = FakeUpstreamAPI(pages=2, page_size=10, search_pages=100, latency=0.001)
+    comments = asyncio.run(api.search_comments_by_keyword("a1=x", "测试", 25))
+    assert len(comments) == 25
+    assert len(api.search_requests) < 10
+
+
+def test_get_comments_stream(client):
+    """流式接口逐条输出评论，最后输出带游标的 summary"""
+    http = client(pages=3, page_size=10)
+    body = {"cookies": "a1=x", "note_url": NOTE_URL, "max_comments": 25}
+    response = http.post("/xhs/get_comments/stream", json=body)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 26
+    assert lines[-1] == {"type": "summary", "count": 25, "cursor": "2", "has_more": True}
+
+    body["cursor"] = lines[-1]["cursor"]
+    response = http.post("/xhs/get_comments/stream?format=sse", json=body)
+    events = response.text.strip().split("\n\n")
+    assert events[0].startswith("event: comment\ndata: ")
+    assert json.loads(events[-1].split("data: ", 1)[1]) == {"type": "summary", "count": 10, "cursor": "", "has_more": False}
+
+    # 非上游错误（如 Cookie 中没有 a1）同样以带 error 的 summary 结束
+    class BrokenAPI(FakeUpstreamAPI):
+        async def _request(self, method, cookies_str, uri, params=None, data=''):
+            raise Exception("Missing a1 cookie")
+
+    lines = [json.loads(line) for line in client(BrokenAPI).post("/xhs/get_comments/stream", json=body).text.splitlines()]
+    assert lines == [{"type": "summary", "count": 0, "cursor": "2", "has_more": True, "error": {"type": "Exception", "message": "Missing a1 cookie"}}]
+
+
+def test_comment_records_encode_like_dicts(client):
+    """评论记录没有 __dict__，但读取、比较和编码都和原来的 dict 一样"""
+    from .records import dumps
+    from .xhs_api import format_comment
+
+    record = format_comment('n', {'id': 'c', 'content': 'hi', 'create_time': 1700000000000, 'target_comment': {'id': 'p'}}, 'r')
+    assert not hasattr(record, '__dict__')
+    assert record['parent_comment_id'] == 'p' and record.get('missing') is None
+    assert record == dict(record) and list(record)[0] == 'note_id'
+    assert json.loads(dumps({'comments': [record]})) == {'comments': [dict(record)]}
+
+    response = client(pages=2, page_size=10).post("/xhs/get_comments", json={"cookies": "a1=x", "note_url": NOTE_URL})
+    body = response.json()
+    assert body["success"] and len(body["data"]) == 20
+    assert body["data"][0]["comment_id"] == "c0-0" and body["data"][0]["create_time"] == 1700000000000
+    assert body["data"][0]["note_time"] is None
+
+
+def test_note_time_formatted_only_for_requested_timezone(client):
+    """note_time 只在指定 tz 时按该时区格式化，与服务器时区无关"""
+    from datetime import datetime, timezone
+    from .records import get_time_formatter
+
+    formatter = get_time_formatter("UTC")
+    for millis in (0, 1700000059999, 1700000060000, 1711846799000):
+        expected = datetime.fromtimestamp(millis // 1000, timezone.utc).strftime("%Y-%m-%d %H:%M:%S") if millis else "未知时间"
+        assert formatter.format(millis) == expected
+
+    http = client(pages=1, page_size=2)
+    body = {"cookies": "a1=x", "note_url": NOTE_URL}
+    assert http.post("/xhs/get_comments?tz=UTC", json=body).json()["data"][0]["note_time"] == "2023-11-14 22:13:20"
+    lines = http.post("/xhs/get_comments/stream?tz=Asia/Shanghai", json=body).text.splitlines()
+    assert json.loads(lines[0])["note_time"] == "2023-11-15 06:13:20"
+    assert http.post("/xhs/get_comments?tz=Mars/Base", json=body).status_code == 400
+
+
+def test_comment_fields_projection_and_raw_passthrough(client):
+    """fields 只返回请求的字段，raw 原样返回接口的根评论且不展开子评论"""
+    http = client(pages=2, page_size=3, sub_pages=1)
+    body = {"cookies": "a1=x", "note_url": NOTE_URL}
+
+    data = http.post("/xhs/get_comments?fields=comment_id,root_comment_id,note_time&tz=UTC", json=body).json()["data"]
+    assert len(data) == 18
+    assert data[0] == {"comment_id": "c0-0", "root_comment_id": None, "note_time": "2023-11-14 22:13:20"}
+    assert data[1] == {"comment_id": "c0-0-s0-0", "root_comment_id": "c0-0", "note_time": "未知时间"}
+
+    data = http.post("/xhs/get_comments?raw=true", json=body).json()["data"]
+    assert [comment["id"] for comment in data] == [f"c{p}-{i}" for p in range(2) for i in range(3)]
+    assert data[0]["user_info"] == {"nickname": "user"} and data[0]["sub_comment_has_more"] is True
+    assert not any(uri.startswith("/api/sns/web/v2/comment/sub/page") for uri in client.apis[-1].requests)
+
+    lines = http.post("/xhs/get_comments/stream?fields=content", json=body).text.splitlines()
+    assert json.loads(lines[0]) == {"content": "comment 0-0"}
+    assert http.post("/xhs/get_comments?fields=author_id", json=body).status_code == 400
+    assert http.post("/xhs/get_comments?fields=content&raw=true", json=body).status_code == 400
+
+
+def test_root_comments_with_lazy_sub_comment_expansion(client):
+    """expand=false 只返回根评论，按根评论的 sub_cursor 分批展开子评论"""
+    http = client(pages=1, page_size=2, sub_pages=3)
+
+    roots = http.post("/xhs/get_comments?expand=false", json={"cookies": "a1=x", "note_url": NOTE_URL}).json()["data"]
+    assert [root["comment_id"] for root in roots] == ["c0-0", "c0-1"]
+    assert all(root["root_comment_id"] is None and root["sub_cursor"] for root in roots)
+    assert not any(uri.startswith("/api/sns/web/v2/comment/sub/page") for uri in client.apis[-1].requests)
+
+    response = http.post("/xhs/get_sub_comments", json={"cookies": "a1=x", "sub_cursor": roots[1]["sub_cursor"], "max_comments": 3}).json()
+    assert [comment["comment_id"] for comment in response["data"]] == ["c0-1-s0-0", "c0-1-s0-1", "c0-1-s1-0"]
+    assert {(comment["root_comment_id"], comment["parent_comment_id"]) for comment in response["data"]} == {("c0-1", "c0-1")}
+
+    response = http.post("/xhs/get_sub_comments?fields=comment_id", json={"cookies": "a1=x", "sub_cursor": response["sub_cursor"]}).json()
+    assert response["data"] == [{"comment_id": "c0-1-s1-1"}, {"comment_id": "c0-1-s2-0"}, {"comment_id": "c0-1-s2-1"}]
+    assert response["sub_cursor"] is None
+    assert http.post("/xhs/get_sub_comments", json={"cookies": "a1=x", "sub_cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_streaming_csv_export(monkeypatch, tmp_path, client):
+    """CSV 边采集边写入文件或响应，支持 gzip，表头固定且各行的键不一致也能导出"""
+    import csv
+    import gzip
+    import io
+
+    monkeypatch.setattr(settings, "XHS_EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(settings, "XHS_EXPORT_CSV_CHUNK_SIZE", 7)
+    service = XhsService()
+    service.api = FakeUpstreamAPI(pages=2, page_size=10, sub_pages=1)
+    path = asyncio.run(service.export_comments_to_csv(service.api.iter_comments("a1=x", NOTE_URL), compress=True))
+    assert path.endswith(".csv.gz")
+    with gzip.open(path, "rt", encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 60
+    assert {row["root_comment_id"] for row in rows if row["parent_comment_id"]} == {f"c{p}-{i}" for p in range(2) for i in range(10)}
+
+    response = client(pages=3, page_size=10).post("/xhs/get_comments/csv", json={"cookies": "a1=x", "note_url": NOTE_URL})
+    assert response.headers["content-disposition"] == 'attachment; filename="xhs_comments.csv"'
+    rows = list(csv.DictReader(io.StringIO(response.content.decode("utf-8-sig"))))
+    assert [row["comment_id"] for row in rows] == [f"c{p}-{i}" for p in range(3) for i in range(10)]
+
+    # 非上游错误同样在失败处截断，而不是中断响应
+    class BrokenPageAPI(FakeUpstreamAPI):
+        async def _request(self, method, cookies_str, uri, params=None, data=''):
+            if (params or {}).get("cursor") == "1":
+                raise Exception("Missing a1 cookie")
+            return await super()._request(method, cookies_str, uri, params, data)
+
+    response = client(BrokenPageAPI, pages=3, page_size=10).post("/xhs/get_comments/csv", json={"cookies": "a1=x", "note_url": NOTE_URL})
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.content.decode("utf-8-sig"))))
+    assert [row["comment_id"] for row in rows] == [f"c0-{i}" for i in range(10)]
+
+
+def test_token_bucket_paces_requests():
+    bucket = AsyncTokenBucket(rate=100, capacity=1)
+
+    async def run():
+        start = time.perf_counter()
+        await asyncio.gather(*(bucket.acquire() for _ in range(11)))
+        return time.perf_counter() - start
+
+    assert asyncio.run(run()) >= 0.09
+
+
+def test_parse_response_classification():
+    assert parse_response(200, b'{"code": 0, "success": true, "data": {}}') == {"code": 0, "success": True, "data": {}}
+    for status_code, content, error in [
+        (503, b'', XhsTransientError),
+        (404, b'', XhsRequestError),
+        (200, b'<html>', XhsResponseError),
+        (200, b'[]', XhsResponseError),
+        (200, b'{"code": -100, "success": false, "msg": "login expired"}', XhsRefusedError),
+    ]:
+        try:
+            parse_response(status_code, content)
+        except error:
+            continue
+        raise AssertionError(f"{status_code} {content!r} should raise {error.__name__}")
+
+
+def test_executor_retries_and_circuit_breaker(monkeypatch):
+    """只重试可重试的失败；连续故障后熔断器打开，直接失败不再发请求"""
+    monkeypatch.setattr(settings, "XHS_RETRY_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "XHS_RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr("app.xhs.executor.breakers", {"test": CircuitBreaker("test", failure_threshold=2, reset_timeout=60)})
+    calls = []
+
+    def failing(error):
+        async def attempt():
+            calls.append(error)
+            raise error
+        return attempt
+
+    outcome = asyncio.run(execute("other", failing(XhsRequestError("bad request", status_code=400))))
+    assert not outcome.ok and outcome.attempts == 1
+
+    outcome = asyncio.run(execute("test", failing(XhsTransientError("timeout"))))
+    assert isinstance(outcome.error, XhsTransientError) and outcome.attempts == 2
+    calls.clear()
+    outcome = asyncio.run(execute("test", failing(XhsTransientError("timeout"))))
+    assert isinstance(outcome.error, XhsCircuitOpenError) and calls == []
+
+
+def test_endpoint_family():
+    assert endpoint_family("/api/sns/web/v1/search/notes") == "search"
+    assert endpoint_family("/api/sns/web/v2/comment/page") == "comment"
+    assert endpoint_family("/api/sns/web/v2/comment/sub/page?note_id=1&cursor=") == "sub_comment"
+    assert endpoint_family("/api/sns/web/v1/feed") == "feed"
+    assert endpoint_family("/api/sns/web/v1/comment/post") == "default"
+
+
+
+@pytest.fixture
+def cookie_server():
+    """本地 HTTP 服务：记录每个请求带的 Cookie 头，并在响应中下发 Set-Cookie"""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            received.append(self.headers.get("Cookie"))
+            self.send_response(200)
+            self.send_header("Set-Cookie", "web_session=leaked; Path=/")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/", received
+    server.shutdown()
+    server.server_close()
+
+
+def test_shared_session_per_loop_discards_set_cookie(cookie_server, monkeypatch):
+    """每个事件循环一个共享会话；响应的 Set-Cookie 不保存，每个请求只带调用方传入的 cookies；关闭时释放会话"""
+    from app import lifetime
+    from . import client
+
+    url, received = cookie_server
+    monkeypatch.setattr(lifetime, "close_redis", lambda: asyncio.sleep(0))
+
+    async def crawl():
+        session = client.get_session()
+        assert client.get_session() is session
+        for a1 in ("x", "y"):
+            await session.get(url, cookies={"a1": a1})
+        await session.get(url)
+        return session
+
+    first = asyncio.run(crawl())
+    assert received == ["a1=x", "a1=y", None]
+
+    second = asyncio.run(crawl())
+    assert second is not first
+    assert received[3:] == ["a1=x", "a1=y", None]
+
+    asyncio.run(lifetime.shutdown())
+    assert client._session is None and client._session_loop is None
+    asyncio.run(client.close_session())
+
 if __name__ == "__main__":
     print("=== 测试URL参数提取 ===")
     asyncio.run(test_url_extraction())
@@ -72,5 +1311,17 @@ if __name__ == "__main__":
     
     print("\n=== 测试服务层功能 ===")
     asyncio.run(test_service_functions())
+
+    print("\n=== 签名 ===")
+    test_python_creator_signer_matches_node()
+    test_concurrent_signing()
+    test_concurrent_web_signing()
+    test_iter_comments_stops_at_max_comments()
+    test_iter_comments_failure_handling()
+    test_parse_response_classification()
+    test_sub_comments_expanded_concurrently_in_order()
+    test_search_notes_dedup_and_termination()
+    test_search_comments_pipeline()
+    test_token_bucket_paces_requests()
     
     print("\n测试完成！")
\ No newline at end of file
@@ -1,27 +1,236 @@
 """Xiaohongshu API client implementation."""
 
 import asyncio
+import base64
+import hashlib
 import json
-import time
 import os
 from pathlib import Path
-from typing import List, Dict, Optional, Any
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
 from urllib.parse import urlencode, urlparse, parse_qs
 import csv
 from datetime import datetime
 from mimetypes import guess_extension
 import math
 import random
-from curl_cffi import requests
+from curl_cffi import CurlError, requests
 from loguru import logger
-from .xhs_utils.xhs_util import get_search_id,splice_str, generate_request_params, generate_x_b3_traceid, get_common_headers,convert_discovery_to_explore_url
+from app.core.config import settings
+from .cache import response_cache
+from .records import CommentRecord, NoteRecord, RootCommentRecord, TimeFormatter
+from .client import EDITH_HOST, close_session, get_session
+from .singleflight import single_flight
+from .errors import XhsError, XhsRefusedError, XhsRequestError, XhsResponseError, XhsTransientError
+from .executor import execute
+from .ratelimit import endpoint_family, upstream_limiter
+from .xhs_utils.xhs_util import get_search_id,splice_str, trans_cookies, generate_request_params, get_common_headers,convert_discovery_to_explore_url
+
+
+def format_comment(note_id: str, comment: Dict[str, Any], root_comment_id: Optional[str] = None) -> CommentRecord:
+    """把接口返回的评论（根评论或子评论）规范化为统一的记录
+
+    Args:
+        note_id (str): 笔记ID
+        comment (dict): 接口返回的原始评论
+        root_comment_id (str, optional): 子评论所属的根评论ID，根评论不传
+
+    Returns:
+        CommentRecord: 规范化后的评论，子评论的 parent_comment_id 为被回复的评论，没有时为根评论；
+            评论时间只保留毫秒级时间戳 create_time，note_time 需要时由 TimeFormatter 按时区填入
+    """
+    return CommentRecord(
+        note_id,
+        comment.get('content', ''),
+        comment.get('like_count', 0),
+        (comment.get('user_info') or {}).get('nickname', ''),
+        comment.get('id', ''),
+        root_comment_id,
+        _parent_comment_id(comment, root_comment_id),
+        comment.get('ip_location', ''),
+        _create_time(comment),
+        None
+    )
+
+
+def _parent_comment_id(comment: Dict[str, Any], root_comment_id: Optional[str]) -> Optional[str]:
+    if not root_comment_id:
+        return None
+    return (comment.get('target_comment') or {}).get('id') or root_comment_id
+
+
+def _create_time(comment: Dict[str, Any]) -> Optional[int]:
+    create_time = comment.get('create_time')
+    return int(float(create_time)) if create_time else None
+
+
+def account_key(cookies_str: str) -> str:
+    """调用方账号的标识（a1 Cookie 的哈希，没有 a1 时用整个 Cookie 字符串），用于区分不同账号的请求"""
+    a1 = trans_cookies(cookies_str or '').get('a1') or cookies_str or ''
+    return hashlib.sha1(a1.encode('utf-8')).hexdigest()[:16]
+
+
+# 每个字段从 (note_id, 原始评论, root_comment_id) 取值的方法，与 format_comment 的结果一致
+COMMENT_FIELDS: Dict[str, Callable[[str, Dict[str, Any], Optional[str]], Any]] = {
+    'note_id': lambda note_id, comment, root_comment_id: note_id,
+    'content': lambda note_id, comment, root_comment_id: comment.get('content', ''),
+    'like_count': lambda note_id, comment, root_comment_id: comment.get('like_count', 0),
+    'nickname': lambda note_id, comment, root_comment_id: (comment.get('user_info') or {}).get('nickname', ''),
+    'comment_id': lambda note_id, comment, root_comment_id: comment.get('id', ''),
+    'root_comment_id': lambda note_id, comment, root_comment_id: root_comment_id,
+    'parent_comment_id': lambda note_id, comment, root_comment_id: _parent_comment_id(comment, root_comment_id),
+    'comment_location': lambda note_id, comment, root_comment_id: comment.get('ip_location', ''),
+    'create_time': lambda note_id, comment, root_comment_id: _create_time(comment),
+    'note_time': lambda note_id, comment, root_comment_id: None,
+}
+
+
+def comment_projector(fields: Sequence[str], formatter: Optional[TimeFormatter] = None) -> Callable[[str, Dict[str, Any], Optional[str]], Dict[str, Any]]:
+    """生成只取部分字段的评论规范化函数，可以代替 format_comment 传给 iter_comments
+
+    只计算请求的字段，其他字段的取值和转换都不执行。
+
+    Args:
+        fields: 需要的字段，取值见 COMMENT_FIELDS
+        formatter (TimeFormatter, optional): 请求了 note_time 时用它按时区格式化
+
+    Returns:
+        callable: (note_id, comment, root_comment_id) -> 只包含这些字段的 dict
+
+    Raises:
+        ValueError: 未知的字段
+    """
+    unknown = [field for field in fields if field not in COMMENT_FIELDS]
+    if unknown:
+        raise ValueError(f"未知的字段: {', '.join(unknown)}，可选: {', '.join(COMMENT_FIELDS)}")
+    getters = [(field, COMMENT_FIELDS[field]) for field in dict.fromkeys(fields)]
+    if formatter:
+        getters = [
+            (field, (lambda note_id, comment, root_comment_id: formatter.format(_create_time(comment))) if field == 'note_time' else getter)
+            for field, getter in getters
+        ]
+
+    def project(note_id: str, comment: Dict[str, Any], root_comment_id: Optional[str] = None) -> Dict[str, Any]:
+        return {field: getter(note_id, comment, root_comment_id) for field, getter in getters}
+
+    return project
+
+
+def encode_sub_cursor(note_id: str, root_comment_id: str, xsec_token: str, cursor: str = '', offset: int = 0) -> str:
+    """把获取某条根评论子评论所需的参数编码为不透明的游标
+
+    Args:
+        cursor (str): 子评论分页游标，为空时从第一条子评论开始
+        offset (int): 该页中已经返回过的子评论数量
+    """
+    state = [note_id, root_comment_id, xsec_token, cursor, offset]
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_sub_cursor(sub_cursor: str) -> Tuple[str, str, str, str, int]:
+    """解析 encode_sub_cursor 生成的游标
+
+    Returns:
+        tuple: (note_id, root_comment_id, xsec_token, cursor, offset)
+
+    Raises:
+        ValueError: 游标无效
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(sub_cursor + '=' * (-len(sub_cursor) % 4)))
+        note_id, root_comment_id, xsec_token, cursor, offset = state
+        if not (note_id and root_comment_id) or not isinstance(offset, int) or offset < 0:
+            raise ValueError
+        return str(note_id), str(root_comment_id), str(xsec_token), str(cursor), offset
+    except (TypeError, ValueError) as e:
+        raise ValueError("无效的sub_cursor") from e
+
+
+def with_sub_cursor(item: Any, note_id: str, comment: Dict[str, Any], xsec_token: str) -> Any:
+    """给不展开子评论的根评论加上 sub_comment_count 和 sub_cursor
+
+    Args:
+        item: transform 规范化后的根评论，CommentRecord 或 dict
+        comment (dict): 接口返回的原始根评论
+    """
+    count = str(comment.get('sub_comment_count') or '')
+    sub_comment_count = int(count) if count.isdigit() else len(comment.get('sub_comments') or [])
+    has_sub_comments = sub_comment_count > 0 or bool(comment.get('sub_comments')) or bool(comment.get('sub_comment_has_more'))
+    sub_cursor = encode_sub_cursor(note_id, comment.get('id', ''), xsec_token) if has_sub_comments else None
+    if isinstance(item, CommentRecord):
+        return RootCommentRecord(*(getattr(item, name) for name in CommentRecord.__slots__), sub_comment_count, sub_cursor)
+    item['sub_comment_count'] = sub_comment_count
+    item['sub_cursor'] = sub_cursor
+    return item
+
+
+def format_note(item: Dict[str, Any]) -> NoteRecord:
+    """把搜索接口返回的笔记规范化为统一的记录"""
+    note_id = item.get('id')
+    xsec_token = item.get('xsec_token')
+    return NoteRecord(
+        (item.get('note_card') or {}).get('display_title'),
+        note_id,
+        xsec_token,
+        f'https://www.xiaohongshu.com/explore/{note_id}?xsec_token={xsec_token}&xsec_source=pc_feed'
+    )
+
+
+def comment_key(comment: Dict[str, Any]) -> Tuple[int, str]:
+    """评论的排序键 (create_time, comment_id)，接口返回的原始评论和规范化后的评论都适用"""
+    create_time = comment.get('create_time')
+    return int(float(create_time)) if create_time else 0, comment.get('comment_id') or comment.get('id') or ''
+
+
+def parse_response(status_code: int, content: bytes) -> Dict[str, Any]:
+    """按状态码和响应内容把上游响应分类为成功或各类 XhsError
+
+    Args:
+        status_code (int): HTTP 状态码
+        content (bytes): 响应体
+
+    Returns:
+        dict: 响应 JSON
+
+    Raises:
+        XhsTransientError: 5xx
+        XhsRequestError: 4xx
+        XhsResponseError: 响应不是 JSON 对象
+        XhsRefusedError: 响应中 code 不为 0
+    """
+    if status_code >= 500:
+        raise XhsTransientError(f"上游返回 {status_code}", status_code=status_code)
+    if status_code >= 400:
+        raise XhsRequestError(f"上游返回 {status_code}", status_code=status_code)
+    try:
+        body = json.loads(content)
+    except ValueError:
+        raise XhsResponseError("响应不是合法的JSON", status_code=status_code)
+    if not isinstance(body, dict):
+        raise XhsResponseError("响应不是JSON对象", status_code=status_code)
+    code = body.get('code', 0)
+    if code != 0 or body.get('success') is False:
+        raise XhsRefusedError(body.get('msg') or body.get('message') or '未知错误', status_code=status_code, code=code)
+    return body
+
+
+def response_data(body: Dict[str, Any]) -> Dict[str, Any]:
+    """取出响应中的 data 对象
+
+    Raises:
+        XhsResponseError: 响应中没有 data 对象
+    """
+    data = body.get('data')
+    if not isinstance(data, dict):
+        raise XhsResponseError("响应中没有data对象")
+    return data
+
 
 class XhsAPI:
-    """小红书API类，封装了获取评论、搜索笔记等功能"""
-    
-    def __init__(self):
-        """初始化XhsAPI类"""
-        self.note_list = []
+    """小红书API类，封装了获取评论、搜索笔记等功能
+
+    同步接口供脚本使用，内部在新的事件循环中运行 AsyncXhsAPI 的对应方法，
+    因此同样经过限速；不能在已运行的事件循环中调用，异步代码请直接使用 AsyncXhsAPI。
+    """
 
     def extract_url_params(self, url: str) -> Dict[str, str]:
         """从URL中提取参数
@@ -46,124 +255,31 @@ class XhsAPI:
         }
         return params
 
-    def get_comments(self, cookies_str: str, ori_url: str, cursor: str = '', comments_list: List[Dict] = [], max_comments: Optional[int] = None) -> List[Dict]:
+    def _run(self, method: str, *args, **kwargs) -> Any:
+        async def runner():
+            try:
+                return await getattr(AsyncXhsAPI(), method)(*args, **kwargs)
+            finally:
+                await close_session()
+        return asyncio.run(runner())
+
+    def get_comments(self, cookies_str: str, ori_url: str, cursor: str = '', comments_list: Optional[List[Dict]] = None, max_comments: Optional[int] = None) -> List[Dict]:
         """获取小红书笔记下的评论
         
         Args:
             cookies_str (str): Cookie字符串
             ori_url (str): 笔记URL
             cursor (str): 分页游标，默认为空
-            comments_list (list): 评论列表
-            max_comments (int, optional): 最大评论数量
+            comments_list (list, optional): 追加评论的列表，不传时新建
+            max_comments (int, optional): comments_list 的最大长度
             
         Returns:
             list: 评论列表
         """
-        if comments_list is None:
-            comments_list = []
-            
-        # 转换discovery URL为explore URL
-        if "discovery" in ori_url:
-            ori_url = convert_discovery_to_explore_url(ori_url)
-            logger.info(f"Converted URL: {ori_url}")
-        
-        note_params = self.extract_url_params(ori_url)
-        uri = "/api/sns/web/v2/comment/page"
-        params = {
-            "note_id": note_params['note_id'],
-            "cursor": cursor,
-            "top_comment_id": "",
-            "image_formats": "jpg,webp,avif",
-            "xsec_token": note_params['xsec_token'],
-        }
-        
-        # 生成请求头和cookies
-        headers, cookies, data = generate_request_params(cookies_str, uri, params)
-        url = "https://edith.xiaohongshu.com/api/sns/web/v2/comment/page"
-        
-        try:
-            response = requests.get(url, headers=headers, cookies=cookies, params=params, impersonate="chrome110")
-            response_data = response.json()
-                
-            if not response_data or not isinstance(response_data, dict) or 'data' not in response_data:
-                logger.warning("API响应数据异常，返回当前评论列表")
-                return comments_list
-                
-            comments = response_data.get('data', {}).get('comments', [])
-        except Exception as e:
-            logger.error(f"获取评论时发生异常: {e}，返回当前评论列表")
-            return comments_list
-        
-        logger.info(f"成功获取{len(comments)}条评论")
-        
-        for comment in comments:
-            # 检查是否已达到最大评论数量
-            if max_comments and len(comments_list) >= max_comments:
-                return comments_list
-                
-            format_dict = {
-                'note_id': note_params['note_id'],
-                'content': comment.get('content', ''),
-                'like_count': comment.get('like_count', 0),
-                'nickname': comment.get('user_info', {}).get('nickname', ''),
-                'comment_id': comment.get('id', ''),
-                'comment_location': comment.get('ip_location', ''),
-                'note_time': datetime.fromtimestamp(
-                    int(float(comment.get('create_time', 0))/1000)
-                ).strftime("%Y-%m-%d %H:%M:%S") if comment.get('create_time') else "未知时间"
-            }
-            comments_list.append(format_dict)
-            
-            # 检查是否已达到最大评论数量
-            if max_comments and len(comments_list) >= max_comments:
-                return comments_list
-            
-            # 处理子评论
-            for sub_comment in comment.get('sub_comments', []):
-                if max_comments and len(comments_list) >= max_comments:
-                    return comments_list
-                    
-                sub_format_dict = {
-                    'note_id': note_params['note_id'],
-                    'content': sub_comment.get('content', ''),
-                    'like_count': sub_comment.get('like_count', 0),
-                    'nickname': sub_comment.get('user_info', {}).get('nickname', ''),
-                    'comment_id': sub_comment.get('id', ''),
-                    'comment_location': sub_comment.get('ip_location', ''),
-                    'note_time': datetime.fromtimestamp(
-                        int(float(sub_comment.get('create_time', 0))/1000)
-                    ).strftime("%Y-%m-%d %H:%M:%S") if sub_comment.get('create_time') else "未知时间"
-                }
-                comments_list.append(sub_format_dict)
-            
-            # 获取更多子评论
-            if comment.get('sub_comment_has_more') == True:
-                if max_comments and len(comments_list) >= max_comments:
-                    return comments_list
-                    
-                time.sleep(2)
-                self.get_sub_comments(
-                    cookies_str,
-                    comment.get('note_id', note_params['note_id']),
-                    comment.get('id', ''),
-                    comment.get('sub_comment_cursor', ''),
-                    note_params['xsec_token'],
-                    comments_list,
-                    max_comments
-                )
-        
-        # 检查是否有下一页
-        if response_data.get('data', {}).get('has_more') == True:
-            if max_comments and len(comments_list) >= max_comments:
-                return comments_list
-                
-            new_cursor = response_data.get('data', {}).get('cursor', '')
-            self.get_comments(cookies_str, ori_url, new_cursor, comments_list, max_comments)
-        
-        return comments_list
-    
-    def get_sub_comments(self,cookies_str: str,note_id: str,root_comment_id: str,cursor: str,xsec_token: str,comments_list: List[Dict],max_comments: Optional[int] = None) -> None:
-        """获取子评论
+        return self._run('get_comments', cookies_str, ori_url, cursor, comments_list, max_comments)
+
+    def get_sub_comments(self, cookies_str: str, note_id: str, root_comment_id: str, cursor: str, xsec_token: str, comments_list: List[Dict], max_comments: Optional[int] = None) -> None:
+        """获取子评论，追加到 comments_list
         
         Args:
             cookies_str (str): Cookie字符串
@@ -174,69 +290,7 @@ class XhsAPI:
             comments_list (list): 评论列表
             max_comments (int, optional): 最大评论数量
         """
-        uri = "/api/sns/web/v2/comment/sub/page"
-        params = {
-            "note_id": note_id,
-            "root_comment_id": root_comment_id,
-            "num": 10,
-            "cursor": cursor,
-            "top_comment_id": "",
-            "image_formats": "jpg,webp,avif",
-            "xsec_token": xsec_token,
-        }
-        splice_api = splice_str(uri, params)
-        try:
-            # 生成请求头和cookies
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            url = "https://edith.xiaohongshu.com/api/sns/web/v2/comment/sub/page"
-            
-            response = requests.get(url=f"https://edith.xiaohongshu.com{splice_api}", cookies=cookies, headers=headers)
-            response_data = response.json()
-            print('rrss',response_data)
-            if not response_data or not isinstance(response_data, dict) or 'data' not in response_data:
-                logger.warning("子评论API响应数据异常")
-                return
-                
-            sub_comments = response_data.get('data', {}).get('comments', [])
-            logger.info(f"成功获取{len(sub_comments)}条子评论")
-            
-            for sub_comment in sub_comments:
-                # 检查是否已达到最大评论数量
-                if max_comments and len(comments_list) >= max_comments:
-                    return
-                    
-                sub_format_dict = {
-                    'note_id': note_id,
-                    'content': sub_comment.get('content', ''),
-                    'like_count': sub_comment.get('like_count', 0),
-                    'nickname': sub_comment.get('user_info', {}).get('nickname', ''),
-                    'comment_id': sub_comment.get('id', ''),
-                    'comment_location': sub_comment.get('ip_location', ''),
-                    'note_time': datetime.fromtimestamp(
-                        int(float(sub_comment.get('create_time', 0))/1000)
-                    ).strftime("%Y-%m-%d %H:%M:%S") if sub_comment.get('create_time') else "未知时间"
-                }
-                comments_list.append(sub_format_dict)
-            
-            # 检查是否还有更多子评论
-            if response_data.get('data', {}).get('has_more') == True:
-                if max_comments and len(comments_list) >= max_comments:
-                    return
-                    
-                new_cursor = response_data.get('data', {}).get('cursor', '')
-                time.sleep(1)  # 避免请求过快
-                self.get_sub_comments(
-                    cookies_str,
-                    note_id,
-                    root_comment_id,
-                    new_cursor,
-                    xsec_token,
-                    comments_list,
-                    max_comments
-                )
-                
-        except Exception as e:
-            logger.error(f"获取子评论时发生异常: {e}")
+        self._run('get_sub_comments', cookies_str, note_id, root_comment_id, cursor, xsec_token, comments_list, max_comments)
 
     def download_image_with_date(self, url, save_dir="images", date_format="%Y%m%d_%H%M%S", 
                                 include_original_name=False, avoid_overwrite=True):
@@ -296,191 +350,21 @@ class XhsAPI:
             return False
 
     def search_notes_by_keyword(self, cookies_str, keyword, num):
-        """根据关键词搜索的笔记下面的评论
+        """根据关键词搜索笔记
         
         Args:
             keyword (str): 搜索关键词
             num (int): 搜索数量
         """
-        for p in range(1000):
-            uri = "/api/sns/web/v1/search/notes"
-            params = {
-                "keyword": keyword,
-                "page": p,
-                "page_size": "20",
-                "search_id": get_search_id(),
-                "sort": "general",
-                "note_type": "0",
-                # "ext_flags": [],
-                # "filters": [
-                #     {
-                #         "tags": [
-                #             "general"
-                #         ],
-                #         "type": "sort_type"
-                #     },
-                #     {
-                #         "tags": [
-                #             "不限"
-                #         ],
-                #         "type": "filter_note_type"
-                #     },
-                #     {
-                #         "tags": [
-                #             "不限"
-                #         ],
-                #         "type": "filter_note_time"
-                #     },
-                #     {
-                #         "tags": [
-                #             "不限"
-                #         ],
-                #         "type": "filter_note_range"
-                #     },
-                #     {
-                #         "tags": [
-                #             "不限"
-                #         ],
-                #         "type": "filter_pos_distance"
-                #     }
-                # ],
-                # "geo": "",
-                # "image_formats": [
-                #     "jpg",
-                #     "webp",
-                #     "avif"
-                # ]
-            }
-            
-            # 这里需要实现具体的搜索逻辑
-            # 暂时使用硬编码的cookies字符串
-            headers, cookies, data = generate_request_params(cookies_str, uri, params)
-            print(headers)
-            url = "https://edith.xiaohongshu.com/api/sns/web/v1/search/notes"
-            try:
-                response_obj = requests.post(url, headers=headers, cookies=cookies, data=data.encode('utf-8'))
-                response = response_obj.json()
-                print(f"API响应状态码: {response_obj.status_code}")
-                print(f"API响应内容: {response}")
-            except Exception as e:
-                print(f"API请求失败: {e}")
-                continue
-                
-            if not response or not isinstance(response, dict):
-                print("API响应为空或格式错误")
-                continue
-                
-            for item in response.get('data', {}).get('items', []):
-                note_id = item.get('id')
-                xsec_token = item.get('xsec_token')
-                if item.get('note_card'):
-                    format_dict = {
-                        'title': item.get('note_card').get('display_title'),
-                        'note_id': note_id,
-                        'xsec_token': xsec_token,
-                        'url': f'https://www.xiaohongshu.com/explore/{note_id}?xsec_token={xsec_token}&xsec_source=pc_feed'
-                    }
-                    print(format_dict)
-                    self.note_list.append({'title': format_dict['title'], 'url': format_dict['url']})
-                    if len(self.note_list) >= num:
-                        return self.note_list
-    
-    def search_comments_by_keyword(self, cookies_str, keyword, num, comments_list: list = []):
+        return self._run('search_notes_by_keyword', cookies_str, keyword, num)
+
+    def search_comments_by_keyword(self, cookies_str, keyword, num, comments_list: Optional[list] = None):
         """根据关键词搜索的笔记下面的评论
         Args:
             keyword (str): 搜索关键词
             num (int): 搜索的评论数量
         """
-        for p in range(1000):
-            uri = "/api/sns/web/v1/search/notes"
-            params = {
-                "keyword": keyword,
-                "page": "1",
-                "page_size": "20",
-                "search_id": generate_x_b3_traceid(21),
-                "sort": "general",
-                "note_type": "0",
-                "ext_flags": [],
-                "filters": [
-                    {
-                        "tags": [
-                            "general"
-                        ],
-                        "type": "sort_type"
-                    },
-                    {
-                        "tags": [
-                            "不限"
-                        ],
-                        "type": "filter_note_type"
-                    },
-                    {
-                        "tags": [
-                            "不限"
-                        ],
-                        "type": "filter_note_time"
-                    },
-                    {
-                        "tags": [
-                            "不限"
-                        ],
-                        "type": "filter_note_range"
-                    },
-                    {
-                        "tags": [
-                            "不限"
-                        ],
-                        "type": "filter_pos_distance"
-                    }
-                ],
-                "geo": "",
-                "image_formats": [
-                    "jpg",
-                    "webp",
-                    "avif"
-                ]
-            }
-            # 将params字典转换为查询字符串
-            from urllib.parse import urlencode
-            query_string = urlencode(params, doseq=True)
-            final_uri = f"{uri}?{query_string}"
-            print(final_uri)
-            
-            # 这里需要实现具体的搜索逻辑
-            # 暂时使用硬编码的cookies字符串
-            headers, cookies, data = generate_request_params(cookies_str, uri, params)
-            url = "https://edith.xiaohongshu.com/api/sns/web/v1/search/notes"
-            try:
-                response = requests.post(url, headers=headers, cookies=cookies, data=data.encode('utf-8')).json()
-                if not response or not isinstance(response, dict) or 'data' not in response:
-                    print("搜索笔记API响应数据异常，返回当前评论列表")
-                    return comments_list
-            except Exception as e:
-                print(f"搜索笔记时发生异常: {e}，返回当前评论列表")
-                return comments_list
-            for item in response.get('data', {}).get('items', []):
-                note_id = item.get('id')
-                xsec_token = item.get('xsec_token')
-                if item.get('note_card'):
-                    format_dict = {
-                        'title': item.get('note_card').get('display_title'),
-                        'note_id': note_id,
-                        'xsec_token': xsec_token,
-                        'url': f'https://www.xiaohongshu.com/explore/{note_id}?xsec_token={xsec_token}&xsec_source=pc_feed'
-                    }
-                    print(format_dict)
-                    
-                    # 每爬一篇笔记，就立即爬取该笔记下的评论
-                    # 计算还需要多少条评论
-                    # remaining_comments = num - len(comments_list)
-                    self.get_comments(cookies_str, format_dict['url'], '', comments_list, max_comments=num)
-                    
-                # 如果评论列表长度超过num，就返回评论列表
-                if len(comments_list) >= num:
-                    return comments_list
-        
-        # 如果循环结束仍未收集到足够的评论，返回已收集到的评论
-        return comments_list
+        return self._run('search_comments_by_keyword', cookies_str, keyword, num, comments_list)
 
     def merge_note_info_with_comments(self, note_info, comments_list,userInfo,kerword):
         """将笔记信息与评论列表合并
@@ -529,11 +413,553 @@ class XhsAPI:
         """获取小红书笔记信息
         Args:
             cookies_str (str): Cookies字符串
+            url (str): 笔记URL
+        """
+        return self._run('get_note_info', cookies_str, url)
+
+    def monitor_comments(self, cookies_str, note_url, userInfo, keyword, interval=60, state=None):
+        """监控笔记评论变化
+        Args:
+            cookies_str (str): Cookies字符串
+            note_url (str): 笔记URL
+            userInfo (str): 客户标识
+            keyword (str): 关键词
+            interval (int): 检查间隔时间（秒）
+            state (dict, optional): 多次调用时传入同一个 dict，只返回新增评论
+        """
+        return self._run('monitor_comments', cookies_str, note_url, userInfo, keyword, interval, state)
+
+    def reply_comment(self, cookies_str, note_id, comment_id, content):
+        """回复评论
+        
+        Args:
+            cookies_str (str): Cookies字符串
+            note_id (str): 笔记ID
+            comment_id (str): 评论ID
+            content (str): 回复内容
+        """
+        return self._run('reply_comment', cookies_str, note_id, comment_id, content)
+
+
+
+class AsyncXhsAPI(XhsAPI):
+    """XhsAPI 的异步版本
+
+    所有请求通过共享的 curl_cffi AsyncSession 发出（连接复用、HTTP/2），
+    签名在线程池中计算，不阻塞事件循环。
+    """
+
+    async def _request(self, method: str, cookies_str: str, uri: str, params: Optional[Dict] = None, data: Any = '') -> Any:
+        """签名并发送请求，返回响应中的 JSON 对象
+
+        网络错误、超时和 5xx 自动退避重试（每次重试重新限速、重新签名），
+        其他失败以及熔断时抛出 XhsError 的子类。
+
+        Args:
+            method (str): GET 或 POST
+            cookies_str (str): Cookie字符串
+            uri (str): 接口路径，参与签名
+            params (dict, optional): 查询参数
+            data: 参与签名的数据，POST 请求同时作为请求体
+
+        Raises:
+            XhsError: 请求最终失败
+        """
+        family = endpoint_family(uri)
+
+        async def attempt():
+            await upstream_limiter.acquire(family)
+            headers, cookies, body = await asyncio.to_thread(generate_request_params, cookies_str, uri, data)
+            try:
+                response = await get_session().request(
+                    method,
+                    f"{EDITH_HOST}{uri}",
+                    params=params,
+                    headers=headers,
+                    cookies=cookies,
+                    data=body.encode('utf-8') if method == 'POST' and body else None,
+                )
+            except CurlError as e:
+                raise XhsTransientError(f"网络错误: {e}")
+            return parse_response(response.status_code, response.content)
+
+        outcome = await execute(family, attempt)
+        if not outcome.ok:
+            raise outcome.error
+        return outcome.data
+
+    async def _fetch_data(self, method: str, cookies_str: str, uri: str, params: Optional[Dict] = None, data: Any = '') -> Dict[str, Any]:
+        """请求上游并返回响应中的 data
+
+        评论和子评论分页通过 single_flight 调用，同一账号同一时刻多次获取同一笔记的同一页时
+        （包括不同进程）只发出一次上游请求，结果共享；不同账号的请求、结果和失败互不共享。
+        """
+        return response_data(await self._request(method, cookies_str, uri, params=params, data=data))
+
+    async def iter_comments(self, cookies_str: str, note_url: str, cursor: str = '', max_comments: Optional[int] = None, progress: Optional[Dict[str, Any]] = None, since: Optional[Tuple[int, str]] = None, transform: Callable[[str, Dict[str, Any], Optional[str]], Any] = format_comment, raw: bool = False, expand: bool = True) -> AsyncIterator[Any]:
+        """逐条获取笔记评论（包括展开的子评论），调用方可以边取边处理，随时停止
+
+        用显式的游标循环代替递归，每次只在内存中保留一页评论。一页返回后，
+        该页根评论立即产出，需要展开的子评论同时在后台并发获取，按原顺序接在根评论后面：
+        根评论和内嵌的子评论先产出，再等待它其余的子评论展开完成。
+        上游返回异常或请求失败时停止迭代。
+
+        Args:
+            cookies_str (str): Cookie字符串
+            note_url (str): 笔记URL
+            cursor (str): 起始分页游标，默认为空
+            max_comments (int, optional): 最大评论数量，达到后不再请求后续子评论和分页
+            progress (dict, optional): 迭代过程中更新的进度，包含 count（已产出数量）、
+                cursor（继续获取时使用的游标）和 has_more（是否还有未获取的评论）。
+                在某页中途停止时 cursor 仍指向该页，继续获取时会重复该页已产出的评论。
+                后续页请求失败时增加 error（失败类型和原因）
+            since (tuple, optional): 高水位线 (create_time, comment_id)，即上次已获取的最新根评论。
+                根评论按时间从新到旧返回，不晚于高水位线的根评论（及其子评论）被跳过，
+                某页最后一条根评论已不晚于高水位线时不再翻页，并在 progress 中设置 caught_up
+            transform (callable): 把原始评论规范化的函数 (note_id, comment, root_comment_id)，
+                默认 format_comment，只需要部分字段时传 comment_projector 的结果
+            raw (bool): 原样产出接口返回的根评论（data.comments 中的对象，包含内嵌的 sub_comments），
+                不规范化也不展开其余子评论，max_comments 按根评论计数
+            expand (bool): 为 False 时只产出根评论，不展开子评论，每条根评论带 sub_comment_count 和
+                sub_cursor（传给 fetch_sub_comments 按需获取），max_comments 按根评论计数
+
+        Yields:
+            CommentRecord: 规范化后的评论（raw 时为原始根评论，传入 transform 时为它的结果）
+
+        Raises:
+            XhsError: 第一页请求失败
+        """
+        if progress is None:
+            progress = {}
+        progress.update(count=0, cursor=cursor, has_more=True)
+        if since:
+            since = (int(since[0]), str(since[1]))
+
+        if "discovery" in note_url:
+            note_url = convert_discovery_to_explore_url(note_url)
+            logger.info(f"Converted URL: {note_url}")
+
+        note_params = self.extract_url_params(note_url)
+        note_id = note_params['note_id']
+        uri = "/api/sns/web/v2/comment/page"
+        semaphore = asyncio.Semaphore(max(1, settings.XHS_SUB_COMMENT_CONCURRENCY))
+        first_page = True
+
+        while True:
+            params = {
+                "note_id": note_id,
+                "cursor": cursor,
+                "top_comment_id": "",
+                "image_formats": "jpg,webp,avif",
+                "xsec_token": note_params['xsec_token'],
+            }
+            try:
+                data = await single_flight.do(
+                    f"comment:{account_key(cookies_str)}:{note_id}:{cursor}",
+                    lambda params=params: self._fetch_data("GET", cookies_str, uri, params=params, data=params),
+                )
+            except XhsError as e:
+                if first_page:
+                    raise
+                # 已经产出了部分评论，记录失败原因后停止，调用方可以从 progress 中的游标继续
+                logger.error(f"获取评论时发生异常，停止获取: {e.message}")
+                progress['error'] = {'type': type(e).__name__, 'message': e.message}
+                return
+            first_page = False
+
+            comments = data.get('comments') or []
+            logger.info(f"成功获取{len(comments)}条评论")
+            caught_up = False
+            if since:
+                # 置顶评论可能比高水位线旧，所以只按本页最后一条判断是否追上
+                caught_up = bool(comments) and comment_key(comments[-1]) <= since
+                comments = [comment for comment in comments if comment_key(comment) > since]
+
+            # 先确定本页需要的根评论，再并发展开它们的子评论
+            remaining = max_comments - progress['count'] if max_comments else None
+            selected = []
+            size = 0
+            for comment in comments:
+                if remaining and size >= remaining:
+                    break
+                selected.append(comment)
+                size += 1 if raw or not expand else 1 + len(comment.get('sub_comments') or [])
+
+            expansions = {
+                index: asyncio.ensure_future(self._expand_sub_comments(
+                    semaphore,
+                    cookies_str,
+                    comment.get('note_id', note_id),
+                    comment.get('id', ''),
+                    comment.get('sub_comment_cursor', ''),
+                    note_params['xsec_token'],
+                    remaining,
+                    transform,
+                ))
+                for index, comment in enumerate(selected) if not raw and expand and comment.get('sub_comment_has_more')
+            }
+            try:
+                for index, comment in enumerate(selected):
+                    if raw:
+                        items = [comment]
+                    elif not expand:
+                        items = [with_sub_cursor(transform(note_id, comment, None), note_id, comment, note_params['xsec_token'])]
+                    else:
+                        items = [transform(note_id, comment, None)]
+                        items.extend(transform(note_id, sub_comment, comment.get('id', '')) for sub_comment in comment.get('sub_comments') or [])
+                    for item in items:
+                        if max_comments and progress['count'] >= max_comments:
+                            return
+                        progress['count'] += 1
+                        yield item
+                    if index in expansions:
+                        # 根评论已经产出，不必等它的整个回复串取完
+                        for item in await expansions[index]:
+                            if max_comments and progress['count'] >= max_comments:
+                                return
+                            progress['count'] += 1
+                            yield item
+            finally:
+                for task in expansions.values():
+                    task.cancel()
+
+            if len(selected) < len(comments) or any(remaining and len(task.result()) >= remaining for task in expansions.values()):
+                # 本页因数量上限没有取完，进度停留在本页
+                return
+
+            has_more = bool(data.get('has_more') and data.get('cursor'))
+            cursor = data.get('cursor', '') if has_more else ''
+            progress.update(cursor=cursor, has_more=has_more)
+            if caught_up:
+                progress['caught_up'] = True
+                return
+            if not has_more or (max_comments and progress['count'] >= max_comments):
+                return
+
+    async def _expand_sub_comments(self, semaphore: asyncio.Semaphore, cookies_str: str, note_id: str, root_comment_id: str, cursor: str, xsec_token: str, limit: Optional[int] = None, transform: Callable[[str, Dict[str, Any], Optional[str]], Any] = format_comment) -> List[Any]:
+        """在并发限制内取完一条根评论下剩余的子评论
+
+        Args:
+            semaphore (asyncio.Semaphore): 限制同时展开的根评论数量
+            limit (int, optional): 最多获取的子评论数量
+
+        Returns:
+            list: 规范化后的子评论
+        """
+        sub_comments = []
+        async with semaphore:
+            async for sub_comment in self.iter_sub_comments(cookies_str, note_id, root_comment_id, cursor, xsec_token, transform):
+                sub_comments.append(sub_comment)
+                if limit and len(sub_comments) >= limit:
+                    break
+        return sub_comments
+
+    async def iter_sub_comments(self, cookies_str: str, note_id: str, root_comment_id: str, cursor: str, xsec_token: str, transform: Callable[[str, Dict[str, Any], Optional[str]], Any] = format_comment) -> AsyncIterator[Any]:
+        """逐条获取某条根评论下的子评论
+
+        Args:
+            cookies_str (str): Cookie字符串
+            note_id (str): 笔记ID
+            root_comment_id (str): 根评论ID
+            cursor (str): 分页游标
+            xsec_token (str): xsec_token
+            transform (callable): 把原始子评论规范化的函数，默认 format_comment
+
+        Yields:
+            CommentRecord: 规范化后的子评论
+        """
+        while True:
+            try:
+                data = await self._fetch_sub_comment_page(cookies_str, note_id, root_comment_id, cursor, xsec_token)
+            except XhsError as e:
+                logger.error(f"获取子评论时发生异常，停止展开根评论{root_comment_id}: {e.message}")
+                return
+
+            sub_comments = data.get('comments') or []
+            logger.info(f"成功获取{len(sub_comments)}条子评论")
+            for sub_comment in sub_comments:
+                yield transform(note_id, sub_comment, root_comment_id)
+
+            cursor = data.get('cursor', '')
+            if not data.get('has_more') or not cursor:
+                return
+
+    async def _fetch_sub_comment_page(self, cookies_str: str, note_id: str, root_comment_id: str, cursor: str, xsec_token: str) -> Dict[str, Any]:
+        uri = "/api/sns/web/v2/comment/sub/page"
+        params = {
+            "note_id": note_id,
+            "root_comment_id": root_comment_id,
+            "num": 10,
+            "cursor": cursor,
+            "top_comment_id": "",
+            "image_formats": "jpg,webp,avif",
+            "xsec_token": xsec_token,
+        }
+        return await single_flight.do(
+            f"sub_comment:{account_key(cookies_str)}:{note_id}:{root_comment_id}:{cursor}",
+            lambda: self._fetch_data("GET", cookies_str, splice_str(uri, params)),
+        )
+
+    async def fetch_sub_comments(self, cookies_str: str, sub_cursor: str, max_comments: Optional[int] = None, transform: Callable[[str, Dict[str, Any], Optional[str]], Any] = format_comment) -> Tuple[List[Any], Optional[str]]:
+        """按 sub_cursor 获取一条根评论下的子评论，用于按需展开 expand=False 时返回的根评论
+
+        Args:
+            cookies_str (str): Cookie字符串
+            sub_cursor (str): 根评论的 sub_cursor 或上次返回的游标
+            max_comments (int, optional): 最多返回的子评论数量，不传时取完
+            transform (callable): 子评论的规范化函数，默认 format_comment
+
+        Returns:
+            tuple: (子评论列表, 继续获取的游标)，已取完时游标为 None
+
+        Raises:
+            ValueError: sub_cursor 无效
+            XhsError: 第一页请求失败
+        """
+        note_id, root_comment_id, xsec_token, cursor, offset = decode_sub_cursor(sub_cursor)
+        sub_comments = []
+        while True:
+            try:
+                data = await self._fetch_sub_comment_page(cookies_str, note_id, root_comment_id, cursor, xsec_token)
+            except XhsError as e:
+                if not sub_comments:
+                    raise
+                # 返回已获取的部分，调用方可以用游标从失败的页继续
+                logger.error(f"获取子评论时发生异常，停止展开根评论{root_comment_id}: {e.message}")
+                return sub_comments, encode_sub_cursor(note_id, root_comment_id, xsec_token, cursor)
+
+            page = data.get('comments') or []
+            for index in range(offset, len(page)):
+                if max_comments and len(sub_comments) >= max_comments:
+                    return sub_comments, encode_sub_cursor(note_id, root_comment_id, xsec_token, cursor, index)
+                sub_comments.append(transform(note_id, page[index], root_comment_id))
+
+            if not data.get('has_more') or not data.get('cursor'):
+                return sub_comments, None
+            cursor, offset = data['cursor'], 0
+            if max_comments and len(sub_comments) >= max_comments:
+                return sub_comments, encode_sub_cursor(note_id, root_comment_id, xsec_token, cursor)
+
+    async def get_comments(self, cookies_str: str, ori_url: str, cursor: str = '', comments_list: Optional[List[Dict]] = None, max_comments: Optional[int] = None, transform: Callable[[str, Dict[str, Any], Optional[str]], Any] = format_comment, raw: bool = False, expand: bool = True) -> List[Dict]:
+        """获取小红书笔记下的评论
+        
+        Args:
+            cookies_str (str): Cookie字符串
+            ori_url (str): 笔记URL
+            cursor (str): 分页游标，默认为空
+            comments_list (list, optional): 追加评论的列表，不传时新建
+            max_comments (int, optional): comments_list 的最大长度
+            transform (callable): 评论的规范化函数，见 iter_comments
+            raw (bool): 原样返回接口返回的根评论，见 iter_comments
+            expand (bool): 为 False 时只返回带 sub_cursor 的根评论，见 iter_comments
+            
+        Returns:
+            list: 评论列表，后续页请求失败时返回已获取的部分
+
+        Raises:
+            XhsError: 第一页请求失败
+        """
+        if comments_list is None:
+            comments_list = []
+        if max_comments and len(comments_list) >= max_comments:
+            return comments_list
+
+        remaining = max_comments - len(comments_list) if max_comments else None
+        async for comment in self.iter_comments(cookies_str, ori_url, cursor, remaining, transform=transform, raw=raw, expand=expand):
+            comments_list.append(comment)
+        return comments_list
+
+    async def get_sub_comments(self, cookies_str: str, note_id: str, root_comment_id: str, cursor: str, xsec_token: str, comments_list: List[Dict], max_comments: Optional[int] = None) -> None:
+        """获取子评论，追加到 comments_list
+        
+        Args:
+            cookies_str (str): Cookie字符串
             note_id (str): 笔记ID
-            xsec_token (str): 安全令牌
+            root_comment_id (str): 根评论ID
+            cursor (str): 分页游标
+            xsec_token (str): xsec_token
+            comments_list (list): 评论列表
+            max_comments (int, optional): comments_list 的最大长度
+        """
+        async for sub_comment in self.iter_sub_comments(cookies_str, note_id, root_comment_id, cursor, xsec_token):
+            if max_comments and len(comments_list) >= max_comments:
+                return
+            comments_list.append(sub_comment)
+
+    async def search_notes_by_keyword(self, cookies_str, keyword, num):
+        """根据关键词搜索笔记
+        
+        Args:
+            keyword (str): 搜索关键词
+            num (int): 搜索数量
+
+        Returns:
+            list: 最多 num 条不重复的笔记，搜索结果不足时返回全部结果
+        """
+        note_list = []
+        async for note in self.iter_search_notes(cookies_str, keyword):
+            note_list.append({'title': note['title'], 'url': note['url']})
+            if len(note_list) >= num:
+                break
+        return note_list
+
+    async def iter_search_notes(self, cookies_str: str, keyword: str, sort: str = 'general') -> AsyncIterator[NoteRecord]:
+        """按页搜索笔记，逐条产出
+
+        每次调用使用独立的 search_id 和页码，上游返回 has_more 为 false、
+        空页或请求失败时停止。同一次搜索中重复出现的笔记只产出一次。
+
+        第一页按关键词和排序方式缓存，连同它的 search_id 一起保存；后续页按该 search_id 和页码缓存，
+        因此命中缓存时所有页都来自同一次搜索，不会把不同搜索的页拼在一起。
+
+        Raises:
+            XhsError: 第一页请求失败
+
+        Args:
+            cookies_str (str): Cookie字符串
+            keyword (str): 搜索关键词
+            sort (str): 排序方式，默认 general
+
+        Yields:
+            NoteRecord: 包含 title、note_id、xsec_token、url 的笔记
+        """
+        uri = "/api/sns/web/v1/search/notes"
+        search_id = get_search_id()
+        seen = set()
+        page = 1
+        while True:
+            params = {
+                "keyword": keyword,
+                "page": page,
+                "page_size": 20,
+                "search_id": search_id,
+                "sort": sort,
+                "note_type": 0,
+                "ext_flags": [],
+                "filters": [
+                    {"tags": [sort], "type": "sort_type"},
+                    {"tags": ["不限"], "type": "filter_note_type"},
+                    {"tags": ["不限"], "type": "filter_note_time"},
+                    {"tags": ["不限"], "type": "filter_note_range"},
+                    {"tags": ["不限"], "type": "filter_pos_distance"}
+                ],
+                "geo": "",
+                "image_formats": ["jpg", "webp", "avif"]
+            }
+            try:
+                if page == 1:
+                    session = await response_cache.get_or_fetch(
+                        "search",
+                        json.dumps([keyword.strip(), sort], ensure_ascii=False),
+                        lambda params=params: self._fetch_search_session(cookies_str, uri, params),
+                        account=account_key(cookies_str),
+                    )
+                    # 命中缓存时沿用缓存的那次搜索的 search_id 获取后续页
+                    search_id, data = session['search_id'], session['data']
+                else:
+                    data = await response_cache.get_or_fetch(
+                        "search",
+                        json.dumps([keyword.strip(), sort, search_id, page], ensure_ascii=False),
+                        lambda params=params: self._fetch_data("POST", cookies_str, uri, data=params),
+                        account=account_key(cookies_str),
+                    )
+            except XhsError as e:
+                if page == 1:
+                    raise
+                logger.error(f"搜索第{page}页时发生异常，停止搜索: {e.message}")
+                return
+
+            items = data.get('items') or []
+            logger.info(f"搜索第{page}页，获取{len(items)}条结果")
+            for item in items:
+                note_id = item.get('id')
+                if item.get('note_card') and note_id not in seen:
+                    seen.add(note_id)
+                    yield format_note(item)
+
+            if not items or not data.get('has_more'):
+                return
+            page += 1
+
+    async def _fetch_search_session(self, cookies_str: str, uri: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        data = await self._fetch_data("POST", cookies_str, uri, data=params)
+        return {'search_id': params['search_id'], 'data': data}
+
+    async def search_comments_by_keyword(self, cookies_str, keyword, num, comments_list: Optional[list] = None):
+        """根据关键词搜索的笔记下面的评论
+
+        搜索翻页和评论获取流水线执行：一个协程逐页搜索笔记放入有界队列，
+        多个协程同时从队列中取笔记获取评论。评论数量达到 num 后立即取消所有在途请求。
+
+        Args:
+            keyword (str): 搜索关键词
+            num (int): 搜索的评论数量
+            comments_list (list, optional): 追加评论的列表，不传时新建
+
+        Returns:
+            list: 评论列表
+        """
+        if comments_list is None:
+            comments_list = []
+        if len(comments_list) >= num:
+            return comments_list
+
+        workers = max(1, settings.XHS_SEARCH_COMMENT_WORKERS)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, settings.XHS_SEARCH_QUEUE_SIZE))
+        budget_met = asyncio.Event()
+        errors = []
+
+        async def produce():
+            try:
+                async for note in self.iter_search_notes(cookies_str, keyword):
+                    await queue.put(note)
+            except Exception as e:
+                logger.error(f"搜索笔记时发生异常: {e}")
+                errors.append(e)
+            # 每个消费者一个结束标记
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def consume():
+            while True:
+                note = await queue.get()
+                if note is None:
+                    return
+                try:
+                    async for comment in self.iter_comments(cookies_str, note['url'], max_comments=num - len(comments_list)):
+                        if len(comments_list) >= num:
+                            break
+                        comments_list.append(comment)
+                except Exception as e:
+                    logger.error(f"获取笔记{note['note_id']}的评论时发生异常: {e}")
+                if len(comments_list) >= num:
+                    budget_met.set()
+                    return
+
+        tasks = [asyncio.ensure_future(produce())]
+        tasks.extend(asyncio.ensure_future(consume()) for _ in range(workers))
+        consumers = asyncio.gather(*tasks[1:])
+        stop = asyncio.ensure_future(budget_met.wait())
+        try:
+            await asyncio.wait([stop, consumers], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks + [stop]:
+                task.cancel()
+            await asyncio.gather(*tasks, stop, consumers, return_exceptions=True)
+
+        if errors and not comments_list:
+            raise errors[0]
+        return comments_list
+
+    async def get_note_info(self, cookies_str, url, fresh=False):
+        """获取小红书笔记信息
+        Args:
+            cookies_str (str): Cookies字符串
+            url (str): 笔记URL
+            fresh (bool): 不使用缓存（包括过期后仍返回的旧值），直接请求上游，结果写回缓存
         """
-        if "discovery" in  url:
-            url=convert_discovery_to_explore_url(url)
+        if "discovery" in url:
+            url = convert_discovery_to_explore_url(url)
         note_params = self.extract_url_params(url)
         uri = "/api/sns/web/v1/feed"
         params = {
@@ -549,31 +975,81 @@ class XhsAPI:
                 "need_body_topic": "1"
             }
         }
-        # splice_api = splice_str(uri, params)
-        headers, cookies, data = generate_request_params(cookies_str, uri, params)
-        response = requests.post("https://edith.xiaohongshu.com"+uri, headers=headers, cookies=cookies, data=data.encode('utf-8')).json()
-        
-        if response.get('code') == 0 :
-            info_data={
-                'note_type': response.get('data', {}).get('items', {})[0].get('model_type', {}),#笔记类型
-                'note_id': response.get('data', {}).get('items', {})[0].get('note_card').get('note_id', ''),  # 笔记ID
-                'title': response.get('data', {}).get('items', {})[0].get('note_card').get('title', ''),  # 笔记标题
-                'like_count': response.get('data', {}).get('items', {})[0].get('note_card').get('interact_info').get('liked_count', 0),  # 点赞数
-                'collected_count': response.get('data', {}).get('items', {})[0].get('note_card').get('interact_info').get('collected_count', 0),  # 收藏数
-                'comment_count': response.get('data', {}).get('items', {})[0].get('note_card').get('interact_info').get('comment_count', 0),  # 评论数
-                'note_url': url,  # 笔记URL
-                'xsec_token': note_params['xsec_token'],  # 安全令牌
-                'location': response.get('data', {}).get('items', {})[0].get('note_card').get('ip_location', ''),  # 位置
-                'author': response.get('data', {}).get('items', {})[0].get('note_card', {}).get('user', '').get('nickname'),  # 作者昵称
+
+        async def fetch():
+            data = await self._fetch_data("POST", cookies_str, uri, data=params)
+            items = data.get('items')
+            if not isinstance(items, list) or not items or not isinstance(items[0], dict):
+                logger.warning("获取笔记信息失败: 响应中没有笔记")
+                return None
+            note_card = items[0].get('note_card') or {}
+            interact_info = note_card.get('interact_info') or {}
+            return {
+                'note_type': items[0].get('model_type', {}),  # 笔记类型
+                'note_id': note_card.get('note_id', ''),  # 笔记ID
+                'title': note_card.get('title', ''),  # 笔记标题
+                'like_count': interact_info.get('liked_count', 0),  # 点赞数
+                'collected_count': interact_info.get('collected_count', 0),  # 收藏数
+                'comment_count': interact_info.get('comment_count', 0),  # 评论数
+                'location': note_card.get('ip_location', ''),  # 位置
+                'author': (note_card.get('user') or {}).get('nickname'),  # 作者昵称
             }
-            print(f"获取笔记信息成功: {info_data}")
-            return info_data
-        else:
-            print(f"获取笔记信息失败: {response.get('message', '未知错误')}")
+
+        try:
+            info = await response_cache.get_or_fetch(
+                "note", note_params['note_id'], fetch, account=account_key(cookies_str), fresh=fresh
+            )
+        except XhsError as e:
+            logger.warning(f"获取笔记信息失败: {e.message}")
             return None
-        print(response)
-    
-    def monitor_comments(self, cookies_str, note_url,userInfo,keyword, interval=60):
+        if info is None:
+            return None
+        # 缓存按笔记ID共享，URL和令牌使用本次请求的
+        info_data = {**info, 'note_url': url, 'xsec_token': note_params['xsec_token']}
+        logger.info(f"获取笔记信息成功: {info_data}")
+        return info_data
+
+    async def fetch_new_comments(self, cookies_str: str, note_url: str, state: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], List[Dict]]:
+        """增量获取上次检查之后的新增评论
+
+        先用 get_note_info 比较评论数，没有变化时不获取评论；有变化时从最新的评论开始翻页，
+        追上高水位线（上次已获取的最新根评论）即停止。只根据根评论判断，
+        旧根评论下新增的子评论不会被获取。
+
+        Args:
+            cookies_str (str): Cookies字符串
+            note_url (str): 笔记URL
+            state (dict): 两次检查之间保存的状态，原地更新：comment_count 为上次的评论数，
+                since 为高水位线 (create_time, comment_id)。为空时获取全部评论。
+                获取中途失败时不更新，下次会重新获取这部分评论
+
+        Returns:
+            tuple: (笔记信息, 新增评论)，笔记信息获取失败时为 None
+        """
+        # 评论数必须是最新的：缓存的旧评论数会让活跃的笔记被当作没有新评论
+        note_info = await self.get_note_info(cookies_str, note_url, fresh=True)
+        comment_count = note_info.get('comment_count') if note_info else None
+        if comment_count is not None and state.get('comment_count') is not None and str(comment_count) == str(state['comment_count']):
+            logger.info(f"评论数没有变化（{comment_count}），跳过获取评论")
+            return note_info, []
+
+        progress: Dict[str, Any] = {}
+        comments = []
+        async for comment in self.iter_comments(cookies_str, note_url, progress=progress, since=state.get('since')):
+            comments.append(comment)
+        logger.info(f"新增{len(comments)}条评论")
+
+        if 'error' not in progress:
+            marks = [comment_key(comment) for comment in comments if not comment['root_comment_id']]
+            if state.get('since'):
+                marks.append((int(state['since'][0]), str(state['since'][1])))
+            if marks:
+                state['since'] = max(marks)
+            if comment_count is not None:
+                state['comment_count'] = comment_count
+        return note_info, comments
+
+    async def monitor_comments(self, cookies_str, note_url, userInfo, keyword, interval=60, state: Optional[Dict[str, Any]] = None):
         """监控笔记评论变化
         Args:
             cookies_str (str): Cookies字符串
@@ -581,25 +1057,21 @@ class XhsAPI:
             userInfo (str): 客户标识
             keyword (str): 关键词
             interval (int): 检查间隔时间（秒）
+            state (dict, optional): 同 fetch_new_comments，多次调用时传入同一个 dict 即只返回新增评论
+
+        Returns:
+            list: 新增评论与笔记信息合并后的列表，没有新增评论时返回 None
         """
-        #笔记基本信息
-        note_info=self.get_note_info(cookies_str,note_url)
-        # if note_info.get('comment_count', 0) != xxx: 如果笔记的评论数和上一次获取的评论数不同，才监控
-        
-          
-        #笔记的评论内容
-        comments_list = []
-        comments_list = self.get_comments(cookies_str, note_url, comments_list=comments_list)
-        print(f'一共收集到{len(comments_list)}条评论')
-        merge_info = self.merge_note_info_with_comments(note_info, comments_list,userInfo,keyword)
-        
-        print(merge_info)
+        if state is None:
+            state = {}
+        note_info, comments_list = await self.fetch_new_comments(cookies_str, note_url, state)
+        logger.info(f'一共收集到{len(comments_list)}条评论')
         if not comments_list:
-            print("没有获取到评论")
+            logger.info("没有获取到评论")
             return None
-        return merge_info
-    
-    def reply_comment(self,cookies_str, note_id, comment_id, content):
+        return self.merge_note_info_with_comments(note_info or {}, comments_list, userInfo, keyword)
+
+    async def reply_comment(self, cookies_str, note_id, comment_id, content):
         """回复评论
         
         Args:
@@ -609,7 +1081,7 @@ class XhsAPI:
             content (str): 回复内容
         """
         uri = "/api/sns/web/v1/comment/post"
-        
+
         params = {
             "note_id": note_id,
             "target_comment_id": comment_id,
@@ -617,15 +1089,10 @@ class XhsAPI:
             "at_users": []
         }
 
-        headers, cookies, data = generate_request_params(cookies_str, uri, params)
-        url = "https://edith.xiaohongshu.com/api/sns/web/v1/comment/post"
-        
-        response = requests.post(url, headers=headers, cookies=cookies, data=data.encode('utf-8')).json()
-        print(f"回复评论请求: {response}")
-        if response.get('code') == 0:
-            print("回复成功")
-        else:
-            print(f"回复失败: {response.get('message', '未知错误')}")
-
-
-
+        try:
+            response = await self._request("POST", cookies_str, uri, data=params)
+        except XhsError as e:
+            logger.warning(f"回复失败: {e.message}")
+            raise
+        logger.info(f"回复成功: {response}")
+        return response
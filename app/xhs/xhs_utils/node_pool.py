@@ -0,0 +1,277 @@
+"""常驻 Node 签名进程池
+
+每个 worker 是一个加载了签名脚本的常驻 node 进程（见 static/xhs_sign_server.js），
+通过 stdin/stdout 上的行分隔 JSON 通信。请求按 id 匹配响应，因此同一个 worker
+上可以同时有多个在途请求（流水线），不必等待上一个响应返回。
+"""
+
+import atexit
+import itertools
+import json
+import subprocess
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+SERVER_SCRIPT = Path(__file__).parent.parent / 'static' / 'xhs_sign_server.js'
+
+
+class NodeWorkerError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class NodeWorker:
+    """单个常驻 node 签名进程"""
+
+    def __init__(self, bundle_path: Path, node_path: str = 'node', startup_timeout: float = 30):
+        self.bundle_path = bundle_path
+        self.calls = 0
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._ready: Future = Future()
+        self._alive = True
+
+        self.proc = subprocess.Popen(
+            [node_path, str(SERVER_SCRIPT), str(bundle_path)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=str(SERVER_SCRIPT.parent),
+            text=True,
+            encoding='utf-8',
+            bufsize=1,
+        )
+        threading.Thread(target=self._read_stdout, name=f'node-worker-{self.proc.pid}', daemon=True).start()
+        threading.Thread(target=self._read_stderr, name=f'node-worker-{self.proc.pid}-stderr', daemon=True).start()
+
+        try:
+            self._ready.result(timeout=startup_timeout)
+        except FutureTimeoutError:
+            self.kill()
+            raise NodeWorkerError(f'node worker for {bundle_path.name} did not start in {startup_timeout}s')
+        except NodeWorkerError:
+            self.kill()
+            raise
+        logger.info(f'Started node worker {self.proc.pid} for {bundle_path.name}')
+
+    @property
+    def alive(self) -> bool:
+        return self._alive and self.proc.poll() is None
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def submit(self, fn: str, *args, count: Optional[int] = None) -> Future:
+        """提交一次函数调用，立即返回 Future，不等待结果
+
+        Args:
+            fn (str): 签名脚本中的函数名
+            count (int, optional): 在进程内连续调用的次数，指定时结果为列表
+        """
+        future: Future = Future()
+        with self._lock:
+            if not self.alive:
+                raise NodeWorkerError(f'node worker {self.proc.pid} is not running')
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            self.calls += 1
+            try:
+                request = {'id': request_id, 'fn': fn, 'args': args}
+                if count:
+                    request['count'] = count
+                self.proc.stdin.write(json.dumps(request, ensure_ascii=False) + '\n')
+                self.proc.stdin.flush()
+            except (BrokenPipeError, OSError, ValueError) as e:
+                self._pending.pop(request_id, None)
+                self._alive = False
+                raise NodeWorkerError(f'failed to write to node worker {self.proc.pid}: {e}')
+        return future
+
+    def call(self, fn: str, *args, timeout: Optional[float] = None, count: Optional[int] = None) -> Any:
+        return self.result(self.submit(fn, *args, count=count), fn, timeout)
+
+    def result(self, future: Future, fn: str, timeout: Optional[float] = None) -> Any:
+        """等待 submit 返回的 Future，超时时杀掉进程"""
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # 超时的进程很可能已经卡死，直接杀掉，由进程池重新拉起
+            logger.error(f'node worker {self.proc.pid} timed out calling {fn}, killing it')
+            self.kill()
+            raise NodeWorkerError(f'{fn} timed out after {timeout}s')
+
+    def retire(self) -> None:
+        """关闭 stdin，让进程处理完在途请求后自行退出"""
+        with self._lock:
+            self._alive = False
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+
+    def kill(self) -> None:
+        self._alive = False
+        if self.proc.poll() is None:
+            self.proc.kill()
+
+    def _read_stdout(self) -> None:
+        for line in self.proc.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                logger.warning(f'node worker {self.proc.pid} wrote invalid output: {line!r}')
+                continue
+            request_id = message.get('id')
+            if request_id == 0:
+                if message.get('ok'):
+                    self._ready.set_result(True)
+                else:
+                    self._ready.set_exception(NodeWorkerError(message.get('error', 'startup failed')))
+                continue
+            future = self._pending.pop(request_id, None)
+            if future is None:
+                continue
+            if message.get('ok'):
+                future.set_result(message.get('result'))
+            else:
+                future.set_exception(NodeWorkerError(message.get('error', 'unknown error')))
+
+        # stdout 关闭说明进程已退出（正常退役或崩溃），让所有在途请求失败
+        self._alive = False
+        returncode = self.proc.wait()
+        if not self._ready.done():
+            self._ready.set_exception(NodeWorkerError(f'node worker exited with code {returncode} during startup'))
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(NodeWorkerError(f'node worker exited with code {returncode}'))
+        if pending:
+            logger.error(f'node worker {self.proc.pid} exited with code {returncode}, {len(pending)} requests failed')
+
+    def _read_stderr(self) -> None:
+        for line in self.proc.stderr:
+            line = line.rstrip()
+            if line:
+                logger.warning(f'[node {self.proc.pid}] {line}')
+
+
+class NodeWorkerPool:
+    """常驻 node 签名进程池
+
+    接口与 execjs 编译后的上下文一致（``pool.call(name, *args)``），可以直接替换。
+    进程在第一次调用时才启动；崩溃的进程会在下次调用时自动重启，
+    调用次数超过 ``max_calls`` 的进程会被平滑退役，以回收 jsdom 等泄漏的内存。
+    启动新进程时只在锁内占住位置，启动本身在锁外进行，其他线程可以继续使用已有的进程。
+    """
+
+    def __init__(
+        self,
+        bundle_path: Path,
+        size: int = 2,
+        max_calls: int = 10000,
+        timeout: float = 10,
+        node_path: str = 'node',
+    ):
+        if not bundle_path.exists():
+            raise FileNotFoundError(bundle_path)
+        self.bundle_path = bundle_path
+        self.size = max(1, size)
+        self.max_calls = max_calls
+        self.timeout = timeout
+        self.node_path = node_path
+        # 每个位置是运行中的 NodeWorker、正在启动的占位对象或空位
+        self._workers: List[Any] = [None] * self.size
+        self._cond = threading.Condition()
+        atexit.register(self.close)
+
+    # 选中的进程在提交前被其他线程退役或已经退出时，换一个进程重试的次数
+    SUBMIT_ATTEMPTS = 3
+
+    def call(self, fn: str, *args) -> Any:
+        worker, future = self._submit(fn, *args)
+        return worker.result(future, fn, self.timeout)
+
+    def call_many(self, fn: str, count: int, *args) -> List[Any]:
+        """在同一个进程内连续调用 ``count`` 次，一次往返拿回全部结果"""
+        worker, future = self._submit(fn, *args, count=count)
+        return worker.result(future, fn, self.timeout)
+
+    def submit(self, fn: str, *args) -> Future:
+        return self._submit(fn, *args)[1]
+
+    def close(self) -> None:
+        with self._cond:
+            workers, self._workers = self._workers, [None] * self.size
+            self._cond.notify_all()
+        for worker in workers:
+            if isinstance(worker, NodeWorker):
+                worker.retire()
+
+    def _submit(self, fn: str, *args, count: Optional[int] = None) -> Tuple[NodeWorker, Future]:
+        for attempt in range(self.SUBMIT_ATTEMPTS):
+            worker = self._acquire()
+            try:
+                return worker, worker.submit(fn, *args, count=count)
+            except NodeWorkerError:
+                if worker.alive or attempt == self.SUBMIT_ATTEMPTS - 1:
+                    raise
+
+    def _acquire(self) -> NodeWorker:
+        """选出在途请求最少的可用进程，顺便替换掉已退出或已达调用上限的进程"""
+        with self._cond:
+            while True:
+                self._reap()
+                live = [worker for worker in self._workers if isinstance(worker, NodeWorker)]
+                idle = next((worker for worker in live if worker.pending == 0), None)
+                if idle is not None:
+                    return idle
+                if None in self._workers:
+                    index = self._workers.index(None)
+                    reservation = self._workers[index] = object()
+                    break
+                if live:
+                    return min(live, key=lambda w: w.pending)
+                # 所有位置的进程都在启动中，等其中一个启动完成
+                self._cond.wait()
+
+        # node 启动可能要几秒（最长到启动超时），不能持有锁
+        try:
+            worker = NodeWorker(self.bundle_path, node_path=self.node_path)
+        except BaseException:
+            with self._cond:
+                if self._workers[index] is reservation:
+                    self._workers[index] = None
+                self._cond.notify_all()
+            raise
+
+        with self._cond:
+            installed = self._workers[index] is reservation
+            if installed:
+                self._workers[index] = worker
+            self._cond.notify_all()
+        if not installed:
+            # 启动期间进程池被关闭了
+            worker.retire()
+            raise NodeWorkerError(f'node worker pool for {self.bundle_path.name} is closed')
+        return worker
+
+    def _reap(self) -> None:
+        """清出已退出和已达调用上限的进程，调用方需持有锁"""
+        for index, worker in enumerate(self._workers):
+            if not isinstance(worker, NodeWorker):
+                continue
+            if not worker.alive:
+                logger.warning(f'Replacing dead node worker {worker.proc.pid} for {self.bundle_path.name}')
+                self._workers[index] = None
+            elif self.max_calls and worker.calls >= self.max_calls:
+                logger.info(f'Recycling node worker {worker.proc.pid} after {worker.calls} calls')
+                worker.retire()
+                self._workers[index] = None
@@ -1,41 +1,41 @@
+import base64
+import hashlib
 import json
 import math
 import random
-import execjs
+import threading
 import time
 import requests
+from abc import ABC, abstractmethod
+from collections import deque
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from loguru import logger
-import os
 from pathlib import Path
 from urllib.parse import urlparse, parse_qs, urlencode
 
+from app.core.config import settings
+from .node_pool import NodeWorkerPool
+
 # 获取当前文件的目录
 current_dir = Path(__file__).parent
 static_dir = current_dir.parent / 'static'
-xhs_dir = current_dir.parent  # app/xhs 目录，包含 node_modules
-
-# 配置 execjs 使用 Node.js
-os.environ['EXECJS_RUNTIME'] = 'Node'
 
 # 加载JavaScript文件
+# 签名脚本运行在常驻的 node 进程池中，避免每次调用都重新启动 node、加载 jsdom。
+# jsdom 与 xhs_xray_pack*.js 在进程启动时按 static/xhs_sign_server.js 的位置解析，
+# 不依赖也不修改当前进程的工作目录，因此签名可以在多个线程或协程中并发调用。
 try:
     js_file_path = static_dir / 'xhs_xs_xsc_56.js'
     logger.info(f"Loading JavaScript file: {js_file_path}")
-    
-    # 保存当前工作目录
-    original_cwd = os.getcwd()
-    try:
-        # 切换到包含 node_modules 的目录
-        os.chdir(str(xhs_dir))
-        logger.info(f"Changed working directory to: {xhs_dir}")
-        
-        with open(js_file_path, 'r', encoding='utf-8') as f:
-            js_content = f.read()
-            js = execjs.compile(js_content)
-        logger.info("Successfully loaded xhs_xs_xsc_56.js")
-    finally:
-        # 恢复原始工作目录
-        os.chdir(original_cwd)
+    js = NodeWorkerPool(
+        js_file_path,
+        size=settings.XHS_SIGNER_POOL_SIZE,
+        max_calls=settings.XHS_SIGNER_MAX_CALLS,
+        timeout=settings.XHS_SIGNER_TIMEOUT,
+        node_path=settings.XHS_NODE_PATH,
+    )
+    logger.info("Successfully loaded xhs_xs_xsc_56.js")
 except Exception as e:
     logger.error(f"Failed to load xhs_xs_xsc_56.js: {e}")
     js = None
@@ -43,24 +43,30 @@ except Exception as e:
 try:
     xray_file_path = static_dir / 'xhs_xray.js'
     logger.info(f"Loading JavaScript file: {xray_file_path}")
-    
-    # 保存当前工作目录
-    original_cwd = os.getcwd()
-    try:
-        # 切换到包含 node_modules 的目录
-        os.chdir(str(xhs_dir))
-        
-        with open(xray_file_path, 'r', encoding='utf-8') as f:
-            xray_content = f.read()
-            xray_js = execjs.compile(xray_content)
-        logger.info("Successfully loaded xhs_xray.js")
-    finally:
-        # 恢复原始工作目录
-        os.chdir(original_cwd)
+    xray_js = NodeWorkerPool(
+        xray_file_path,
+        size=settings.XHS_XRAY_POOL_SIZE,
+        max_calls=settings.XHS_SIGNER_MAX_CALLS,
+        timeout=settings.XHS_SIGNER_TIMEOUT,
+        node_path=settings.XHS_NODE_PATH,
+    )
+    logger.info("Successfully loaded xhs_xray.js")
 except Exception as e:
     logger.error(f"Failed to load xhs_xray.js: {e}")
     xray_js = None
 
+try:
+    creator_js = NodeWorkerPool(
+        static_dir / 'xhs_creator_xs.js',
+        size=1,
+        max_calls=settings.XHS_SIGNER_MAX_CALLS,
+        timeout=settings.XHS_SIGNER_TIMEOUT,
+        node_path=settings.XHS_NODE_PATH,
+    )
+except Exception as e:
+    logger.error(f"Failed to load xhs_creator_xs.js: {e}")
+    creator_js = None
+
 def base36encode(number, alphabet='0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'):
     """Converts an integer to a base36 string."""
     if not isinstance(number, int):
@@ -93,33 +99,185 @@ def generate_x_b3_traceid(len=16):
         x_b3_traceid += "abcdef0123456789"[math.floor(16 * random.random())]
     return x_b3_traceid
 
+class Signer(ABC):
+    """签名后端接口
+
+    两个方法与签名脚本中的同名函数一一对应：
+    ``get_xs`` 返回 (x-s, x-t)，``get_request_headers_params`` 返回 (x-s, x-t, x-s-common)。
+    """
+
+    name = ''
+
+    @abstractmethod
+    def get_xs(self, api, data, a1):
+        ...
+
+    @abstractmethod
+    def get_request_headers_params(self, api, data, a1):
+        ...
+
+
+class NodeSigner(Signer):
+    """调用常驻 node 进程中的签名脚本"""
+
+    name = 'node'
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    def get_xs(self, api, data, a1):
+        ret = self.runtime.call('get_xs', api, data, a1)
+        return ret['X-s'], ret['X-t']
+
+    def get_request_headers_params(self, api, data, a1):
+        ret = self.runtime.call('get_request_headers_params', api, data, a1)
+        return ret['xs'], ret['xt'], ret.get('xs_common')
+
+
+class PythonCreatorSigner(Signer):
+    """xhs_creator_xs.js 的 Python 实现：MD5 + AES-128-CBC + base64，不需要启动 node"""
+
+    name = 'python'
+
+    key = b'glt6h61ta7kisow7'
+    iv = b'4hrivgw5s342f9b2'
+
+    def get_xs(self, api, data, a1, xt=None):
+        # 与 JS 的 `if (data)` 保持一致：空对象、空数组也会被拼接
+        if isinstance(data, (dict, list)) or data:
+            api = api + json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+        x1 = hashlib.md5(api.encode('utf-8')).hexdigest()
+        x2 = "0|0|0|1|0|0|1|0|0|0|1|0|0|0|0|1|0|0|0"
+        x4 = xt if xt is not None else int(time.time() * 1000)
+        x = f'x1={x1};x2={x2};x3={a1};x4={x4};'
+        payload = self._encrypt(base64.b64encode(x.encode('utf-8')))
+        encrypt_data = json.dumps({
+            "signSvn": "55",
+            "signType": "x2",
+            "appId": "ugc",
+            "signVersion": "1",
+            "payload": payload
+        }, separators=(',', ':'))
+        return 'XYW_' + base64.b64encode(encrypt_data.encode('utf-8')).decode(), x4
+
+    def get_request_headers_params(self, api, data, a1):
+        xs, xt = self.get_xs('url=' + api, data, a1)
+        return xs, xt, None
+
+    def _encrypt(self, plaintext):
+        padder = padding.PKCS7(128).padder()
+        padded = padder.update(plaintext) + padder.finalize()
+        encryptor = Cipher(algorithms.AES(self.key), modes.CBC(self.iv)).encryptor()
+        return (encryptor.update(padded) + encryptor.finalize()).hex()
+
+
+def get_signer(backend, flavor='web'):
+    """按配置选择签名后端
+
+    Args:
+        backend (str): 'node' 或 'python'
+        flavor (str): 'web' 为网页端签名（依赖 jsdom，只能用 node），'creator' 为创作者平台签名
+
+    Returns:
+        Signer: 签名后端实例
+    """
+    if backend == 'node':
+        runtime = js if flavor == 'web' else creator_js
+        if runtime is None:
+            raise Exception("JavaScript engine not available")
+        return NodeSigner(runtime)
+    if backend == 'python':
+        if flavor != 'creator':
+            raise ValueError("python signer only supports the creator signature, web signing needs node")
+        return PythonCreatorSigner()
+    raise ValueError(f"Unknown signer backend: {backend}")
+
+
+# 后端在导入时创建，配置的后端不可用时启动即失败，而不是等到第一次签名
+web_signer = get_signer(settings.XHS_WEB_SIGNER, 'web')
+creator_signer = get_signer(settings.XHS_CREATOR_SIGNER, 'creator')
+
+
 def generate_xs_xs_common(a1, api, data=''):
-    original_cwd = os.getcwd()
-    try:
-        os.chdir(str(xhs_dir))
-        ret = js.call('get_request_headers_params', api, data, a1)
-        xs, xt, xs_common = ret['xs'], ret['xt'], ret['xs_common']
-        return xs, xt, xs_common
-    finally:
-        os.chdir(original_cwd)
+    return web_signer.get_request_headers_params(api, data, a1)
 
 def generate_xs(a1, api, data=''):
-    original_cwd = os.getcwd()
-    try:
-        os.chdir(str(xhs_dir))
-        ret = js.call('get_xs', api, data, a1)
-        xs, xt = ret['X-s'], ret['X-t']
-        return xs, xt
-    finally:
-        os.chdir(original_cwd)
+    return web_signer.get_xs(api, data, a1)
+
+def generate_creator_xs(a1, api, data=''):
+    """创作者平台接口的 x-s、x-t，后端由 XHS_CREATOR_SIGNER 选择"""
+    return creator_signer.get_xs(api, data, a1)
+
+class XrayTraceIdPool:
+    """预生成的 x-xray-traceid 环形缓冲区
+
+    traceId 在常驻的 xhs_xray.js 进程里批量生成，取用时直接从内存弹出；
+    余量低于 ``low_watermark`` 时由后台线程补充，请求线程不等待 JS。
+    traceId 内含生成时间，超过 ``max_age`` 秒未被取用的会被丢弃。
+    """
+
+    def __init__(self, runtime, capacity=512, batch_size=256, low_watermark=128, max_age=60):
+        self.runtime = runtime
+        self.batch_size = batch_size
+        self.low_watermark = low_watermark
+        self.max_age = max_age
+        self._buffer = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._refilling = False
+
+    def get(self):
+        expire_before = time.monotonic() - self.max_age
+        trace_id = None
+        with self._lock:
+            while self._buffer:
+                created_at, candidate = self._buffer.popleft()
+                if created_at >= expire_before:
+                    trace_id = candidate
+                    break
+            remaining = len(self._buffer)
+        if remaining < self.low_watermark:
+            self.warm()
+        if trace_id is None:
+            # 缓冲区为空（冷启动或消耗过快），只能同步生成一个
+            logger.debug("x-xray-traceid pool is empty, generating synchronously")
+            trace_id = self.runtime.call('traceId')
+        return trace_id
+
+    def warm(self):
+        """在后台线程中补充缓冲区，已有补充任务在运行时直接返回"""
+        with self._lock:
+            if self._refilling:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, name='xray-traceid-refill', daemon=True).start()
+
+    def _refill(self):
+        try:
+            trace_ids = self.runtime.call_many('traceId', self.batch_size)
+            created_at = time.monotonic()
+            with self._lock:
+                self._buffer.extend((created_at, trace_id) for trace_id in trace_ids)
+        except Exception as e:
+            logger.error(f"Failed to refill x-xray-traceid pool: {e}")
+        finally:
+            with self._lock:
+                self._refilling = False
+
+
+xray_traceids = XrayTraceIdPool(
+    xray_js,
+    capacity=settings.XHS_XRAY_BUFFER_SIZE,
+    batch_size=settings.XHS_XRAY_BATCH_SIZE,
+    low_watermark=settings.XHS_XRAY_BATCH_SIZE // 2,
+    max_age=settings.XHS_XRAY_MAX_AGE,
+) if xray_js is not None else None
+
 
 def generate_xray_traceid():
-    original_cwd = os.getcwd()
-    try:
-        os.chdir(str(xhs_dir))
-        return xray_js.call('traceId')
-    finally:
-        os.chdir(original_cwd)
+    if xray_traceids is None:
+        raise Exception("JavaScript engine not available")
+    return xray_traceids.get()
+
 def get_common_headers():
     return {
         "authority": "www.xiaohongshu.com",
@@ -177,9 +335,6 @@ def generate_headers(a1, api, data=''):
 
 def generate_request_params(cookies_str, api, data=''):
     """生成请求参数，包括headers、cookies和data"""
-    if js is None:
-        raise Exception("JavaScript engine not available")
-    
     cookies = trans_cookies(cookies_str)
     print(f'Cookies: {cookies}')
     logger.info(f'Cookies: {cookies}')
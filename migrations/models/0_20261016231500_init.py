@@ -0,0 +1,74 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS `users` (
+            `email` VARCHAR(255) NOT NULL UNIQUE,
+            `hashed_password` VARCHAR(1024) NOT NULL,
+            `is_active` BOOL NOT NULL  DEFAULT 1,
+            `is_superuser` BOOL NOT NULL  DEFAULT 0,
+            `is_verified` BOOL NOT NULL  DEFAULT 0,
+            `id` CHAR(36) NOT NULL  PRIMARY KEY,
+            `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6),
+            `updated_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+            `short_name` VARCHAR(255),
+            `full_name` VARCHAR(255),
+            KEY `idx_users_email_133a6f` (`email`)
+        ) CHARACTER SET utf8mb4;
+        CREATE TABLE IF NOT EXISTS `xhs_crawl_runs` (
+            `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6),
+            `updated_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+            `id` INT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+            `kind` VARCHAR(32) NOT NULL  COMMENT 'comments 或 search',
+            `target` VARCHAR(1024) NOT NULL  COMMENT '笔记URL或搜索关键词',
+            `status` VARCHAR(16) NOT NULL  COMMENT 'running、success、failed' DEFAULT 'running',
+            `note_count` INT NOT NULL  DEFAULT 0,
+            `comment_count` INT NOT NULL  DEFAULT 0,
+            `error` LONGTEXT,
+            `finished_at` DATETIME(6)
+        ) CHARACTER SET utf8mb4 COMMENT='一次采集（获取评论或搜索笔记）';
+        CREATE TABLE IF NOT EXISTS `xhs_comments` (
+            `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6),
+            `updated_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+            `id` BIGINT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+            `comment_id` VARCHAR(64) NOT NULL UNIQUE,
+            `note_id` VARCHAR(64) NOT NULL,
+            `root_comment_id` VARCHAR(64)   COMMENT '子评论所属的根评论，根评论为空',
+            `parent_comment_id` VARCHAR(64)   COMMENT '子评论回复的评论，根评论为空',
+            `content` LONGTEXT NOT NULL,
+            `like_count` INT NOT NULL  DEFAULT 0,
+            `nickname` VARCHAR(255) NOT NULL  DEFAULT '',
+            `ip_location` VARCHAR(64) NOT NULL  DEFAULT '',
+            `create_time` BIGINT   COMMENT '评论时间（毫秒级时间戳）',
+            `crawl_run_id` INT,
+            CONSTRAINT `fk_xhs_comm_xhs_craw_b3889dc5` FOREIGN KEY (`crawl_run_id`) REFERENCES `xhs_crawl_runs` (`id`) ON DELETE SET NULL,
+            KEY `idx_xhs_comment_root_co_02ec2c` (`root_comment_id`),
+            KEY `idx_xhs_comment_note_id_fd6649` (`note_id`, `create_time`)
+        ) CHARACTER SET utf8mb4;
+        CREATE TABLE IF NOT EXISTS `xhs_notes` (
+            `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6),
+            `updated_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+            `id` INT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+            `note_id` VARCHAR(64) NOT NULL UNIQUE,
+            `xsec_token` VARCHAR(255) NOT NULL  DEFAULT '',
+            `title` VARCHAR(512) NOT NULL  DEFAULT '',
+            `url` VARCHAR(1024) NOT NULL  DEFAULT '',
+            `keyword` VARCHAR(255)   COMMENT '最近一次搜到该笔记的关键词',
+            `author` VARCHAR(255),
+            `like_count` INT,
+            `collected_count` INT,
+            `comment_count` INT   COMMENT '上游返回的评论总数',
+            `last_crawled_at` DATETIME(6)
+        ) CHARACTER SET utf8mb4;
+        CREATE TABLE IF NOT EXISTS `aerich` (
+            `id` INT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+            `version` VARCHAR(255) NOT NULL,
+            `app` VARCHAR(100) NOT NULL,
+            `content` JSON NOT NULL
+        ) CHARACTER SET utf8mb4;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        """
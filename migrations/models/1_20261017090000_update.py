@@ -0,0 +1,13 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE `xhs_notes` ADD `last_comment_time` BIGINT;
+        ALTER TABLE `xhs_notes` ADD `last_comment_id` VARCHAR(64);"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE `xhs_notes` DROP COLUMN `last_comment_time`;
+        ALTER TABLE `xhs_notes` DROP COLUMN `last_comment_id`;"""
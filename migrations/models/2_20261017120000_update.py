@@ -0,0 +1,28 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS `xhs_monitored_notes` (
+            `created_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6),
+            `updated_at` DATETIME(6) NOT NULL  DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
+            `id` INT NOT NULL PRIMARY KEY AUTO_INCREMENT,
+            `note_id` VARCHAR(64) NOT NULL UNIQUE,
+            `note_url` VARCHAR(1024) NOT NULL,
+            `cookies` LONGTEXT NOT NULL,
+            `user_info` VARCHAR(255) NOT NULL  COMMENT '客户标识' DEFAULT '',
+            `keyword` VARCHAR(255) NOT NULL  DEFAULT '',
+            `enabled` BOOL NOT NULL  DEFAULT 1,
+            `interval` DOUBLE NOT NULL  COMMENT '当前轮询间隔（秒）',
+            `velocity` DOUBLE NOT NULL  COMMENT '新增评论速度（条/秒，指数加权平均）' DEFAULT 0,
+            `next_due_at` DATETIME(6) NOT NULL,
+            `last_polled_at` DATETIME(6),
+            `last_new_comments` INT NOT NULL  DEFAULT 0,
+            `error_count` INT NOT NULL  COMMENT '连续失败次数' DEFAULT 0,
+            KEY `idx_xhs_monitor_next_du_d918dd` (`next_due_at`)
+        ) CHARACTER SET utf8mb4 COMMENT='定时增量同步评论的笔记，轮询间隔随新增评论速度自适应';"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS `xhs_monitored_notes`;"""